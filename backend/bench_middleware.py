@@ -0,0 +1,158 @@
+"""
+Benchmark middleware stack của IVIE Wedding API (requests/giây)
+
+So sánh stack ASGI thuần hiện tại với stack cũ dựng bằng BaseHTTPMiddleware
+(Timing + Cache Control + response cache nối body bằng body += chunk), chạy
+trong process qua httpx.ASGITransport nên chỉ đo chi phí middleware + routing.
+
+Chạy:
+    python bench_middleware.py --requests 3000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from fastapi import FastAPI, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from ung_dung.cache_advanced import AdvancedCacheMiddleware, redis_client, response_cache
+from ung_dung.cache_utils import CACHE_NONE, CacheControlMiddleware, _cache_duration
+
+PAYLOAD = [{"id": i, "ten": f"Váy cưới mẫu {i}", "gia": 1_500_000 + i} for i in range(200)]
+
+
+# =============================================================================
+# STACK CŨ (BaseHTTPMiddleware)
+# =============================================================================
+
+
+class LegacyTimingMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        response = await call_next(request)
+        response.headers["X-Response-Time"] = f"{time.time() - start_time:.4f}s"
+        return response
+
+
+class LegacyCacheControlMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        if request.method != "GET":
+            response.headers["Cache-Control"] = "no-store"
+        elif _cache_duration(request.url.path) > CACHE_NONE:
+            response.headers["Cache-Control"] = "public, max-age=60"
+        elif "/api/" in request.url.path:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+class LegacyResponseCacheMiddleware(BaseHTTPMiddleware):
+    """Response cache cũ: lưu body chưa nén, hit đi qua GZipMiddleware phía ngoài"""
+
+    store = {}
+
+    async def dispatch(self, request: Request, call_next):
+        rule = response_cache.get_rule(request.url.path, request.method)
+        if rule is None:
+            return await call_next(request)
+        key = response_cache.generate_key(request)
+        cached = self.store.get(key)
+        if cached is not None:
+            return Response(
+                content=cached["body"],
+                status_code=cached["status_code"],
+                headers={**cached["headers"], "X-Cache": "HIT"},
+            )
+        response = await call_next(request)
+        body = b""
+        async for chunk in response.body_iterator:
+            body += chunk
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        self.store[key] = {"body": body, "status_code": response.status_code, "headers": headers}
+        return Response(content=body, status_code=response.status_code, headers=headers)
+
+
+# =============================================================================
+# APPS
+# =============================================================================
+
+
+def _routes(app: FastAPI) -> FastAPI:
+    @app.get("/api/banner")
+    def banners():
+        return PAYLOAD
+
+    @app.get("/api/khong_cache")
+    def uncached():
+        return PAYLOAD[:20]
+
+    return app
+
+
+def legacy_app() -> FastAPI:
+    app = _routes(FastAPI())
+    app.add_middleware(LegacyCacheControlMiddleware)
+    app.add_middleware(LegacyResponseCacheMiddleware)
+    app.add_middleware(GZipMiddleware, minimum_size=500)
+    app.add_middleware(LegacyTimingMiddleware)
+    return app
+
+
+def asgi_app() -> FastAPI:
+    from ung_dung.chinh_optimized import ResponseTimingMiddleware
+
+    app = _routes(FastAPI())
+    app.add_middleware(GZipMiddleware, minimum_size=500)
+    app.add_middleware(CacheControlMiddleware)
+    app.add_middleware(AdvancedCacheMiddleware)
+    app.add_middleware(ResponseTimingMiddleware)
+    return app
+
+
+# =============================================================================
+# ĐO
+# =============================================================================
+
+
+async def run(app: FastAPI, path: str, total: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    headers = {"accept-encoding": "gzip"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get(path, headers=headers)  # làm nóng cache
+        remaining = total
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                response = await client.get(path, headers=headers)
+                assert response.status_code == 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    redis_client.clear()
+    print(f"{'scenario':<28}{'before (req/s)':>16}{'after (req/s)':>16}{'speedup':>10}")
+    for label, path in (("cache hit /api/banner", "/api/banner"), ("pass-through", "/api/khong_cache")):
+        before = asyncio.run(run(legacy_app(), path, args.requests, args.concurrency))
+        after = asyncio.run(run(asgi_app(), path, args.requests, args.concurrency))
+        print(f"{label:<28}{before:>16.0f}{after:>16.0f}{after / before:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import os
 from dotenv import load_dotenv
+from ung_dung.db_engine import get_engine, normalize_url
 
 load_dotenv()
 
@@ -13,10 +14,10 @@ DUONG_DAN_CSDL = os.getenv(
 )
 
 # Render dùng postgres:// nhưng SQLAlchemy cần postgresql://
-if DUONG_DAN_CSDL.startswith("postgres://"):
-    DUONG_DAN_CSDL = DUONG_DAN_CSDL.replace("postgres://", "postgresql://", 1)
+DUONG_DAN_CSDL = normalize_url(DUONG_DAN_CSDL)
 
-dong_co = create_engine(DUONG_DAN_CSDL, echo=False, pool_pre_ping=True)
+# Cùng DATABASE_URL thì dùng chung engine (pool) với ung_dung.co_so_du_lieu
+dong_co = get_engine(DUONG_DAN_CSDL, name="pg")
 PhienLamViec = sessionmaker(autocommit=False, autoflush=False, bind=dong_co)
 CoSo = declarative_base()
 
@@ -11,17 +11,9 @@ echo "🚀 STARTING IVIE WEDDING BACKEND (FREE TIER)"
 echo "=================================================="
 date
 
-# Debug: Print system info
-echo "📂 Current Directory: $(pwd)"
-echo "📂 Directory Contents:"
-ls -la
-
 echo "🐍 Python Version:"
 python --version
 
-echo "📦 Installed Packages (Key components):"
-pip list | grep -E "fastapi|uvicorn|gunicorn|sqlalchemy|psycopg2" || echo "Packages checking skipped"
-
 # Set default values - OPTIMIZED FOR FREE TIER
 PORT=${PORT:-8000}
 WORKERS=${WEB_CONCURRENCY:-1}
@@ -41,27 +33,8 @@ else
     echo "   - DATABASE_URL: Not set (will use SQLite fallback)"
 fi
 
-# Wait for database to be ready (PostgreSQL)
-echo "⏳ Waiting for database connection..."
-sleep 5
-
-# Run database initialization/migrations
-echo "📦 Initializing database tables..."
-# Run with error handling
-if python -c "
-try:
-    from ung_dung.co_so_du_lieu import khoi_tao_csdl
-    print('🔄 Calling khoi_tao_csdl()...')
-    khoi_tao_csdl()
-    print('✅ Database initialized successfully')
-except Exception as e:
-    print(f'⚠️  Database initialization warning: {e}')
-    print('Tables may already exist. Continuing...')
-"; then
-    echo "✅ Database setup completed"
-else
-    echo "⚠️  Database setup warning. Continuing with startup..."
-fi
+# Migration chạy trong app ở thread nền (không chặn bind port);
+# Render chỉ chuyển traffic khi /ready trả 200
 
 # Create upload directory if not exists
 mkdir -p tep_tin
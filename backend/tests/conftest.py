@@ -0,0 +1,25 @@
+"""
+Cấu hình chung cho test backend (chạy: cd backend && python -m pytest)
+- Database SQLite tạm, đặt trước khi import ung_dung (engine tạo lúc import)
+- Băm mật khẩu trong threadpool với cost thấp cho nhanh
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_thu_muc_tam = tempfile.mkdtemp(prefix="ivie_test_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_thu_muc_tam, 'test.db')}"
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+
+@pytest.fixture
+def csdl_trong():
+    """Tạo bảng trước mỗi test, xóa sau khi xong"""
+    from ung_dung.co_so_du_lieu import CoSo, dong_co
+
+    CoSo.metadata.create_all(dong_co)
+    yield
+    CoSo.metadata.drop_all(dong_co)
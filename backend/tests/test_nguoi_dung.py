@@ -0,0 +1,39 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from ung_dung.bao_mat import bam_mat_khau, tao_token_truy_cap
+from ung_dung.co_so_du_lieu import NguoiDung, PhienLamViec
+from ung_dung.dinh_tuyen import nguoi_dung
+
+
+def _tao_user(username: str) -> None:
+    phien = PhienLamViec()
+    try:
+        phien.add(NguoiDung(username=username, hashed_password=bam_mat_khau("mat-khau-cu")))
+        phien.commit()
+    finally:
+        phien.close()
+
+
+def test_token_cu_khong_co_uid_het_hieu_luc_sau_khi_doi_mat_khau(csdl_trong):
+    ung_dung = FastAPI()
+    ung_dung.include_router(nguoi_dung.bo_dinh_tuyen)
+    _tao_user("khach_cu")
+
+    # Token phát hành trước khi có claim uid/ver: chỉ có sub
+    headers = {"Authorization": f"Bearer {tao_token_truy_cap({'sub': 'khach_cu'})}"}
+
+    with TestClient(ung_dung) as client:
+        phan_hoi = client.put("/api/nguoi_dung/cap_nhat", json={"password": "mat-khau-moi"}, headers=headers)
+        assert phan_hoi.status_code == 200
+        token_moi = phan_hoi.headers[nguoi_dung.ACCESS_TOKEN_HEADER]
+
+        phan_hoi = client.put("/api/nguoi_dung/cap_nhat", json={"full_name": "Khach"}, headers=headers)
+        assert phan_hoi.status_code == 401
+
+        phan_hoi = client.put(
+            "/api/nguoi_dung/cap_nhat",
+            json={"full_name": "Khach"},
+            headers={"Authorization": f"Bearer {token_moi}"},
+        )
+        assert phan_hoi.status_code == 200
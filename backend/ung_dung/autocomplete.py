@@ -0,0 +1,334 @@
+"""
+Autocomplete sản phẩm bằng prefix trie trong bộ nhớ cho IVIE Wedding Studio
+- Khóa: tên đã bỏ dấu (từ mọi vị trí bắt đầu của từ) và mã sản phẩm
+- Mỗi node giữ sẵn top-k sản phẩm theo độ phổ biến của cả cây con
+- Trả lời gợi ý bằng một lần duyệt trie, không truy vấn database
+- Cập nhật tăng dần qua product_events khi sản phẩm thay đổi
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import product_events
+from .tien_ich_chuoi import tach_tu
+
+logger = logging.getLogger(__name__)
+
+# Số gợi ý tối đa giữ ở mỗi node (>= limit lớn nhất của route)
+TOP_K = 20
+
+# Cắt khóa dài để giới hạn độ sâu trie
+MAX_KEY_LENGTH = 48
+
+# Cộng điểm phổ biến cho sản phẩm hot/mới
+HOT_BONUS = 5.0
+NEW_BONUS = 2.0
+
+# Build lại toàn bộ sau N giây để đồng bộ độ phổ biến (đơn hàng, yêu thích)
+MAX_AGE = int(os.getenv("AUTOCOMPLETE_MAX_AGE", "1800"))
+
+
+def _keys(name: str, code: str) -> Set[str]:
+    """Các khóa trie của một sản phẩm: hậu tố theo từ của tên + mã"""
+    keys: Set[str] = set()
+    words = tach_tu(name)
+    for i in range(len(words)):
+        keys.add(" ".join(words[i:])[:MAX_KEY_LENGTH])
+    code_key = "".join(tach_tu(code))
+    if code_key:
+        keys.add(code_key[:MAX_KEY_LENGTH])
+    return keys
+
+
+def _normalize_query(query: str) -> str:
+    """Bỏ dấu, gộp khoảng trắng; giữ nguyên từ cuối đang gõ dở"""
+    return " ".join(tach_tu(query))
+
+
+class _Node:
+    __slots__ = ("children", "ids", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.ids: Set[int] = set()  # sản phẩm có khóa kết thúc tại node này
+        self.top: List[int] = []  # top-k id của cả cây con
+
+
+class ProductAutocomplete:
+    """
+    Prefix trie với top-k theo độ phổ biến tại mỗi node.
+
+    Ghi (upsert/remove) tính lại top-k từ dưới lên dọc các đường đi bị ảnh
+    hưởng: top của node = top-k của (ids tại node ∪ top của các node con).
+    Ghi đến trong lúc build đọc database được phát lại lên trie mới.
+    """
+
+    def __init__(self, top_k: int = TOP_K, max_age: int = MAX_AGE):
+        self.top_k = top_k
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._build_lock = threading.RLock()
+        self._loaded = False
+        self._built_at = 0.0
+        # Tăng ở mỗi upsert/remove/invalidate; nhật ký ghi khi đang build
+        self._generation = 0
+        self._journal: Optional[List[Tuple[str, Any]]] = None
+        self._root = _Node()
+        self._products: Dict[int, Dict[str, Any]] = {}
+        self._keys: Dict[int, Set[str]] = {}
+        self._scores: Dict[int, float] = {}
+        self._base_popularity: Dict[int, float] = {}
+
+    # -------------------------------------------------------------------------
+    # Build / cập nhật
+    # -------------------------------------------------------------------------
+
+    def _is_stale(self) -> bool:
+        if not self._loaded:
+            return True
+        return self.max_age > 0 and time.time() - self._built_at > self.max_age
+
+    @staticmethod
+    def _load_popularity(csdl) -> Dict[int, float]:
+        """Độ phổ biến = số lượng đã đặt + số lượt yêu thích"""
+        from sqlalchemy import func
+
+        from .co_so_du_lieu import ChiTietDonHang, YeuThich
+
+        popularity: Dict[int, float] = {}
+        for product_id, total in (
+            csdl.query(ChiTietDonHang.product_id, func.sum(ChiTietDonHang.quantity))
+            .group_by(ChiTietDonHang.product_id)
+            .all()
+        ):
+            popularity[product_id] = popularity.get(product_id, 0.0) + float(total or 0)
+        for product_id, total in (
+            csdl.query(YeuThich.product_id, func.count(YeuThich.id))
+            .group_by(YeuThich.product_id)
+            .all()
+        ):
+            popularity[product_id] = popularity.get(product_id, 0.0) + float(total or 0)
+        return popularity
+
+    def build(self, csdl) -> int:
+        """
+        Build lại toàn bộ trie từ database.
+
+        Generation đổi trong lúc đọc thì phát lại nhật ký ghi; có invalidate
+        thì để chưa load (build lại lần sau).
+        """
+        from .co_so_du_lieu import SanPham as SanPhamDB
+
+        with self._build_lock:
+            with self._lock:
+                generation = self._generation
+                self._journal = []
+            try:
+                rows = csdl.query(
+                    SanPhamDB.id,
+                    SanPhamDB.name,
+                    SanPhamDB.code,
+                    SanPhamDB.category,
+                    SanPhamDB.is_hot,
+                    SanPhamDB.is_new,
+                ).all()
+                popularity = self._load_popularity(csdl)
+            except Exception:
+                with self._lock:
+                    self._journal = None
+                raise
+
+            with self._lock:
+                journal, self._journal = self._journal, None
+                self._root = _Node()
+                self._products = {}
+                self._keys = {}
+                self._scores = {}
+                self._base_popularity = popularity
+                for row in rows:
+                    self._insert(row._asdict(), recompute=False)
+                self._recompute_all(self._root)
+                fresh = self._replay(journal) if self._generation != generation else True
+                self._loaded = fresh
+                self._built_at = time.time()
+
+        logger.info(f"Autocomplete trie built: {len(rows)} products")
+        return len(rows)
+
+    def ensure_loaded(self, csdl) -> None:
+        """Build trie nếu chưa có hoặc đã quá MAX_AGE"""
+        if self._is_stale():
+            with self._build_lock:
+                if self._is_stale():
+                    self.build(csdl)
+
+    def _score(self, product: Dict[str, Any]) -> float:
+        score = self._base_popularity.get(product["id"], 0.0)
+        if product.get("is_hot"):
+            score += HOT_BONUS
+        if product.get("is_new"):
+            score += NEW_BONUS
+        return score
+
+    def _rank(self, product_id: int) -> Tuple[float, int]:
+        return (-self._scores[product_id], -product_id)
+
+    def _recompute(self, node: _Node) -> None:
+        candidates: Set[int] = set(node.ids)
+        for child in node.children.values():
+            candidates.update(child.top)
+        node.top = sorted(candidates, key=self._rank)[: self.top_k]
+
+    def _recompute_all(self, node: _Node) -> None:
+        # Duyệt hậu thứ tự bằng stack để tránh đệ quy sâu
+        stack: List[Tuple[_Node, bool]] = [(node, False)]
+        while stack:
+            current, visited = stack.pop()
+            if visited:
+                self._recompute(current)
+            else:
+                stack.append((current, True))
+                stack.extend((child, False) for child in current.children.values())
+
+    def _path(self, key: str, create: bool) -> List[_Node]:
+        node = self._root
+        path = [node]
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    break
+                child = node.children[char] = _Node()
+            node = child
+            path.append(node)
+        return path
+
+    def _insert(self, product: Dict[str, Any], recompute: bool = True) -> None:
+        product_id = product["id"]
+        keys = _keys(product.get("name") or "", product.get("code") or "")
+        self._products[product_id] = {
+            "id": product_id,
+            "name": product.get("name"),
+            "code": product.get("code"),
+            "category": product.get("category"),
+        }
+        self._keys[product_id] = keys
+        self._scores[product_id] = self._score(product)
+        for key in keys:
+            path = self._path(key, create=True)
+            path[-1].ids.add(product_id)
+            if recompute:
+                for node in reversed(path):
+                    self._recompute(node)
+
+    def _delete(self, product_id: int) -> None:
+        keys = self._keys.pop(product_id, None)
+        if keys is None:
+            return
+        for key in keys:
+            path = self._path(key, create=False)
+            if len(path) == len(key) + 1:
+                path[-1].ids.discard(product_id)
+            # Tính lại từ dưới lên, bỏ các node rỗng
+            for depth in range(len(path) - 1, -1, -1):
+                node = path[depth]
+                self._recompute(node)
+                if depth > 0 and not node.ids and not node.children:
+                    del path[depth - 1].children[key[depth - 1]]
+        self._products.pop(product_id, None)
+        self._scores.pop(product_id, None)
+
+    def _log_write(self, op: str, arg: Any) -> None:
+        # Gọi khi đang giữ _lock
+        self._generation += 1
+        if self._journal is not None:
+            self._journal.append((op, arg))
+
+    def _replay(self, journal: List[Tuple[str, Any]]) -> bool:
+        """Phát lại ghi trong lúc build; False nếu có invalidate"""
+        fresh = True
+        for op, arg in journal:
+            if op == "upsert":
+                for row in arg:
+                    self._delete(row["id"])
+                    self._insert(row)
+            elif op == "remove":
+                for product_id in arg:
+                    self._delete(product_id)
+            else:
+                fresh = False
+        return fresh
+
+    def upsert_products(self, products: Iterable[Any]) -> None:
+        rows = [
+            {
+                "id": p.id,
+                "name": p.name,
+                "code": p.code,
+                "category": p.category,
+                "is_hot": p.is_hot,
+                "is_new": p.is_new,
+            }
+            for p in products
+        ]
+        with self._lock:
+            self._log_write("upsert", rows)
+            if not self._loaded:
+                return
+            for row in rows:
+                self._delete(row["id"])
+                self._insert(row)
+
+    def remove_products(self, ids: Iterable[int]) -> None:
+        ids = list(ids)
+        with self._lock:
+            self._log_write("remove", ids)
+            for product_id in ids:
+                self._delete(product_id)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._log_write("invalidate", None)
+            self._loaded = False
+
+    # -------------------------------------------------------------------------
+    # Truy vấn
+    # -------------------------------------------------------------------------
+
+    def suggest(self, query: str, limit: int = 10, csdl=None) -> List[Dict[str, Any]]:
+        """
+        Gợi ý sản phẩm có tên (từ bất kỳ vị trí đầu từ) hoặc mã bắt đầu bằng query.
+
+        Args:
+            csdl: Session dùng để build trie nếu chưa có (optional)
+        """
+        if csdl is not None:
+            self.ensure_loaded(csdl)
+
+        key = _normalize_query(query)
+        if not key:
+            return []
+        key = key[:MAX_KEY_LENGTH]
+
+        with self._lock:
+            if not self._loaded:
+                raise RuntimeError("Autocomplete trie chưa được build")
+            path = self._path(key, create=False)
+            if len(path) != len(key) + 1:
+                return []
+            return [self._products[pid] for pid in path[-1].top[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "products": len(self._products),
+                "built_at": self._built_at,
+            }
+
+
+# Global autocomplete instance
+product_autocomplete = product_events.register(ProductAutocomplete())
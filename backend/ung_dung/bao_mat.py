@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
-from typing import Any, Union
-from jose import jwt
-from passlib.context import CryptContext
+from typing import Any, Optional, Tuple, Union
+from functools import lru_cache
+from jose import jwk, jwt
 import os
 import hashlib
 import base64
@@ -14,26 +14,54 @@ bi_mat = os.getenv("SECRET_KEY", "ivie_wedding_secret_key_super_secure_123")
 thuat_toan = "HS256"
 thoi_gian_het_han_phut = 60 * 24 * 7 # 7 ngày
 
-ngu_canh_mat_khau = CryptContext(
-    schemes=["bcrypt"], 
-    deprecated="auto",
-    bcrypt__rounds=12,
-    bcrypt__ident="2b"
-)
+# Cost bcrypt: đổi giá trị thì mật khẩu cũ được băm lại khi user đăng nhập
+so_vong_bcrypt = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# hashed_password của tài khoản không dùng mật khẩu (Google/Facebook):
+# không phải mã bcrypt nên không mật khẩu nào khớp
+MAT_KHAU_KHONG_DUNG = "!"
+
+# Khóa ký/kiểm tra JWT dựng sẵn một lần (jose không phải parse lại secret mỗi request)
+khoa_jwt = jwk.construct(bi_mat, thuat_toan)
+
+# Vai trò trong claim "role" (tài khoản đăng nhập hiện chỉ có khách hàng)
+VAI_TRO_KHACH_HANG = "customer"
+
+@lru_cache(maxsize=None)
+def ngu_canh_mat_khau():
+    """CryptContext bcrypt, tạo khi băm/kiểm tra mật khẩu lần đầu (passlib không nằm trên đường khởi động)"""
+    from passlib.context import CryptContext
+
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=so_vong_bcrypt,
+        bcrypt__ident="2b"
+    )
+
+def _chuan_hoa(mat_khau: str) -> str:
+    # Hash password with SHA256 and encode to base64 to ensure it's within bcrypt's 72 byte limit
+    mat_khau_sha = hashlib.sha256(mat_khau.encode('utf-8')).digest()
+    return base64.b64encode(mat_khau_sha).decode('utf-8')
 
 def xac_minh_mat_khau(mat_khau_tho: str, mat_khau_bam: str) -> bool:
     """Kiểm tra mật khẩu khớp với mã băm"""
-    # Hash password with SHA256 and encode to base64 to ensure it's within bcrypt's 72 byte limit
-    mat_khau_sha = hashlib.sha256(mat_khau_tho.encode('utf-8')).digest()
-    mat_khau_b64 = base64.b64encode(mat_khau_sha).decode('utf-8')
-    return ngu_canh_mat_khau.verify(mat_khau_b64, mat_khau_bam)
+    return xac_minh_va_cap_nhat(mat_khau_tho, mat_khau_bam)[0]
+
+def xac_minh_va_cap_nhat(mat_khau_tho: str, mat_khau_bam: str) -> Tuple[bool, Optional[str]]:
+    """
+    Kiểm tra mật khẩu; nếu khớp nhưng mã băm dùng cost cũ thì băm lại.
+
+    Returns:
+        (khớp, mã băm mới hoặc None nếu không cần lưu lại)
+    """
+    if not mat_khau_bam or mat_khau_bam == MAT_KHAU_KHONG_DUNG:
+        return False, None
+    return ngu_canh_mat_khau().verify_and_update(_chuan_hoa(mat_khau_tho), mat_khau_bam)
 
 def bam_mat_khau(mat_khau: str) -> str:
     """Tạo mã băm cho mật khẩu"""
-    # Hash password with SHA256 and encode to base64 to ensure it's within bcrypt's 72 byte limit
-    mat_khau_sha = hashlib.sha256(mat_khau.encode('utf-8')).digest()
-    mat_khau_b64 = base64.b64encode(mat_khau_sha).decode('utf-8')
-    return ngu_canh_mat_khau.hash(mat_khau_b64)
+    return ngu_canh_mat_khau().hash(_chuan_hoa(mat_khau))
 
 def tao_token_truy_cap(du_lieu: dict, het_han_sau: Union[timedelta, None] = None) -> str:
     """Tạo JWT Token"""
@@ -44,5 +72,18 @@ def tao_token_truy_cap(du_lieu: dict, het_han_sau: Union[timedelta, None] = None
         het_han = datetime.utcnow() + timedelta(minutes=thoi_gian_het_han_phut)
     
     copy_du_lieu.update({"exp": het_han})
-    encoded_jwt = jwt.encode(copy_du_lieu, bi_mat, algorithm=thuat_toan)
+    encoded_jwt = jwt.encode(copy_du_lieu, khoa_jwt, algorithm=thuat_toan)
     return encoded_jwt
+
+def tao_token_nguoi_dung(user) -> str:
+    """JWT cho user: sub (username), uid, role và ver (token_version)"""
+    return tao_token_truy_cap({
+        "sub": user.username,
+        "uid": user.id,
+        "role": VAI_TRO_KHACH_HANG,
+        "ver": user.token_version or 0,
+    })
+
+def giai_ma_token(token: str) -> dict:
+    """Kiểm tra chữ ký / hạn và trả claims (JWTError nếu không hợp lệ)"""
+    return jwt.decode(token, khoa_jwt, algorithms=[thuat_toan])
@@ -0,0 +1,361 @@
+"""
+Cache trong bộ nhớ có giới hạn cho IVIE Wedding Studio
+- Giới hạn theo số entry và tổng dung lượng (bytes ước lượng)
+- Chính sách loại bỏ: LRU hoặc W-TinyLFU (window LRU + admission theo tần suất)
+- Hết hạn TTL bằng min-heap, dọn dần trong các thao tác ghi/đọc
+- Bộ đếm hits/misses/evictions/expirations/rejections để giám sát
+- Dùng cho fallback cache của RedisClient và QueryCache
+"""
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+POLICY_LRU = "lru"
+POLICY_TINYLFU = "tinylfu"
+
+# Số entry hết hạn tối đa dọn trong một thao tác (giữ độ trễ ổn định)
+_PURGE_BATCH = 64
+
+_MISSING = object()
+
+# estimate_size: số cấp lồng nhau tối đa, số phần tử lấy mẫu mỗi container,
+# phụ phí mỗi phần tử/số (gần với độ dài khi serialize, không phải sizeof)
+_SIZE_MAX_DEPTH = 4
+_SIZE_SAMPLE = 8
+_SIZE_ITEM = 8
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Ước lượng nhanh dung lượng của value (bytes), không serialize.
+
+    Container lớn chỉ đo _SIZE_SAMPLE phần tử đầu rồi nhân theo số phần tử;
+    caller đã có payload đã serialize thì truyền size=len(payload) cho set().
+    """
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return len(value)
+    if value is None or isinstance(value, (bool, int, float)):
+        return _SIZE_ITEM
+    if _depth >= _SIZE_MAX_DEPTH:
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        count = len(value)
+        sample = sum(
+            estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+            for k, v in itertools.islice(value.items(), _SIZE_SAMPLE)
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        count = len(value)
+        sample = sum(
+            estimate_size(item, _depth + 1) for item in itertools.islice(value, _SIZE_SAMPLE)
+        )
+    elif hasattr(value, "__dict__"):
+        return estimate_size(vars(value), _depth)
+    else:
+        return sys.getsizeof(value)
+    if count > _SIZE_SAMPLE:
+        sample = sample * count // _SIZE_SAMPLE
+    return sample + _SIZE_ITEM * (count + 1)
+
+
+class CountMinSketch:
+    """
+    Ước lượng tần suất truy cập cho TinyLFU.
+
+    4 hàng bộ đếm bão hòa ở 15; sau sample_size lần ghi nhận thì chia đôi
+    tất cả (aging) để tần suất cũ phai dần.
+    """
+
+    DEPTH = 4
+    MAX_COUNT = 15
+
+    def __init__(self, capacity: int):
+        width = 16
+        while width < capacity * 4:
+            width <<= 1
+        self._mask = width - 1
+        self._rows = [bytearray(width) for _ in range(self.DEPTH)]
+        self._seeds = [0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F]
+        self.sample_size = max(10 * capacity, 100)
+        self._additions = 0
+
+    def _indexes(self, key: Any) -> Iterator[Tuple[bytearray, int]]:
+        h = hash(key)
+        for row, seed in zip(self._rows, self._seeds):
+            yield row, ((h ^ seed) * 0x01000193 >> 7) & self._mask
+
+    def increment(self, key: Any) -> None:
+        for row, index in self._indexes(key):
+            if row[index] < self.MAX_COUNT:
+                row[index] += 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._reset()
+
+    def frequency(self, key: Any) -> int:
+        return min(row[index] for row, index in self._indexes(key))
+
+    def _reset(self) -> None:
+        self._additions //= 2
+        for row in self._rows:
+            for i in range(len(row)):
+                row[i] >>= 1
+
+
+class _Item:
+    __slots__ = ("value", "expires_at", "size")
+
+    def __init__(self, value: Any, expires_at: Optional[float], size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class BoundedCache:
+    """
+    Cache key-value thread-safe với giới hạn entry/bytes và TTL.
+
+    LRU: một OrderedDict, loại entry ít dùng gần đây nhất.
+    W-TinyLFU: entry mới vào window LRU nhỏ (~1%); entry rời window chỉ
+    được nhận vào vùng chính nếu tần suất (CountMinSketch) cao hơn entry
+    sắp bị loại của vùng chính, nên key quét một lần không đẩy key nóng ra.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        policy: str = POLICY_TINYLFU,
+        default_ttl: Optional[float] = None,
+        sizeof: Callable[[Any], int] = estimate_size,
+    ):
+        if policy not in (POLICY_LRU, POLICY_TINYLFU):
+            raise ValueError(f"Unknown cache policy: {policy}")
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.default_ttl = default_ttl
+        self._sizeof = sizeof
+        self._lock = threading.RLock()
+        self._main: "OrderedDict[str, _Item]" = OrderedDict()
+        self._window: "OrderedDict[str, _Item]" = OrderedDict()
+        self._window_max = max(1, self.max_entries // 100) if policy == POLICY_TINYLFU else 0
+        self._sketch = CountMinSketch(self.max_entries) if policy == POLICY_TINYLFU else None
+        self._expiry_heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejections = 0
+
+    # -------------------------------------------------------------------------
+    # Nội bộ
+    # -------------------------------------------------------------------------
+
+    def _find(self, key: str) -> Optional[_Item]:
+        item = self._main.get(key)
+        if item is None:
+            item = self._window.get(key)
+        return item
+
+    def _drop(self, key: str) -> Optional[_Item]:
+        item = self._main.pop(key, None)
+        if item is None:
+            item = self._window.pop(key, None)
+        if item is not None:
+            self._bytes -= item.size
+        return item
+
+    def _touch(self, key: str) -> None:
+        if key in self._main:
+            self._main.move_to_end(key)
+        elif key in self._window:
+            self._window.move_to_end(key)
+
+    def _purge(self, limit: Optional[int] = _PURGE_BATCH) -> int:
+        """Xóa các entry đã hết hạn ở đỉnh heap"""
+        now = time.monotonic()
+        purged = 0
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now and (limit is None or purged < limit):
+            expires_at, _, key = heapq.heappop(heap)
+            item = self._find(key)
+            # Bỏ qua bản ghi heap cũ (key đã bị ghi đè với hạn khác)
+            if item is not None and item.expires_at == expires_at:
+                self._drop(key)
+                self.expirations += 1
+                purged += 1
+        # Heap chứa nhiều bản ghi cũ: dựng lại để không phình bộ nhớ
+        if len(heap) > 2 * (len(self._main) + len(self._window)) + 64:
+            self._expiry_heap = [
+                (item.expires_at, next(self._seq), key)
+                for store in (self._main, self._window)
+                for key, item in store.items()
+                if item.expires_at is not None
+            ]
+            heapq.heapify(self._expiry_heap)
+        return purged
+
+    def _evict_one(self) -> bool:
+        store = self._main if self._main else self._window
+        if not store:
+            return False
+        _, item = store.popitem(last=False)
+        self._bytes -= item.size
+        self.evictions += 1
+        return True
+
+    def _admit_from_window(self) -> None:
+        """W-TinyLFU: chuyển entry rời window sang vùng chính nếu thắng victim"""
+        main_max = self.max_entries - self._window_max
+        while len(self._window) > self._window_max:
+            key, item = self._window.popitem(last=False)
+            if len(self._main) < main_max:
+                self._main[key] = item
+                continue
+            victim_key = next(iter(self._main))
+            if self._sketch.frequency(key) > self._sketch.frequency(victim_key):
+                victim = self._main.pop(victim_key)
+                self._bytes -= victim.size
+                self.evictions += 1
+                self._main[key] = item
+            else:
+                self._bytes -= item.size
+                self.rejections += 1
+
+    def _enforce_limits(self) -> None:
+        if self.policy == POLICY_TINYLFU:
+            self._admit_from_window()
+        while (
+            len(self._main) + len(self._window) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            if not self._evict_one():
+                break
+
+    # -------------------------------------------------------------------------
+    # API
+    # -------------------------------------------------------------------------
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Lấy value còn hạn, cập nhật thứ tự/tần suất truy cập"""
+        with self._lock:
+            if self._sketch is not None:
+                self._sketch.increment(key)
+            item = self._find(key)
+            if item is not None and item.expires_at is not None:
+                if item.expires_at <= time.monotonic():
+                    self._drop(key)
+                    self.expirations += 1
+                    item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._touch(key)
+            self.hits += 1
+            return item.value
+
+    def set(
+        self, key: str, value: Any, ttl: Optional[float] = _MISSING, size: Optional[int] = None
+    ) -> bool:
+        """
+        Lưu value với TTL (giây). ttl=None: không hết hạn; bỏ trống: default_ttl.
+
+        size: dung lượng đã biết (vd. độ dài payload Redis); None thì ước lượng
+
+        Returns:
+            False nếu value lớn hơn max_bytes (không lưu)
+        """
+        if ttl is _MISSING:
+            ttl = self.default_ttl
+        if size is None:
+            size = self._sizeof(value)
+        with self._lock:
+            self._purge()
+            was_main = key in self._main
+            self._drop(key)
+            if size > self.max_bytes:
+                self.rejections += 1
+                return False
+            if self._sketch is not None:
+                self._sketch.increment(key)
+
+            expires_at = time.monotonic() + ttl if ttl is not None else None
+            item = _Item(value, expires_at, size)
+            if self.policy == POLICY_TINYLFU and not was_main:
+                self._window[key] = item
+            else:
+                self._main[key] = item
+            self._bytes += size
+            if expires_at is not None:
+                heapq.heappush(self._expiry_heap, (expires_at, next(self._seq), key))
+            self._enforce_limits()
+            return True
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._drop(key) is not None
+
+    def contains(self, key: str) -> bool:
+        """Key tồn tại và còn hạn (không tính là một lần truy cập)"""
+        with self._lock:
+            item = self._find(key)
+            if item is None:
+                return False
+            if item.expires_at is not None and item.expires_at <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                return False
+            return True
+
+    def remaining_ttl(self, key: str) -> Optional[float]:
+        """Số giây còn lại; None nếu không hết hạn; -1 nếu không có key"""
+        with self._lock:
+            if not self.contains(key):
+                return -1
+            item = self._find(key)
+            if item.expires_at is None:
+                return None
+            return max(0.0, item.expires_at - time.monotonic())
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._window) + list(self._main)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._main.clear()
+            self._window.clear()
+            self._expiry_heap.clear()
+            self._bytes = 0
+
+    def purge_expired(self) -> int:
+        """Dọn toàn bộ entry đã hết hạn"""
+        with self._lock:
+            return self._purge(limit=None)
+
+    def __len__(self) -> int:
+        return len(self._main) + len(self._window)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "policy": self.policy,
+                "entries": len(self._main) + len(self._window),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": f"{(self.hits / total * 100) if total else 0:.2f}%",
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rejections": self.rejections,
+            }
@@ -5,22 +5,40 @@ Advanced Caching Layer cho IVIE Wedding Studio
 - Cache invalidation strategies
 - TTL management và auto-cleanup
 - Cache statistics và monitoring
+- Single-flight, stale-while-revalidate và XFetch refresh sớm
 """
 
 import asyncio
+import contextvars
+import gzip
 import hashlib
 import json
 import logging
+import math
 import os
-import pickle
+import random
 import threading
 import time
-from datetime import datetime, timedelta
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
 from functools import wraps
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import product_events
+from .bounded_cache import BoundedCache
+from .cache_codec import KIND_VALUE, CacheCodec, CodecError, to_plain
+from .near_cache import MISSING, LocalBroker, NearCache, RedisPubSubBroker
+from .route_rules import RouteMatcher
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
@@ -40,6 +58,39 @@ CACHE_TTL = {
     "DAY": 86400,  # 1 ngày - rarely changing
 }
 
+# Single-flight: thời gian tối đa (giây) một caller chờ caller đang tính
+# cùng key trước khi tự tính; lock Redis (cross-process) hết hạn sau LOCK_TTL
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "30"))
+SINGLE_FLIGHT_LOCK_TTL = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "30"))
+
+# Stale-while-revalidate / XFetch: beta > 0 bật refresh sớm xác suất khi gần
+# hết soft TTL (beta càng lớn càng refresh sớm), 0 = tắt
+XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))
+REFRESH_WORKERS = int(os.getenv("CACHE_REFRESH_WORKERS", "4"))
+
+# Giới hạn fallback cache trong bộ nhớ (khi không có Redis)
+FALLBACK_CACHE_MAX_ENTRIES = int(os.getenv("FALLBACK_CACHE_MAX_ENTRIES", "10000"))
+FALLBACK_CACHE_MAX_MB = float(os.getenv("FALLBACK_CACHE_MAX_MB", "64"))
+FALLBACK_CACHE_POLICY = os.getenv("FALLBACK_CACHE_POLICY", "tinylfu")
+
+# Near cache (L1) trong mỗi worker trước Redis, đồng bộ qua kênh pub/sub
+NEAR_CACHE_ENABLED = os.getenv("NEAR_CACHE_ENABLED", "true").lower() == "true"
+NEAR_CACHE_TTL = float(os.getenv("NEAR_CACHE_TTL", "5"))
+NEAR_CACHE_MAX_ENTRIES = int(os.getenv("NEAR_CACHE_MAX_ENTRIES", "2000"))
+NEAR_CACHE_MAX_MB = float(os.getenv("NEAR_CACHE_MAX_MB", "16"))
+NEAR_CACHE_CHANNEL = os.getenv("NEAR_CACHE_CHANNEL", "cache:invalidate")
+
+# Response cache: nén sẵn gzip/br một lần khi lưu (body >= MIN_BYTES)
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "500"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "9"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "9"))
+
+# Cache warmup: chạy các warmer đã đăng ký khi app sẵn sàng rồi mỗi INTERVAL
+# giây; entry còn hơn 2 * INTERVAL giây tới soft TTL thì không render lại
+CACHE_WARMUP_ENABLED = os.getenv("CACHE_WARMUP_ENABLED", "true").lower() == "true"
+CACHE_WARMUP_INTERVAL = float(os.getenv("CACHE_WARMUP_INTERVAL", "240"))
+CACHE_WARMUP_CONCURRENCY = int(os.getenv("CACHE_WARMUP_CONCURRENCY", "4"))
+
 # Cache keys patterns
 CACHE_KEYS = {
     "PRODUCTS": "products",
@@ -56,22 +107,133 @@ CACHE_KEYS = {
     "ORDERS": "orders:{user_id}",
 }
 
+# Cache tags: mỗi key cache được ghi vào set "tag:{tag}" của các entity nó
+# phụ thuộc; invalidation xóa đúng các thành viên của set thay vì SCAN
+CACHE_TAGS = {
+    "PRODUCTS": "products",  # mọi cache có dữ liệu sản phẩm
+    "PRODUCT_LISTS": "products:list",  # danh sách, danh mục, thống kê, gợi ý
+    "PRODUCT": "product:{id}",
+    "CATEGORIES": "categories",
+    "BANNERS": "banners",
+    "BLOGS": "blogs",
+    "GALLERY": "gallery",
+    "EXPERTS": "experts",
+    "COMBOS": "combos",
+    "CONTENT": "content",
+    "STATS": "stats",
+    "ORDERS": "orders",
+    "USER_ORDERS": "orders:{user_id}",
+}
+TAG_KEY_PREFIX = "tag:"
+
+
+# =============================================================================
+# CACHE ENTRY (SOFT TTL METADATA)
+# =============================================================================
+
+
+class CacheEntry:
+    """
+    Giá trị cache kèm metadata cho stale-while-revalidate.
+
+    - soft_expires: mốc (epoch) sau đó giá trị được coi là cũ; key vẫn sống
+      tới hard TTL = soft TTL + stale TTL
+    - delta: thời gian tính lại lần trước (giây), dùng cho XFetch
+    """
+
+    __slots__ = ("value", "soft_expires", "delta")
+
+    def __init__(self, value: Any, soft_expires: float, delta: float = 0.0):
+        self.value = value
+        self.soft_expires = soft_expires
+        self.delta = delta
+
+    def is_fresh(self, beta: float = XFETCH_BETA) -> bool:
+        """
+        Còn tươi hay cần refresh.
+
+        XFetch: now - delta * beta * ln(rand) >= soft_expires thì refresh sớm,
+        xác suất tăng dần khi càng gần hạn và khi tính lại càng tốn thời gian.
+        """
+        now = time.time()
+        if beta > 0 and self.delta > 0:
+            now -= self.delta * beta * math.log(1.0 - random.random())
+        return now < self.soft_expires
+
+    def is_stale(self) -> bool:
+        """Đã quá soft TTL (đang trong khoảng stale)"""
+        return time.time() >= self.soft_expires
+
+    def remaining(self) -> int:
+        """Số giây còn lại tới soft TTL"""
+        return max(0, int(self.soft_expires - time.time()))
+
+
+def _unwrap(value: Any) -> Any:
+    return value.value if isinstance(value, CacheEntry) else value
+
+
+# Loại payload codec của CacheEntry: [value, soft_expires, delta]
+KIND_ENTRY = 1
+
 
 # =============================================================================
 # REDIS CLIENT (với fallback)
 # =============================================================================
 
+# Xóa lock chỉ khi token khớp (không nhả nhầm lock của process khác)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Xóa mọi thành viên của các tag set (KEYS) và chính các set trong một lệnh;
+# trả về {số key đã xóa, danh sách thành viên} (để báo near cache)
+_INVALIDATE_TAGS_SCRIPT = """
+local deleted = 0
+local keys = {}
+for _, tag in ipairs(KEYS) do
+    local members = redis.call("smembers", tag)
+    for i = 1, #members, 1000 do
+        deleted = deleted + redis.call("del", unpack(members, i, math.min(i + 999, #members)))
+    end
+    for _, member in ipairs(members) do
+        keys[#keys + 1] = member
+    end
+    redis.call("del", tag)
+end
+return {deleted, keys}
+"""
+
+
+def _tag_key(tag: str) -> str:
+    return f"{TAG_KEY_PREFIX}{tag}"
+
 
 class RedisClient:
     """
     Redis client wrapper với automatic fallback về in-memory cache.
+
+    Khi có Redis, near cache (L1) trong process trả các key nóng không cần
+    round trip; mọi ghi/xóa đều publish invalidation cho các process khác.
     """
 
     def __init__(self):
         self._redis = None
         self._connected = False
-        self._fallback_cache: Dict[str, Dict[str, Any]] = {}
+        self._fallback_cache = BoundedCache(
+            max_entries=FALLBACK_CACHE_MAX_ENTRIES,
+            max_bytes=int(FALLBACK_CACHE_MAX_MB * 1024 * 1024),
+            policy=FALLBACK_CACHE_POLICY,
+        )
         self._lock = threading.RLock()
+        # Fallback tag index: tag -> keys (key đã bị loại/hết hạn dọn dần)
+        self._fallback_tags: Dict[str, set] = {}
+        self._near: Optional[NearCache] = None
+        self._scripts: Dict[str, Any] = {}
+        self._codec = CacheCodec()
         self._connect()
 
     def _connect(self):
@@ -84,7 +246,7 @@ class RedisClient:
 
                 self._redis = redis.from_url(
                     redis_url,
-                    decode_responses=False,  # Để hỗ trợ pickle
+                    decode_responses=False,  # Giá trị là bytes của CacheCodec
                     socket_timeout=5,
                     socket_connect_timeout=5,
                     retry_on_timeout=True,
@@ -94,6 +256,8 @@ class RedisClient:
                 self._redis.ping()
                 self._connected = True
                 logger.info("✅ Redis connected successfully")
+                if NEAR_CACHE_ENABLED and NEAR_CACHE_TTL > 0:
+                    self.enable_near_cache()
             except Exception as e:
                 logger.warning(f"⚠️ Redis connection failed, using fallback: {e}")
                 self._redis = None
@@ -106,66 +270,199 @@ class RedisClient:
         """Kiểm tra Redis có connected không"""
         return self._connected and self._redis is not None
 
+    def enable_near_cache(self, broker=None) -> NearCache:
+        """
+        Bật near cache L1.
+
+        broker: kênh invalidation (mặc định Redis pub/sub NEAR_CACHE_CHANNEL);
+        truyền LocalBroker để chạy nhiều "worker" trong một process
+        """
+        if self._near is not None:
+            self._near.close()
+        if broker is None:
+            broker = RedisPubSubBroker(self._redis, NEAR_CACHE_CHANNEL)
+        self._near = NearCache(
+            broker,
+            ttl=NEAR_CACHE_TTL,
+            max_entries=NEAR_CACHE_MAX_ENTRIES,
+            max_bytes=int(NEAR_CACHE_MAX_MB * 1024 * 1024),
+        )
+        return self._near
+
+    def broker(self, channel: str):
+        """Kênh pub/sub: Redis khi đã kết nối (mọi worker/instance), ngược lại trong process"""
+        if self.is_connected:
+            return RedisPubSubBroker(self._redis, channel)
+        return LocalBroker()
+
+    def disable_near_cache(self) -> None:
+        if self._near is not None:
+            self._near.close()
+            self._near = None
+
     def _serialize(self, value: Any) -> bytes:
-        """Serialize value để lưu"""
-        return pickle.dumps(value)
+        """Serialize value để lưu (CacheCodec, value đã ở dạng thuần)"""
+        if isinstance(value, CacheEntry):
+            return self._codec.dumps([value.value, value.soft_expires, value.delta], KIND_ENTRY)
+        return self._codec.dumps(value)
 
     def _deserialize(self, data: bytes) -> Any:
-        """Deserialize value từ cache"""
+        """
+        Deserialize value từ cache.
+        Entry không đọc được (format/schema cũ) được coi là miss.
+        """
         if data is None:
             return None
-        return pickle.loads(data)
+        if data.isdigit():
+            return int(data)  # Counter lưu bằng INCR
+        try:
+            kind, value = self._codec.loads(data)
+        except CodecError as e:
+            logger.debug(f"Cache entry skipped: {e}")
+            return None
+        if kind == KIND_ENTRY:
+            return CacheEntry(*value)
+        return value if kind == KIND_VALUE else None
 
     def get(self, key: str) -> Optional[Any]:
         """Lấy giá trị từ cache"""
+        return _unwrap(self._get_raw(key))
+
+    def _get_raw(self, key: str) -> Optional[Any]:
         if self.is_connected:
+            near = self._near
+            if near is not None:
+                value = near.get(key)
+                if value is not MISSING:
+                    return value
+                generation = near.begin()
             try:
                 data = self._redis.get(key)
-                return self._deserialize(data)
+                value = self._deserialize(data)
+                if near is not None:
+                    near.fill(key, value, generation, size=len(data) if data else None)
+                return value
             except Exception as e:
                 logger.error(f"Redis GET error: {e}")
 
         # Fallback
-        with self._lock:
-            if key in self._fallback_cache:
-                item = self._fallback_cache[key]
-                if datetime.now() < item["expires"]:
-                    return item["value"]
-                del self._fallback_cache[key]
-        return None
-
-    def set(self, key: str, value: Any, ttl: int = 300) -> bool:
-        """Lưu giá trị vào cache"""
+        return self._fallback_cache.get(key)
+
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        """
+        Lấy giá trị kèm metadata soft TTL.
+        Giá trị lưu bằng set() thường được coi là luôn tươi.
+        """
+        value = self._get_raw(key)
+        if value is None or isinstance(value, CacheEntry):
+            return value
+        return CacheEntry(value, float("inf"))
+
+    def set_entry(
+        self,
+        key: str,
+        value: Any,
+        ttl: int = 300,
+        stale_ttl: int = 0,
+        delta: float = 0.0,
+        tags: Optional[List[str]] = None,
+    ) -> bool:
+        """
+        Lưu giá trị với soft TTL = ttl, hard TTL = ttl + stale_ttl.
+        Trong khoảng stale, người đọc nhận giá trị cũ trong khi refresh nền.
+        """
+        entry = CacheEntry(to_plain(value), time.time() + ttl, delta)
+        return self.set(key, entry, ttl + max(0, stale_ttl), tags)
+
+    def set(self, key: str, value: Any, ttl: int = 300, tags: Optional[List[str]] = None) -> bool:
+        """
+        Lưu giá trị vào cache.
+
+        tags: đăng ký key vào các tag set để invalidate_tags() xóa chính xác
+
+        Value được chuyển về dạng thuần (ORM -> dict...) trước khi lưu ở mọi
+        tầng, nên giá trị đọc lại giống nhau dù từ Redis, L1 hay fallback.
+        """
+        if not isinstance(value, CacheEntry):
+            value = to_plain(value)
         if self.is_connected:
             try:
-                self._redis.setex(key, ttl, self._serialize(value))
+                data = self._serialize(value)
+            except TypeError as e:
+                logger.warning(f"Cache SET skipped for {key}: {e}")
+                return False
+            try:
+                if not tags:
+                    self._redis.setex(key, ttl, data)
+                    if self._near is not None:
+                        self._near.put(key, value, ttl, size=len(data))
+                    return True
+                # Tag set sống ít nhất bằng key thành viên
+                tag_ttl = max(ttl, CACHE_TTL["DAY"])
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.setex(key, ttl, data)
+                for tag in tags:
+                    pipe.sadd(_tag_key(tag), key)
+                    pipe.expire(_tag_key(tag), tag_ttl)
+                pipe.execute()
+                if self._near is not None:
+                    self._near.put(key, value, ttl, size=len(data))
                 return True
             except Exception as e:
                 logger.error(f"Redis SET error: {e}")
 
         # Fallback
+        stored = self._fallback_cache.set(key, value, ttl)
+        if stored and tags:
+            with self._lock:
+                for tag in tags:
+                    members = self._fallback_tags.setdefault(tag, set())
+                    members.add(key)
+                    if len(members) > self._fallback_cache.max_entries:
+                        members.intersection_update(self._fallback_cache.keys())
+        return stored
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """Xóa mọi key đã đăng ký dưới các tag (một round trip tới Redis)"""
+        tags = [tag for tag in tags if tag]
+        if not tags:
+            return 0
+
+        if self.is_connected:
+            try:
+                deleted, keys = self._redis.eval(
+                    _INVALIDATE_TAGS_SCRIPT, len(tags), *[_tag_key(tag) for tag in tags]
+                )
+                if self._near is not None:
+                    self._near.invalidate(
+                        k.decode() if isinstance(k, bytes) else k for k in keys
+                    )
+                return int(deleted)
+            except Exception as e:
+                logger.error(f"Redis INVALIDATE_TAGS error: {e}")
+
+        # Fallback
+        count = 0
         with self._lock:
-            self._fallback_cache[key] = {
-                "value": value,
-                "expires": datetime.now() + timedelta(seconds=ttl),
-            }
-        return True
+            for tag in tags:
+                for key in self._fallback_tags.pop(tag, ()):
+                    if self._fallback_cache.delete(key):
+                        count += 1
+        return count
 
     def delete(self, key: str) -> bool:
         """Xóa key khỏi cache"""
         if self.is_connected:
             try:
                 self._redis.delete(key)
+                if self._near is not None:
+                    self._near.invalidate([key])
                 return True
             except Exception as e:
                 logger.error(f"Redis DELETE error: {e}")
 
         # Fallback
-        with self._lock:
-            if key in self._fallback_cache:
-                del self._fallback_cache[key]
-                return True
-        return False
+        return self._fallback_cache.delete(key)
 
     def delete_pattern(self, pattern: str) -> int:
         """Xóa tất cả keys match pattern"""
@@ -182,6 +479,8 @@ class RedisClient:
                         count += len(keys)
                     if cursor == 0:
                         break
+                if self._near is not None:
+                    self._near.invalidate_all()
                 return count
             except Exception as e:
                 logger.error(f"Redis DELETE_PATTERN error: {e}")
@@ -190,9 +489,9 @@ class RedisClient:
         with self._lock:
             # Convert glob pattern to simple matching
             simple_pattern = pattern.replace("*", "")
-            keys_to_delete = [k for k in self._fallback_cache if simple_pattern in k]
+            keys_to_delete = [k for k in self._fallback_cache.keys() if simple_pattern in k]
             for key in keys_to_delete:
-                del self._fallback_cache[key]
+                self._fallback_cache.delete(key)
             count = len(keys_to_delete)
 
         return count
@@ -202,13 +501,16 @@ class RedisClient:
         if self.is_connected:
             try:
                 self._redis.flushdb()
+                if self._near is not None:
+                    self._near.invalidate_all()
                 return True
             except Exception as e:
                 logger.error(f"Redis CLEAR error: {e}")
 
         # Fallback
+        self._fallback_cache.clear()
         with self._lock:
-            self._fallback_cache.clear()
+            self._fallback_tags.clear()
         return True
 
     def exists(self, key: str) -> bool:
@@ -220,12 +522,7 @@ class RedisClient:
                 logger.error(f"Redis EXISTS error: {e}")
 
         # Fallback
-        with self._lock:
-            if key in self._fallback_cache:
-                if datetime.now() < self._fallback_cache[key]["expires"]:
-                    return True
-                del self._fallback_cache[key]
-        return False
+        return self._fallback_cache.contains(key)
 
     def ttl(self, key: str) -> int:
         """Lấy TTL còn lại của key (seconds)"""
@@ -236,20 +533,30 @@ class RedisClient:
                 logger.error(f"Redis TTL error: {e}")
 
         # Fallback
-        with self._lock:
-            if key in self._fallback_cache:
-                remaining = (
-                    self._fallback_cache[key]["expires"] - datetime.now()
-                ).total_seconds()
-                return max(0, int(remaining))
-        return -2  # Key không tồn tại
+        remaining = self._fallback_cache.remaining_ttl(key)
+        if remaining is None:
+            return -1  # Không hết hạn
+        if remaining < 0:
+            return -2  # Key không tồn tại
+        return int(remaining)
 
     def mget(self, keys: List[str]) -> List[Optional[Any]]:
         """Lấy nhiều keys cùng lúc"""
         if self.is_connected:
+            near = self._near
+            if near is not None:
+                found = {key: near.get(key) for key in keys}
+                missing = [key for key, value in found.items() if value is MISSING]
+                generation = near.begin()
+            else:
+                found, missing = {}, list(keys)
             try:
-                values = self._redis.mget(keys)
-                return [self._deserialize(v) for v in values]
+                if missing:
+                    for key, data in zip(missing, self._redis.mget(missing)):
+                        found[key] = self._deserialize(data)
+                        if near is not None:
+                            near.fill(key, found[key], generation, size=len(data) if data else None)
+                return [_unwrap(found[key]) for key in keys]
             except Exception as e:
                 logger.error(f"Redis MGET error: {e}")
 
@@ -258,12 +565,17 @@ class RedisClient:
 
     def mset(self, mapping: Dict[str, Any], ttl: int = 300) -> bool:
         """Set nhiều keys cùng lúc"""
+        mapping = {key: to_plain(value) for key, value in mapping.items()}
         if self.is_connected:
             try:
                 pipe = self._redis.pipeline()
-                for key, value in mapping.items():
-                    pipe.setex(key, ttl, self._serialize(value))
+                payloads = {key: self._serialize(value) for key, value in mapping.items()}
+                for key, data in payloads.items():
+                    pipe.setex(key, ttl, data)
                 pipe.execute()
+                if self._near is not None:
+                    for key, value in mapping.items():
+                        self._near.put(key, value, ttl, size=len(payloads[key]))
                 return True
             except Exception as e:
                 logger.error(f"Redis MSET error: {e}")
@@ -277,19 +589,67 @@ class RedisClient:
         """Tăng giá trị counter"""
         if self.is_connected:
             try:
-                return self._redis.incr(key, amount)
+                value = self._redis.incr(key, amount)
+                # Counter ghi thường xuyên: chỉ bỏ bản L1 của process này,
+                # không publish mỗi lần tăng
+                if self._near is not None:
+                    self._near.discard(key)
+                return value
             except Exception as e:
                 logger.error(f"Redis INCR error: {e}")
 
         # Fallback
         with self._lock:
-            if key not in self._fallback_cache:
-                self._fallback_cache[key] = {
-                    "value": 0,
-                    "expires": datetime.now() + timedelta(days=1),
-                }
-            self._fallback_cache[key]["value"] += amount
-            return self._fallback_cache[key]["value"]
+            remaining = self._fallback_cache.remaining_ttl(key)
+            value = self._fallback_cache.get(key, 0) + amount
+            ttl = remaining if remaining is not None and remaining > 0 else 86400
+            self._fallback_cache.set(key, value, ttl)
+            return value
+
+    def run_script(self, script: str, keys: List[str], args: List[Any]) -> Any:
+        """
+        Chạy Lua script trên Redis (EVALSHA, tự nạp lại nếu Redis mất script).
+
+        Returns:
+            Kết quả script, hoặc None nếu không có Redis / lỗi (caller tự fallback)
+        """
+        if not self.is_connected:
+            return None
+        try:
+            runner = self._scripts.get(script)
+            if runner is None:
+                runner = self._scripts[script] = self._redis.register_script(script)
+            return runner(keys=keys, args=args)
+        except Exception as e:
+            logger.error(f"Redis SCRIPT error: {e}")
+            return None
+
+    def acquire_lock(self, name: str, ttl: float = SINGLE_FLIGHT_LOCK_TTL) -> Optional[str]:
+        """
+        Lấy lock cross-process (SET NX PX) trên Redis.
+
+        Returns:
+            Token để release, hoặc None nếu process khác đang giữ lock.
+            Không có Redis thì luôn trả token (single-flight trong process là đủ).
+        """
+        token = uuid.uuid4().hex
+        if self.is_connected:
+            try:
+                if self._redis.set(f"lock:{name}", token, nx=True, px=int(ttl * 1000)):
+                    return token
+                return None
+            except Exception as e:
+                logger.error(f"Redis LOCK error: {e}")
+        return token
+
+    def release_lock(self, name: str, token: str) -> None:
+        """Nhả lock nếu vẫn đang giữ (so khớp token bằng Lua)"""
+        if not self.is_connected:
+            return
+        try:
+            self._redis.eval(_RELEASE_LOCK_SCRIPT, 1, f"lock:{name}", token)
+        except Exception as e:
+            logger.error(f"Redis UNLOCK error: {e}")
 
     def stats(self) -> Dict[str, Any]:
         """Thống kê cache"""
@@ -298,6 +658,8 @@ class RedisClient:
             "connected": self.is_connected,
             "timestamp": datetime.now().isoformat(),
         }
+        if self.is_connected:
+            result["codec"] = self._codec.describe()
 
         if self.is_connected:
             try:
@@ -313,9 +675,12 @@ class RedisClient:
                 )
             except Exception as e:
                 result["error"] = str(e)
+            if self._near is not None:
+                result["near_cache"] = self._near.stats()
         else:
-            with self._lock:
-                result["total_keys"] = len(self._fallback_cache)
+            fallback = self._fallback_cache.stats()
+            result["total_keys"] = fallback["entries"]
+            result["fallback"] = fallback
 
         return result
 
@@ -324,20 +689,323 @@ class RedisClient:
         if self.is_connected:
             return 0  # Redis tự động xử lý
 
-        with self._lock:
-            now = datetime.now()
-            expired = [
-                k for k, v in self._fallback_cache.items() if now >= v["expires"]
-            ]
-            for key in expired:
-                del self._fallback_cache[key]
-            return len(expired)
+        return self._fallback_cache.purge_expired()
 
 
 # Global Redis client instance
 redis_client = RedisClient()
 
 
+# =============================================================================
+# SINGLE-FLIGHT (REQUEST COALESCING)
+# =============================================================================
+
+
+class SingleFlight:
+    """
+    Gộp các lần tính cùng một key: chỉ caller đầu tiên (leader) tính, các
+    caller khác chờ và nhận chung kết quả (hoặc exception).
+
+    Dùng concurrent.futures.Future làm điểm hẹn nên chạy được cả giữa các
+    thread (sync route trong threadpool) lẫn asyncio tasks.
+    """
+
+    def __init__(self, timeout: float = SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def _join(self, key: str):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Chạy fn() một lần cho mỗi key đang bay (sync)"""
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                self.timeouts += 1
+                logger.warning(f"Single-flight wait timed out: {key}")
+                return fn()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, future)
+
+    async def do_async(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Chạy await fn() một lần cho mỗi key đang bay (async)"""
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                # shield: hủy việc chờ không được hủy Future của leader
+                return await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), self.timeout
+                )
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                logger.warning(f"Single-flight wait timed out: {key}")
+                return await fn()
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, future)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "in_flight": in_flight,
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "timeouts": self.timeouts,
+        }
+
+
+# Global single-flight instance cho cache
+cache_flight = SingleFlight()
+
+
+def _load_and_store(
+    cache_key: str,
+    compute: Callable[[], Any],
+    ttl: int,
+    distributed: bool = False,
+    stale_ttl: int = 0,
+    force: bool = False,
+    tags: Optional[List[str]] = None,
+) -> Any:
+    """
+    Leader của single-flight: kiểm tra lại cache, tính và lưu.
+
+    distributed=True: giữ thêm lock Redis để chỉ một process tính; process
+    không lấy được lock chờ giá trị xuất hiện trong cache rồi mới tự tính.
+    Giá trị được lưu kèm soft TTL và thời gian tính (CacheEntry).
+    force=True (refresh nền) bỏ qua bước kiểm tra lại cache.
+    """
+    if not force:
+        value = redis_client.get(cache_key)
+        if value is not None:
+            return value
+
+    token = None
+    if distributed and redis_client.is_connected:
+        token = redis_client.acquire_lock(cache_key)
+        if token is None:
+            deadline = time.monotonic() + SINGLE_FLIGHT_LOCK_TTL
+            delay = 0.01
+            while time.monotonic() < deadline:
+                time.sleep(delay)
+                value = redis_client.get(cache_key)
+                if value is not None:
+                    return value
+                delay = min(delay * 2, 0.2)
+
+    try:
+        started = time.monotonic()
+        value = compute()
+        if value is not None:
+            redis_client.set_entry(
+                cache_key, value, ttl, stale_ttl, time.monotonic() - started, tags
+            )
+        return value
+    finally:
+        if token is not None:
+            redis_client.release_lock(cache_key, token)
+
+
+async def _load_and_store_async(
+    cache_key: str,
+    compute: Callable[[], Any],
+    ttl: int,
+    distributed: bool = False,
+    stale_ttl: int = 0,
+    force: bool = False,
+    tags: Optional[List[str]] = None,
+) -> Any:
+    """Async version của _load_and_store (compute trả về awaitable)"""
+    if not force:
+        value = redis_client.get(cache_key)
+        if value is not None:
+            return value
+
+    token = None
+    if distributed and redis_client.is_connected:
+        token = redis_client.acquire_lock(cache_key)
+        if token is None:
+            deadline = time.monotonic() + SINGLE_FLIGHT_LOCK_TTL
+            delay = 0.01
+            while time.monotonic() < deadline:
+                await asyncio.sleep(delay)
+                value = redis_client.get(cache_key)
+                if value is not None:
+                    return value
+                delay = min(delay * 2, 0.2)
+
+    try:
+        started = time.monotonic()
+        value = await compute()
+        if value is not None:
+            redis_client.set_entry(
+                cache_key, value, ttl, stale_ttl, time.monotonic() - started, tags
+            )
+        return value
+    finally:
+        if token is not None:
+            redis_client.release_lock(cache_key, token)
+
+
+# =============================================================================
+# STALE-WHILE-REVALIDATE (BACKGROUND REFRESH)
+# =============================================================================
+
+
+class BackgroundRefresher:
+    """
+    Refresh nền cho giá trị đã cũ (quá soft TTL) hoặc được XFetch chọn
+    refresh sớm. Mỗi key chỉ có một lần refresh đang chạy trong process;
+    khi có Redis thì thêm lock để chỉ một process refresh.
+    """
+
+    def __init__(self, max_workers: int = REFRESH_WORKERS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="cache-refresh"
+        )
+        self._lock = threading.Lock()
+        self._running: set = set()
+        self._tasks: set = set()  # giữ tham chiếu asyncio tasks
+        self.scheduled = 0
+        self.failed = 0
+
+    def _claim(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._running:
+                return None
+            self._running.add(key)
+        token = redis_client.acquire_lock(f"refresh:{key}")
+        if token is None:
+            self._release(key, None)
+        return token
+
+    def _release(self, key: str, token: Optional[str]) -> None:
+        if token is not None:
+            redis_client.release_lock(f"refresh:{key}", token)
+        with self._lock:
+            self._running.discard(key)
+
+    def schedule(self, key: str, fn: Callable[[], Any]) -> bool:
+        """Chạy fn() trong thread nền nếu key chưa được refresh"""
+        token = self._claim(key)
+        if token is None:
+            return False
+        self.scheduled += 1
+
+        def run():
+            try:
+                fn()
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Background refresh failed for {key}: {e}")
+            finally:
+                self._release(key, token)
+
+        self._executor.submit(run)
+        return True
+
+    def schedule_async(self, key: str, fn: Callable[[], Any]) -> bool:
+        """Chạy await fn() như asyncio task nếu key chưa được refresh"""
+        token = self._claim(key)
+        if token is None:
+            return False
+        self.scheduled += 1
+
+        async def run():
+            try:
+                await fn()
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Background refresh failed for {key}: {e}")
+            finally:
+                self._release(key, token)
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = len(self._running)
+        return {"running": running, "scheduled": self.scheduled, "failed": self.failed}
+
+
+# Global background refresher
+cache_refresher = BackgroundRefresher()
+
+
+def _serve_entry(key: str, entry: CacheEntry, beta: float, load: Callable) -> Any:
+    """
+    Trả giá trị từ cache hit, refresh nếu cần:
+    - Còn tươi: trả luôn
+    - XFetch chọn refresh sớm (chưa quá soft TTL): caller này tính lại
+      (single-flight), lỗi thì vẫn trả giá trị cũ
+    - Quá soft TTL (stale): trả giá trị cũ, refresh ở thread nền
+    """
+    if entry.is_fresh(beta):
+        return entry.value
+    if entry.is_stale():
+        cache_refresher.schedule(key, lambda: load(True))
+        return entry.value
+    try:
+        return cache_flight.do(key, lambda: load(True))
+    except Exception as e:
+        logger.error(f"Early refresh failed for {key}: {e}")
+        return entry.value
+
+
+async def _serve_entry_async(key: str, entry: CacheEntry, beta: float, load: Callable) -> Any:
+    """Async version của _serve_entry (load trả về awaitable)"""
+    if entry.is_fresh(beta):
+        return entry.value
+    if entry.is_stale():
+        cache_refresher.schedule_async(key, lambda: load(True))
+        return entry.value
+    try:
+        return await cache_flight.do_async(key, lambda: load(True))
+    except Exception as e:
+        logger.error(f"Early refresh failed for {key}: {e}")
+        return entry.value
+
+
 # =============================================================================
 # CACHE DECORATORS
 # =============================================================================
@@ -351,10 +1019,29 @@ def generate_cache_key(*args, **kwargs) -> str:
     return hashlib.md5(key_string.encode()).hexdigest()
 
 
+def resolve_tags(tags: Union[List[str], Callable[..., List[str]], None], *args, **kwargs) -> List[str]:
+    """Tags tĩnh (list) hoặc tính từ arguments của function (callable)"""
+    if tags is None:
+        return []
+    if callable(tags):
+        return list(tags(*args, **kwargs) or [])
+    return list(tags)
+
+
+def _prefix_tag(key_prefix: str) -> str:
+    """Tag chung của mọi key do một decorator tạo (thay cho SCAN theo prefix)"""
+    return f"prefix:{key_prefix}"
+
+
 def cached(
     key_prefix: str,
     ttl: int = CACHE_TTL["MEDIUM"],
     key_builder: Optional[Callable] = None,
+    single_flight: bool = True,
+    distributed_lock: bool = False,
+    stale_ttl: int = 0,
+    early_refresh_beta: float = XFETCH_BETA,
+    tags: Union[List[str], Callable[..., List[str]], None] = None,
 ):
     """
     Decorator để cache kết quả function.
@@ -363,9 +1050,17 @@ def cached(
         key_prefix: Prefix cho cache key
         ttl: Time-to-live (seconds)
         key_builder: Custom function để build cache key
+        single_flight: Gộp các cache miss đồng thời của cùng key
+        distributed_lock: Gộp cả giữa các process qua lock Redis
+        stale_ttl: Thời gian (giây) sau ttl vẫn trả giá trị cũ trong khi
+            refresh ở thread nền (stale-while-revalidate). Chỉ dùng khi
+            function không phụ thuộc tài nguyên theo request (vd. Session)
+        early_refresh_beta: Hệ số XFetch: trước ttl, một caller được chọn
+            ngẫu nhiên tính lại ngay trong request của nó (0 = tắt)
+        tags: Cache tags của kết quả (list, hoặc callable nhận cùng arguments)
 
     Example:
-        @cached("products", ttl=300)
+        @cached("products", ttl=300, tags=[CACHE_TAGS["PRODUCT_LISTS"]])
         def get_products(category=None):
             ...
     """
@@ -379,24 +1074,35 @@ def cached(
             else:
                 cache_key = f"{key_prefix}:{generate_cache_key(*args, **kwargs)}"
 
+            key_tags = [_prefix_tag(key_prefix), *resolve_tags(tags, *args, **kwargs)]
+
+            def load(force: bool = False):
+                return _load_and_store(
+                    cache_key,
+                    lambda: func(*args, **kwargs),
+                    ttl,
+                    distributed_lock,
+                    stale_ttl,
+                    force,
+                    key_tags,
+                )
+
             # Try get from cache
-            cached_value = redis_client.get(cache_key)
-            if cached_value is not None:
+            entry = redis_client.get_entry(cache_key)
+            if entry is not None:
                 logger.debug(f"Cache HIT: {cache_key}")
-                return cached_value
+                return _serve_entry(cache_key, entry, early_refresh_beta, load)
 
             # Execute function
             logger.debug(f"Cache MISS: {cache_key}")
-            result = func(*args, **kwargs)
+            if not single_flight:
+                return load(True)
 
-            # Store in cache
-            redis_client.set(cache_key, result, ttl)
-
-            return result
+            return cache_flight.do(cache_key, load)
 
         # Attach cache utilities
         wrapper.cache_key_prefix = key_prefix
-        wrapper.invalidate = lambda: redis_client.delete_pattern(f"{key_prefix}:*")
+        wrapper.invalidate = lambda: redis_client.invalidate_tags(_prefix_tag(key_prefix))
         wrapper.invalidate_key = lambda k: redis_client.delete(f"{key_prefix}:{k}")
 
         return wrapper
@@ -408,6 +1114,11 @@ def cached_async(
     key_prefix: str,
     ttl: int = CACHE_TTL["MEDIUM"],
     key_builder: Optional[Callable] = None,
+    single_flight: bool = True,
+    distributed_lock: bool = False,
+    stale_ttl: int = 0,
+    early_refresh_beta: float = XFETCH_BETA,
+    tags: Union[List[str], Callable[..., List[str]], None] = None,
 ):
     """
     Async version của cached decorator.
@@ -422,21 +1133,32 @@ def cached_async(
             else:
                 cache_key = f"{key_prefix}:{generate_cache_key(*args, **kwargs)}"
 
+            key_tags = [_prefix_tag(key_prefix), *resolve_tags(tags, *args, **kwargs)]
+
+            def load(force: bool = False):
+                return _load_and_store_async(
+                    cache_key,
+                    lambda: func(*args, **kwargs),
+                    ttl,
+                    distributed_lock,
+                    stale_ttl,
+                    force,
+                    key_tags,
+                )
+
             # Try get from cache
-            cached_value = redis_client.get(cache_key)
-            if cached_value is not None:
-                return cached_value
+            entry = redis_client.get_entry(cache_key)
+            if entry is not None:
+                return await _serve_entry_async(cache_key, entry, early_refresh_beta, load)
 
             # Execute async function
-            result = await func(*args, **kwargs)
+            if not single_flight:
+                return await load(True)
 
-            # Store in cache
-            redis_client.set(cache_key, result, ttl)
-
-            return result
+            return await cache_flight.do_async(cache_key, load)
 
         wrapper.cache_key_prefix = key_prefix
-        wrapper.invalidate = lambda: redis_client.delete_pattern(f"{key_prefix}:*")
+        wrapper.invalidate = lambda: redis_client.invalidate_tags(_prefix_tag(key_prefix))
 
         return wrapper
 
@@ -447,152 +1169,527 @@ def cached_async(
 # RESPONSE CACHING MIDDLEWARE
 # =============================================================================
 
+# Header không lưu kèm response cache (tính lại theo variant khi trả)
+_VARIANT_HEADERS = {"content-length", "content-encoding", "etag", "transfer-encoding"}
+
+# Thứ tự ưu tiên content-coding khi client chấp nhận nhiều loại
+_ENCODING_PREFERENCE = ("br", "gzip")
+
+
+def build_response_entry(
+    status_code: int, headers: Dict[str, str], body: bytes, media_type: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Dữ liệu response cache: body gốc + các variant nén sẵn + ETag.
+
+    ETag mạnh tính từ body gốc lúc lưu; mỗi variant có ETag riêng
+    ("<hash>", "<hash>-gzip", "<hash>-br") vì là các representation khác nhau.
+    """
+    variants = {"identity": body}
+    if len(body) >= RESPONSE_COMPRESS_MIN_BYTES:
+        compressed = gzip.compress(body, RESPONSE_GZIP_LEVEL, mtime=0)
+        if len(compressed) < len(body):
+            variants["gzip"] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+            if len(compressed) < len(body):
+                variants["br"] = compressed
+    return {
+        "status_code": status_code,
+        "headers": {k: v for k, v in headers.items() if k.lower() not in _VARIANT_HEADERS},
+        "media_type": media_type,
+        "etag": hashlib.blake2b(body, digest_size=16).hexdigest(),
+        "variants": variants,
+    }
+
+
+def negotiate_encoding(accept_encoding: str, available) -> str:
+    """Chọn content-coding tốt nhất theo Accept-Encoding (q-values)"""
+    if not accept_encoding:
+        return "identity"
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    wildcard = weights.get("*", 0.0)
+    for coding in _ENCODING_PREFERENCE:
+        if coding in available and weights.get(coding, wildcard) > 0:
+            return coding
+    return "identity"
+
+
+def variant_etag(entry: Dict[str, Any], coding: str) -> str:
+    if coding == "identity":
+        return f'"{entry["etag"]}"'
+    return f'"{entry["etag"]}-{coding}"'
+
+
+def etag_matches(if_none_match: str, entry: Dict[str, Any]) -> bool:
+    """If-None-Match (so sánh yếu) khớp một variant bất kỳ của entry"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        value = tag.strip('"')
+        if value == entry["etag"] or value.startswith(entry["etag"] + "-"):
+            return True
+    return False
+
+
+def _merge_vary(vary: Optional[str], value: str = "Accept-Encoding") -> str:
+    if not vary:
+        return value
+    if value.lower() in (v.strip().lower() for v in vary.split(",")):
+        return vary
+    return f"{vary}, {value}"
+
+
+def serve_response_entry(
+    entry: Dict[str, Any],
+    accept_encoding: str,
+    if_none_match: str,
+    extra_headers: Dict[str, str],
+) -> Response:
+    """Trả variant phù hợp, hoặc 304 không body nếu ETag khớp"""
+    coding = negotiate_encoding(accept_encoding, entry["variants"])
+    headers = {**entry["headers"], **extra_headers}
+    headers["ETag"] = variant_etag(entry, coding)
+    vary_key = next((k for k in headers if k.lower() == "vary"), "Vary")
+    headers[vary_key] = _merge_vary(headers.pop(vary_key, None))
+
+    if etag_matches(if_none_match, entry):
+        for key in [k for k in headers if k.lower() == "content-type"]:
+            del headers[key]
+        return Response(status_code=304, headers=headers)
+
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    return Response(
+        content=entry["variants"][coding],
+        status_code=entry["status_code"],
+        headers=headers,
+        media_type=entry.get("media_type"),
+    )
+
 
 class ResponseCache:
     """
     Cache cho HTTP responses.
     Lưu response body và headers.
+
+    Rule được biên dịch thành cây segment (RouteMatcher): template
+    "/api/san_pham/{id:int}" khớp exact, rule không có tham số khớp prefix.
     """
 
     def __init__(self):
         self.rules: Dict[str, Dict[str, Any]] = {}
+        self._matcher: Optional[RouteMatcher] = None
+        # Số response theo X-Cache (HIT, STALE, MISS, COALESCED)
+        self.counters: Dict[str, int] = {}
         self._setup_default_rules()
 
     def _setup_default_rules(self):
         """Setup cache rules mặc định"""
-        self.rules = {
-            # Products
-            "/api/san_pham": {"ttl": CACHE_TTL["MEDIUM"], "methods": ["GET"]},
-            "/api/san_pham/{id}": {"ttl": CACHE_TTL["LONG"], "methods": ["GET"]},
-            # Banners
-            "/api/banner": {"ttl": CACHE_TTL["LONG"], "methods": ["GET"]},
-            # Gallery
-            "/api/thu_vien": {"ttl": CACHE_TTL["EXTENDED"], "methods": ["GET"]},
-            # Blog
-            "/api/blog": {"ttl": CACHE_TTL["LONG"], "methods": ["GET"]},
-            # Experts
-            "/api/chuyen_gia": {"ttl": CACHE_TTL["EXTENDED"], "methods": ["GET"]},
-            # Combos
-            "/api/combo": {"ttl": CACHE_TTL["LONG"], "methods": ["GET"]},
-            # Static content
-            "/api/noi_dung": {"ttl": CACHE_TTL["EXTENDED"], "methods": ["GET"]},
-            # Statistics (shorter TTL)
-            "/api/thong_ke": {"ttl": CACHE_TTL["SHORT"], "methods": ["GET"]},
-        }
+        self.rules = {}
+        self._matcher = None
+        # Products: chi tiết gắn tag product:{id}, còn lại là danh sách
+        self.add_rule(
+            "/api/san_pham",
+            CACHE_TTL["MEDIUM"],
+            tags=[CACHE_TAGS["PRODUCTS"]],
+            item_tag=CACHE_TAGS["PRODUCT"],
+            list_tags=[CACHE_TAGS["PRODUCT_LISTS"]],
+        )
+        self.add_rule(
+            "/api/san_pham/{id:int}",
+            CACHE_TTL["LONG"],
+            tags=[CACHE_TAGS["PRODUCTS"]],
+            item_tag=CACHE_TAGS["PRODUCT"],
+            vary_query=["include_reviews"],
+        )
+        self.add_rule(
+            "/api/san_pham/{id:int}/danh_gia",
+            CACHE_TTL["MEDIUM"],
+            tags=[CACHE_TAGS["PRODUCTS"]],
+            item_tag=CACHE_TAGS["PRODUCT"],
+            vary_query=[],
+        )
+        # Banners
+        self.add_rule(
+            "/api/banner", CACHE_TTL["LONG"], tags=[CACHE_TAGS["BANNERS"]], vary_query=[]
+        )
+        # Gallery
+        self.add_rule(
+            "/api/thu_vien", CACHE_TTL["EXTENDED"], tags=[CACHE_TAGS["GALLERY"]], vary_query=[]
+        )
+        # Blog
+        self.add_rule("/api/blog", CACHE_TTL["LONG"], tags=[CACHE_TAGS["BLOGS"]])
+        # Experts
+        self.add_rule(
+            "/api/dich_vu/chuyen_gia", CACHE_TTL["EXTENDED"], tags=[CACHE_TAGS["EXPERTS"]]
+        )
+        # Combos (chứa thông tin sản phẩm)
+        self.add_rule(
+            "/pg/combo",
+            CACHE_TTL["LONG"],
+            tags=[CACHE_TAGS["COMBOS"], CACHE_TAGS["PRODUCTS"]],
+        )
+        # Static content
+        self.add_rule("/api/noi_dung", CACHE_TTL["EXTENDED"], tags=[CACHE_TAGS["CONTENT"]])
+        # Statistics (shorter TTL)
+        self.add_rule("/api/thong_ke", CACHE_TTL["SHORT"], tags=[CACHE_TAGS["STATS"]])
 
-    def add_rule(self, path: str, ttl: int, methods: List[str] = None):
-        """Thêm cache rule"""
-        self.rules[path] = {
+    def add_rule(
+        self,
+        path: str,
+        ttl: int,
+        methods: List[str] = None,
+        stale_ttl: Optional[int] = None,
+        tags: Optional[List[str]] = None,
+        item_tag: Optional[str] = None,
+        list_tags: Optional[List[str]] = None,
+        vary_query: Optional[List[str]] = None,
+        prefix: Optional[bool] = None,
+    ):
+        """
+        Thêm cache rule.
+
+        stale_ttl: thời gian sau ttl vẫn trả response cũ trong khi render lại
+        ở nền (mặc định bằng ttl)
+        tags: cache tags của mọi response khớp rule
+        item_tag: mẫu tag ("product:{id}") lấy id từ tham số path, hoặc từ
+        segment số ngay sau path của rule prefix
+        list_tags: tags thêm khi không có id (response dạng danh sách)
+        vary_query: chỉ các query param này vào cache key (None = tất cả)
+        prefix: khớp cả path con (mặc định: đúng khi path không có tham số)
+        """
+        if prefix is None:
+            prefix = "{" not in path
+        rule = {
+            "path": path.split("/{", 1)[0],
             "ttl": ttl,
             "methods": methods or ["GET"],
+            "tags": list(tags or []),
+            "prefix": prefix,
         }
+        if stale_ttl is not None:
+            rule["stale_ttl"] = stale_ttl
+        if item_tag:
+            rule["item_tag"] = item_tag
+        if list_tags:
+            rule["list_tags"] = list(list_tags)
+        if vary_query is not None:
+            rule["vary_query"] = sorted(vary_query)
+        self.rules[path] = rule
+        self._matcher = None
+
+    def _compiled(self) -> RouteMatcher:
+        matcher = self._matcher
+        if matcher is None:
+            matcher = RouteMatcher(
+                (path, rule, rule["prefix"]) for path, rule in self.rules.items()
+            )
+            self._matcher = matcher
+        return matcher
+
+    @staticmethod
+    def tags_for(
+        rule: Dict[str, Any], path: str, params: Optional[Dict[str, str]] = None
+    ) -> List[str]:
+        """Cache tags của một response theo rule, path và tham số path"""
+        tags = list(rule.get("tags", ()))
+        item_id = (params or {}).get("id")
+        if item_id is None:
+            segment = path[len(rule.get("path", "")) :].strip("/").split("/", 1)[0]
+            item_id = segment if segment.isdigit() else None
+        if rule.get("item_tag") and item_id is not None:
+            tags.append(rule["item_tag"].format(id=item_id))
+        else:
+            tags.extend(rule.get("list_tags", ()))
+        return tags
+
+    @staticmethod
+    def stale_ttl(rule: Dict[str, Any]) -> int:
+        """Stale TTL của rule (mặc định bằng ttl)"""
+        return rule.get("stale_ttl", rule["ttl"])
+
+    def match(self, path: str, method: str) -> Optional[Tuple[Dict[str, Any], Dict[str, str]]]:
+        """(rule, tham số path) khớp với request, hoặc None"""
+        found = self._compiled().match(path)
+        if found is None or method not in found[0]["methods"]:
+            return None
+        return found
 
     def get_rule(self, path: str, method: str) -> Optional[Dict[str, Any]]:
         """Lấy cache rule cho path"""
-        # Exact match
-        if path in self.rules:
-            rule = self.rules[path]
-            if method in rule["methods"]:
-                return rule
-
-        # Prefix match
-        for rule_path, rule in self.rules.items():
-            if "{" not in rule_path and path.startswith(rule_path):
-                if method in rule["methods"]:
-                    return rule
-
-        return None
-
-    def generate_key(self, request: Request) -> str:
-        """Generate cache key từ request"""
-        # Include path, query params, and relevant headers
-        parts = [
-            request.method,
-            str(request.url.path),
-            str(sorted(request.query_params.items())),
-        ]
-
-        # Add Accept-Encoding to key (for compressed responses)
-        accept_encoding = request.headers.get("accept-encoding", "")
-        if "gzip" in accept_encoding:
-            parts.append("gzip")
-
+        found = self.match(path, method)
+        return found[0] if found else None
+
+    def generate_key(self, request: Request, rule: Optional[Dict[str, Any]] = None) -> str:
+        """Generate cache key từ request (query params theo vary_query của rule)"""
+        query = request.query_params.multi_items()
+        vary_query = rule.get("vary_query") if rule else None
+        if vary_query is not None:
+            query = [(k, v) for k, v in query if k in vary_query]
+        parts = [request.method, str(request.url.path), str(sorted(query))]
+
+        # Accept-Encoding không vào key: một entry giữ mọi variant nén
         key_string = ":".join(parts)
         return f"response:{hashlib.md5(key_string.encode()).hexdigest()}"
 
+    def record(self, status: str) -> None:
+        self.counters[status] = self.counters.get(status, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Số response theo trạng thái cache và tỉ lệ hit (HIT + STALE)"""
+        counters = dict(self.counters)
+        total = sum(counters.values())
+        served = counters.get("HIT", 0) + counters.get("STALE", 0)
+        return {
+            **counters,
+            "total": total,
+            "hit_rate": round(served / total, 4) if total else 0.0,
+        }
+
 
 response_cache = ResponseCache()
 
 
-class AdvancedCacheMiddleware(BaseHTTPMiddleware):
+def _without_accept_encoding(scope: Dict[str, Any]) -> Dict[str, Any]:
+    """Bản sao scope bỏ Accept-Encoding: app phía sau trả body gốc chưa nén"""
+    headers = [(k, v) for k, v in scope.get("headers", []) if k.lower() != b"accept-encoding"]
+    return {**scope, "headers": headers}
+
+
+class AdvancedCacheMiddleware:
     """
-    Advanced caching middleware với response caching.
+    Advanced caching middleware với response caching (ASGI thuần).
+
+    Hit được trả ngay trước khi vào routing. Mỗi entry giữ body gốc cùng
+    các variant gzip/br nén sẵn và ETag; hit chỉ chọn variant theo
+    Accept-Encoding (không nén lại), If-None-Match khớp thì trả 304 không body.
+
+    Response quá soft TTL (hoặc được XFetch chọn refresh sớm) vẫn được trả
+    ngay, đồng thời render lại ở nền bằng một request nội bộ tới app.
     """
 
-    async def dispatch(self, request: Request, call_next):
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def _render_detached(
+        self, scope: Scope, receive: Optional[Receive] = None
+    ) -> Dict[str, Any]:
+        """Gọi app phía sau với bản sao scope (bỏ Accept-Encoding), gom response"""
+        scope = {**_without_accept_encoding(scope), "state": dict(scope.get("state") or {})}
+        result: Dict[str, Any] = {"status_code": 500, "raw_headers": []}
+        chunks: List[bytes] = []
+
+        async def empty_receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def collect(message: Message):
+            if message["type"] == "http.response.start":
+                result["status_code"] = message["status"]
+                result["raw_headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive or empty_receive, collect)
+        result["body"] = b"".join(chunks)
+        return result
+
+    @staticmethod
+    def _to_entry(rendered: Dict[str, Any]) -> Dict[str, Any]:
+        headers = {
+            k.decode("latin-1"): v.decode("latin-1") for k, v in rendered["raw_headers"]
+        }
+        return build_response_entry(rendered["status_code"], headers, rendered["body"])
+
+    async def _refresh(
+        self, scope: Scope, cache_key: str, rule: Dict[str, Any], tags: List[str]
+    ) -> bool:
+        started = time.monotonic()
+        rendered = await self._render_detached(scope)
+        if not 200 <= rendered["status_code"] < 300:
+            return False
+        redis_client.set_entry(
+            cache_key,
+            self._to_entry(rendered),
+            rule["ttl"],
+            response_cache.stale_ttl(rule),
+            time.monotonic() - started,
+            tags,
+        )
+        return True
+
+    async def warm(
+        self, app: ASGIApp, path: str, query_string: str = "", refresh_before: float = 0
+    ) -> Optional[bool]:
+        """
+        Render trước một URL GET vào response cache.
+
+        app: ứng dụng ngoài cùng (scope["app"] cho router)
+
+        Returns:
+            None nếu path không có rule hoặc entry còn hơn refresh_before giây
+            tới soft TTL, True nếu đã ghi entry, False nếu response không 2xx
+        """
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "server": ("warmup", 80),
+            "client": None,
+            "root_path": "",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string.encode(),
+            "headers": [(b"host", b"warmup")],
+            "app": app,
+            "state": {},
+        }
+        matched = response_cache.match(path, "GET")
+        if matched is None:
+            return None
+        rule, params = matched
+        cache_key = response_cache.generate_key(Request(scope), rule)
+        entry = redis_client.get_entry(cache_key)
+        if entry is not None and entry.remaining() > refresh_before:
+            return None
+        stored = await self._refresh(
+            scope, cache_key, rule, response_cache.tags_for(rule, path, params)
+        )
+        if stored:
+            cache_warmer.record_warmed(cache_key)
+        return stored
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            if scope["type"] == "lifespan":
+                # Warmer render qua middleware này (không đi qua rate limit)
+                cache_warmer.attach(self, scope.get("app"))
+            await self.app(scope, receive, send)
+            return
+
         # Skip non-cacheable methods
-        if request.method not in ["GET", "HEAD"]:
-            response = await call_next(request)
-            response.headers["Cache-Control"] = "no-store"
-            return response
+        method = scope["method"]
+        if method not in ("GET", "HEAD"):
+
+            async def send_no_store(message: Message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message)["Cache-Control"] = "no-store"
+                await send(message)
+
+            await self.app(scope, receive, send_no_store)
+            return
 
         # Check cache rule
-        rule = response_cache.get_rule(request.url.path, request.method)
+        matched = response_cache.match(scope["path"], method)
 
-        if rule is None:
+        if matched is None:
             # No caching rule, just pass through
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
         # Generate cache key
-        cache_key = response_cache.generate_key(request)
+        rule, params = matched
+        cache_key = response_cache.generate_key(Request(scope), rule)
+        tags = response_cache.tags_for(rule, scope["path"], params)
+        request_headers = Headers(scope=scope)
+        accept_encoding = request_headers.get("accept-encoding", "")
+        if_none_match = request_headers.get("if-none-match", "")
 
         # Try to get from cache
-        cached = redis_client.get(cache_key)
-        if cached is not None:
+        entry = redis_client.get_entry(cache_key)
+        if entry is not None:
+            status = "HIT"
+            if not entry.is_fresh():
+                status = "STALE" if entry.is_stale() else "HIT"
+                cache_refresher.schedule_async(
+                    cache_key, lambda: self._refresh(scope, cache_key, rule, tags)
+                )
+            response_cache.record(status)
+            cache_warmer.record_hit(cache_key)
             # Return cached response
-            return Response(
-                content=cached["body"],
-                status_code=cached["status_code"],
-                headers={
-                    **cached["headers"],
-                    "X-Cache": "HIT",
-                    "X-Cache-TTL": str(redis_client.ttl(cache_key)),
-                },
-                media_type=cached.get("media_type"),
+            response = serve_response_entry(
+                entry.value,
+                accept_encoding,
+                if_none_match,
+                {"X-Cache": status, "X-Cache-TTL": str(entry.remaining())},
             )
-
-        # Execute request
-        response = await call_next(request)
-
-        # Only cache successful responses
-        if 200 <= response.status_code < 300:
-            # Read response body
-            body = b""
-            async for chunk in response.body_iterator:
-                body += chunk
+            await response(scope, receive, send)
+            return
+
+        # Execute request (single-flight: request đồng thời cùng key chờ leader)
+        leader_response = None
+        rendered = False
+
+        async def render():
+            nonlocal leader_response, rendered
+            rendered = True
+            started = time.monotonic()
+            # App phía sau (và GZipMiddleware) trả body gốc; nén một lần khi lưu
+            result = await self._render_detached(scope, receive)
+            if not 200 <= result["status_code"] < 300:
+                leader_response = result
+                return None
 
             # Store in cache
-            cache_data = {
-                "body": body,
-                "status_code": response.status_code,
-                "headers": dict(response.headers),
-                "media_type": response.media_type,
-            }
-            redis_client.set(cache_key, cache_data, rule["ttl"])
-
-            # Return new response with body
-            return Response(
-                content=body,
-                status_code=response.status_code,
-                headers={
-                    **dict(response.headers),
-                    "X-Cache": "MISS",
-                    "Cache-Control": f"public, max-age={rule['ttl']}",
-                },
-                media_type=response.media_type,
+            cache_data = self._to_entry(result)
+            redis_client.set_entry(
+                cache_key,
+                cache_data,
+                rule["ttl"],
+                response_cache.stale_ttl(rule),
+                time.monotonic() - started,
+                tags,
             )
+            return cache_data
 
-        return response
+        cache_data = await cache_flight.do_async(cache_key, render)
+        response_cache.record("MISS" if rendered else "COALESCED")
+        if rendered:
+            cache_warmer.record_miss(cache_key)
+
+        if cache_data is None:
+            # Không cache được: leader trả response gốc, follower tự gọi lại
+            if leader_response is not None:
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": leader_response["status_code"],
+                        "headers": leader_response["raw_headers"],
+                    }
+                )
+                await send({"type": "http.response.body", "body": leader_response["body"]})
+            else:
+                await self.app(scope, receive, send)
+            return
+
+        # Return new response with body
+        response = serve_response_entry(
+            cache_data,
+            accept_encoding,
+            if_none_match,
+            {
+                "X-Cache": "MISS" if rendered else "COALESCED",
+                "Cache-Control": f"public, max-age={rule['ttl']}",
+            },
+        )
+        await response(scope, receive, send)
 
 
 # =============================================================================
@@ -602,58 +1699,63 @@ class AdvancedCacheMiddleware(BaseHTTPMiddleware):
 
 class CacheInvalidator:
     """
-    Quản lý cache invalidation theo entity.
+    Quản lý cache invalidation theo entity (qua cache tags).
     """
 
+    @staticmethod
+    def invalidate_tags(*tags: str) -> int:
+        """Xóa mọi cache gắn với các tags"""
+        count = redis_client.invalidate_tags(*tags)
+        logger.info(f"Invalidated tags {', '.join(tags)}: {count} keys")
+        return count
+
     @staticmethod
     def invalidate_products():
         """Invalidate tất cả cache liên quan đến products"""
-        patterns = ["products:*", "response:*san_pham*", "combos:*"]
-        count = 0
-        for pattern in patterns:
-            count += redis_client.delete_pattern(pattern)
-        logger.info(f"Invalidated products cache: {count} keys")
-        return count
+        return CacheInvalidator.invalidate_tags(CACHE_TAGS["PRODUCTS"], CACHE_TAGS["COMBOS"])
+
+    @staticmethod
+    def invalidate_product_lists():
+        """Invalidate danh sách/thống kê sản phẩm (vd. khi thêm sản phẩm mới)"""
+        return CacheInvalidator.invalidate_tags(CACHE_TAGS["PRODUCT_LISTS"], CACHE_TAGS["COMBOS"])
 
     @staticmethod
     def invalidate_product(product_id: int):
-        """Invalidate cache của một product cụ thể"""
-        redis_client.delete(f"product:{product_id}")
-        redis_client.delete_pattern(f"*san_pham*{product_id}*")
-        CacheInvalidator.invalidate_products()
+        """Invalidate cache của một product cụ thể và các danh sách chứa nó"""
+        return CacheInvalidator.invalidate_tags(
+            CACHE_TAGS["PRODUCT"].format(id=product_id),
+            CACHE_TAGS["PRODUCT_LISTS"],
+            CACHE_TAGS["COMBOS"],
+        )
 
     @staticmethod
     def invalidate_orders(user_id: Optional[int] = None):
         """Invalidate cache đơn hàng"""
         if user_id:
-            redis_client.delete(f"orders:{user_id}")
-        else:
-            redis_client.delete_pattern("orders:*")
-        redis_client.delete_pattern("*don_hang*")
+            return CacheInvalidator.invalidate_tags(
+                CACHE_TAGS["USER_ORDERS"].format(user_id=user_id)
+            )
+        return CacheInvalidator.invalidate_tags(CACHE_TAGS["ORDERS"])
 
     @staticmethod
     def invalidate_banners():
         """Invalidate cache banners"""
-        redis_client.delete_pattern("banners:*")
-        redis_client.delete_pattern("*banner*")
+        return CacheInvalidator.invalidate_tags(CACHE_TAGS["BANNERS"])
 
     @staticmethod
     def invalidate_blogs():
         """Invalidate cache blogs"""
-        redis_client.delete_pattern("blogs:*")
-        redis_client.delete_pattern("*blog*")
+        return CacheInvalidator.invalidate_tags(CACHE_TAGS["BLOGS"])
 
     @staticmethod
     def invalidate_gallery():
         """Invalidate cache gallery"""
-        redis_client.delete_pattern("gallery:*")
-        redis_client.delete_pattern("*thu_vien*")
+        return CacheInvalidator.invalidate_tags(CACHE_TAGS["GALLERY"])
 
     @staticmethod
     def invalidate_stats():
         """Invalidate cache thống kê"""
-        redis_client.delete_pattern("stats:*")
-        redis_client.delete_pattern("*thong_ke*")
+        return CacheInvalidator.invalidate_tags(CACHE_TAGS["STATS"])
 
     @staticmethod
     def invalidate_all():
@@ -665,6 +1767,36 @@ class CacheInvalidator:
 invalidator = CacheInvalidator()
 
 
+class ProductCacheListener:
+    """
+    Listener product_events: mọi route ghi sản phẩm (kể cả /pg và duyệt
+    đánh giá) xóa cache chi tiết product:{id} và các danh sách chứa nó
+    """
+
+    @staticmethod
+    def upsert_products(products) -> None:
+        CacheInvalidator.invalidate_tags(
+            *(CACHE_TAGS["PRODUCT"].format(id=p.id) for p in products),
+            CACHE_TAGS["PRODUCT_LISTS"],
+            CACHE_TAGS["COMBOS"],
+        )
+
+    @staticmethod
+    def remove_products(ids) -> None:
+        CacheInvalidator.invalidate_tags(
+            *(CACHE_TAGS["PRODUCT"].format(id=product_id) for product_id in ids),
+            CACHE_TAGS["PRODUCT_LISTS"],
+            CACHE_TAGS["COMBOS"],
+        )
+
+    @staticmethod
+    def invalidate() -> None:
+        CacheInvalidator.invalidate_products()
+
+
+product_cache_listener = product_events.register(ProductCacheListener())
+
+
 # =============================================================================
 # CACHE WARMUP
 # =============================================================================
@@ -673,128 +1805,192 @@ invalidator = CacheInvalidator()
 class CacheWarmer:
     """
     Pre-warm cache với data thường xuyên truy cập.
+
+    Warmer là function sync hoặc async đăng ký qua register(); warmer async
+    gọi warm_paths() để render trước các URL vào response cache qua
+    AdvancedCacheMiddleware. Mỗi warmer có thống kê: số lần chạy, thời gian,
+    số entry đã ghi / bỏ qua (còn tươi) và số miss tránh được (request đầu
+    tiên tới entry vừa warm là HIT).
     """
 
     def __init__(self):
         self._warmup_functions: List[Callable] = []
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        # cache key -> warmer vừa ghi, chưa có request nào tới
+        self._pending: Dict[str, str] = {}
+        self._renderer: Optional["AdvancedCacheMiddleware"] = None
+        self._app: Optional[ASGIApp] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.refresh_before = 0.0
+        self.last_run: Optional[str] = None
 
     def register(self, func: Callable):
         """Register function để warmup"""
         self._warmup_functions.append(func)
+        self._stats[func.__name__] = {
+            "runs": 0,
+            "failures": 0,
+            "last_ms": None,
+            "total_ms": 0.0,
+            "warmed": 0,
+            "skipped": 0,
+            "misses_avoided": 0,
+            "last_error": None,
+        }
         return func
 
+    def attach(self, renderer: "AdvancedCacheMiddleware", app: Optional[ASGIApp]) -> None:
+        """Middleware response cache của app (gọi khi app khởi động)"""
+        self._renderer = renderer
+        self._app = app
+
+    # -------------------------------------------------------------------------
+    # Response cache
+    # -------------------------------------------------------------------------
+
+    async def warm_paths(self, paths: List[Union[str, Tuple[str, str]]]) -> Dict[str, int]:
+        """
+        Render trước các URL (path hoặc (path, query string)) vào response
+        cache, tối đa CACHE_WARMUP_CONCURRENCY URL cùng lúc.
+        """
+        result = {"warmed": 0, "skipped": 0, "failed": 0}
+        if self._renderer is None:
+            result["skipped"] = len(paths)
+            return result
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(CACHE_WARMUP_CONCURRENCY)
+
+        async def warm_one(item):
+            path, query_string = (item, "") if isinstance(item, str) else item
+            async with self._semaphore:
+                return await self._renderer.warm(
+                    self._app, path, query_string, self.refresh_before
+                )
+
+        for outcome in await asyncio.gather(*(warm_one(p) for p in paths), return_exceptions=True):
+            if outcome is None:
+                result["skipped"] += 1
+            elif outcome is True:
+                result["warmed"] += 1
+            else:
+                if isinstance(outcome, Exception):
+                    logger.warning(f"Warmup render failed: {outcome}")
+                result["failed"] += 1
+        return result
+
+    def record_warmed(self, cache_key: str) -> None:
+        name = _current_warmer.get()
+        if name is not None:
+            self._pending[cache_key] = name
+
+    def record_hit(self, cache_key: str) -> None:
+        """Request đầu tiên tới entry vừa warm là HIT: một miss đã được tránh"""
+        if self._pending:
+            name = self._pending.pop(cache_key, None)
+            if name is not None:
+                self._stats[name]["misses_avoided"] += 1
+
+    def record_miss(self, cache_key: str) -> None:
+        """Entry warm đã hết hạn trước khi có request"""
+        if self._pending:
+            self._pending.pop(cache_key, None)
+
+    # -------------------------------------------------------------------------
+    # Chạy warmer
+    # -------------------------------------------------------------------------
+
+    def _record(self, name: str, started: float, result: Any, error: Optional[Exception]) -> None:
+        stats = self._stats[name]
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        stats["runs"] += 1
+        stats["last_ms"] = elapsed_ms
+        stats["total_ms"] += elapsed_ms
+        if error is not None:
+            stats["failures"] += 1
+            stats["last_error"] = str(error)
+            logger.error(f"  ✗ Failed to warm up {name}: {error}")
+            return
+        if isinstance(result, dict):
+            stats["warmed"] += result.get("warmed", 0)
+            stats["skipped"] += result.get("skipped", 0)
+        logger.info(f"  ✓ Warmed up: {name} ({elapsed_ms}ms)")
+
     def warmup_all(self):
-        """Chạy tất cả warmup functions"""
+        """Chạy tất cả warmup functions sync (warmer async cần warmup_all_async)"""
         logger.info("🔥 Starting cache warmup...")
         start_time = time.time()
 
         for func in self._warmup_functions:
+            if asyncio.iscoroutinefunction(func):
+                continue
+            started = time.perf_counter()
             try:
-                func()
-                logger.info(f"  ✓ Warmed up: {func.__name__}")
+                self._record(func.__name__, started, func(), None)
             except Exception as e:
-                logger.error(f"  ✗ Failed to warm up {func.__name__}: {e}")
+                self._record(func.__name__, started, None, e)
 
+        self.last_run = datetime.now().isoformat()
         elapsed = time.time() - start_time
         logger.info(f"🔥 Cache warmup completed in {elapsed:.2f}s")
 
-    async def warmup_all_async(self):
-        """Async version của warmup"""
-        logger.info("🔥 Starting async cache warmup...")
-        start_time = time.time()
-
-        tasks = []
-        for func in self._warmup_functions:
+    async def _run_async(self, func: Callable) -> None:
+        _current_warmer.set(func.__name__)
+        started = time.perf_counter()
+        try:
             if asyncio.iscoroutinefunction(func):
-                tasks.append(func())
+                result = await func()
             else:
                 # Wrap sync function
-                tasks.append(asyncio.to_thread(func))
+                result = await asyncio.to_thread(func)
+        except Exception as e:
+            self._record(func.__name__, started, None, e)
+        else:
+            self._record(func.__name__, started, result, None)
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+    async def warmup_all_async(self):
+        """Async version của warmup: các warmer chạy đồng thời"""
+        logger.info("🔥 Starting async cache warmup...")
+        start_time = time.time()
 
-        for func, result in zip(self._warmup_functions, results):
-            if isinstance(result, Exception):
-                logger.error(f"  ✗ Failed: {func.__name__}: {result}")
-            else:
-                logger.info(f"  ✓ Warmed: {func.__name__}")
+        await asyncio.gather(*(self._run_async(func) for func in self._warmup_functions))
 
+        self.last_run = datetime.now().isoformat()
         elapsed = time.time() - start_time
         logger.info(f"🔥 Async cache warmup completed in {elapsed:.2f}s")
 
-
-cache_warmer = CacheWarmer()
-
-
-# =============================================================================
-# RATE LIMITING (using cache)
-# =============================================================================
-
-
-class RateLimiter:
-    """
-    Rate limiting sử dụng Redis/cache.
-    """
-
-    def __init__(
-        self,
-        key_prefix: str = "ratelimit",
-        limit: int = 100,
-        window: int = 60,
-    ):
-        """
-        Args:
-            key_prefix: Prefix cho rate limit keys
-            limit: Số request tối đa trong window
-            window: Thời gian window (seconds)
+    async def run_periodic(self, interval: float = CACHE_WARMUP_INTERVAL):
         """
-        self.key_prefix = key_prefix
-        self.limit = limit
-        self.window = window
-
-    def _get_key(self, identifier: str) -> str:
-        """Generate rate limit key"""
-        window_id = int(time.time()) // self.window
-        return f"{self.key_prefix}:{identifier}:{window_id}"
-
-    def check(self, identifier: str) -> Dict[str, Any]:
+        Warmup ngay rồi lặp lại mỗi interval giây. Mỗi lượt chỉ render lại
+        entry sẽ hết soft TTL trước lượt sau (còn dưới 2 * interval giây)
         """
-        Kiểm tra và increment rate limit.
-
-        Args:
-            identifier: IP address hoặc user ID
-
-        Returns:
-            Dict với allowed, remaining, reset_at
-        """
-        key = self._get_key(identifier)
-
-        current = redis_client.incr(key)
-
-        # Set TTL nếu là lần đầu
-        if current == 1:
-            redis_client.set(key, 1, self.window)
-
-        allowed = current <= self.limit
-        remaining = max(0, self.limit - current)
-        reset_at = (int(time.time()) // self.window + 1) * self.window
+        self.refresh_before = interval * 2
+        while True:
+            await self.warmup_all_async()
+            await asyncio.sleep(interval)
 
+    def stats(self) -> Dict[str, Any]:
+        warmers = {}
+        for name, stats in self._stats.items():
+            runs = stats["runs"]
+            warmers[name] = {
+                **{k: v for k, v in stats.items() if k != "total_ms"},
+                "avg_ms": round(stats["total_ms"] / runs, 1) if runs else None,
+            }
         return {
-            "allowed": allowed,
-            "remaining": remaining,
-            "limit": self.limit,
-            "reset_at": reset_at,
-            "current": current,
+            "attached": self._renderer is not None,
+            "last_run": self.last_run,
+            "refresh_before": self.refresh_before,
+            "pending_keys": len(self._pending),
+            "warmers": warmers,
+            "response_cache": response_cache.stats(),
         }
 
-    def is_allowed(self, identifier: str) -> bool:
-        """Simple check nếu allowed"""
-        return self.check(identifier)["allowed"]
 
-
-# Default rate limiter instances
-api_rate_limiter = RateLimiter(key_prefix="api", limit=100, window=60)
-admin_rate_limiter = RateLimiter(key_prefix="admin", limit=200, window=60)
+# Warmer đang chạy (gán cho entry vừa ghi để tính miss tránh được)
+_current_warmer: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar(
+    "cache_warmer", default=None
+)
+cache_warmer = CacheWarmer()
 
 
 # =============================================================================
@@ -811,6 +2007,10 @@ def get_cache_health() -> Dict[str, Any]:
         "backend": "redis" if redis_client.is_connected else "in-memory",
         "stats": redis_client.stats(),
         "response_cache_rules": len(response_cache.rules),
+        "response_cache": response_cache.stats(),
+        "warmup": cache_warmer.stats(),
+        "single_flight": cache_flight.stats(),
+        "background_refresh": cache_refresher.stats(),
         "timestamp": datetime.now().isoformat(),
     }
 
@@ -835,10 +2035,21 @@ def get_or_set(
     key: str,
     factory: Callable,
     ttl: int = CACHE_TTL["MEDIUM"],
+    single_flight: bool = True,
+    distributed_lock: bool = False,
+    stale_ttl: int = 0,
+    early_refresh_beta: float = XFETCH_BETA,
+    tags: Optional[List[str]] = None,
 ) -> Any:
     """
     Get from cache or set using factory function.
 
+    Khi miss, các caller đồng thời của cùng key chỉ gọi factory một lần
+    (single_flight); distributed_lock gộp cả giữa các process qua Redis.
+    stale_ttl/early_refresh_beta: xem cached(). Với stale_ttl > 0, factory
+    có thể chạy ở thread nền sau khi request đã kết thúc.
+    tags: cache tags để invalidate_tags() xóa key này.
+
     Example:
         products = get_or_set(
             "products:all",
@@ -846,13 +2057,18 @@ def get_or_set(
             ttl=300
         )
     """
-    value = redis_client.get(key)
-    if value is not None:
-        return value
 
-    value = factory()
-    redis_client.set(key, value, ttl)
-    return value
+    def load(force: bool = False):
+        return _load_and_store(key, factory, ttl, distributed_lock, stale_ttl, force, tags)
+
+    entry = redis_client.get_entry(key)
+    if entry is not None:
+        return _serve_entry(key, entry, early_refresh_beta, load)
+
+    if not single_flight:
+        return load(True)
+
+    return cache_flight.do(key, load)
 
 
 def cache_aside(key: str, ttl: int = CACHE_TTL["MEDIUM"]):
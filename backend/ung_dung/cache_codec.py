@@ -0,0 +1,285 @@
+"""
+Codec cho giá trị cache (Redis) của IVIE Wedding Studio
+- Chuyển giá trị về dạng thuần (dict/list/str/số) trước khi lưu: ORM
+  instance, Pydantic model, datetime, Decimal, Enum...
+- Mã hóa nhị phân nhanh: orjson (mặc định) hoặc msgpack nếu được cài;
+  thiếu orjson thì dùng json của stdlib (cùng payload JSON, chậm hơn)
+- Nén zstd/lz4 (nếu được cài, không thì zlib) khi vượt ngưỡng dung lượng
+- Header phiên bản: entry của format/schema khác (kể cả pickle cũ) được
+  coi là cache miss, không bao giờ unpickle dữ liệu từ Redis dùng chung
+"""
+
+import base64
+import json
+import logging
+import os
+import uuid
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Tăng khi cấu trúc dữ liệu được cache thay đổi (entry cũ thành miss)
+SCHEMA_VERSION = int(os.getenv("CACHE_SCHEMA_VERSION", "1"))
+CODEC_FORMAT = os.getenv("CACHE_CODEC", "orjson")  # orjson | msgpack
+COMPRESSION = os.getenv("CACHE_COMPRESSION", "auto")  # auto | zstd | lz4 | zlib | none
+COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+
+# Envelope: MAGIC(2) | schema version | format | compression | kind | flags
+MAGIC = b"\xa7C"
+HEADER_SIZE = 7
+
+FORMAT_ORJSON = 1
+FORMAT_MSGPACK = 2
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSION_LZ4 = 3
+
+# Loại payload do caller tự định nghĩa (vd. giá trị thường / CacheEntry)
+KIND_VALUE = 0
+
+# Payload có giá trị được đánh dấu (bytes trong JSON) cần khôi phục khi đọc
+FLAG_TAGGED = 1
+
+_BYTES_TAG = "__b64__"
+
+
+class CodecError(ValueError):
+    """Dữ liệu cache không đọc được bằng codec hiện tại"""
+
+
+# =============================================================================
+# CHUYỂN VỀ DẠNG THUẦN
+# =============================================================================
+
+
+def _orm_to_dict(obj: Any) -> dict:
+    """Các cột đã nạp của ORM instance (không kích hoạt lazy load)"""
+    from sqlalchemy import inspect as sa_inspect
+
+    state = sa_inspect(obj)
+    unloaded = state.unloaded
+    return {
+        attr.key: to_plain(getattr(obj, attr.key))
+        for attr in state.mapper.column_attrs
+        if attr.key not in unloaded
+    }
+
+
+def to_plain(value: Any) -> Any:
+    """
+    Chuyển value về dạng thuần để cache.
+
+    ORM instance -> dict các cột (quan hệ không được đưa vào), Pydantic ->
+    model_dump(). Kiểu không nhận ra được giữ nguyên (encoder sẽ báo lỗi).
+    """
+    if value is None or isinstance(value, (str, int, float, bool, bytes)):
+        return value
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [to_plain(item) for item in value]
+    if hasattr(type(value), "__mapper__"):
+        return _orm_to_dict(value)
+    if hasattr(value, "model_dump"):
+        return to_plain(value.model_dump())
+    return value
+
+
+def _default(obj: Any) -> Any:
+    """Kiểu không có sẵn trong format nhị phân (dùng chung orjson/msgpack)"""
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(type(obj), "__mapper__") or hasattr(obj, "model_dump"):
+        return to_plain(obj)
+    raise TypeError(f"Không cache được kiểu {type(obj).__name__}")
+
+
+def _untag(value: Any) -> Any:
+    if isinstance(value, dict):
+        if len(value) == 1 and _BYTES_TAG in value:
+            return base64.b64decode(value[_BYTES_TAG])
+        return {key: _untag(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_untag(item) for item in value]
+    return value
+
+
+# =============================================================================
+# NÉN
+# =============================================================================
+
+
+def _load_compressors() -> dict:
+    compressors = {
+        COMPRESSION_ZLIB: (lambda b: zlib.compress(b, 1), zlib.decompress),
+    }
+    try:
+        import zstandard
+
+        compressors[COMPRESSION_ZSTD] = (
+            zstandard.ZstdCompressor(level=3).compress,
+            zstandard.ZstdDecompressor().decompress,
+        )
+    except ImportError:
+        pass
+    try:
+        import lz4.frame
+
+        compressors[COMPRESSION_LZ4] = (lz4.frame.compress, lz4.frame.decompress)
+    except ImportError:
+        pass
+    return compressors
+
+
+_COMPRESSORS = _load_compressors()
+
+_COMPRESSION_NAMES = {
+    "none": COMPRESSION_NONE,
+    "zlib": COMPRESSION_ZLIB,
+    "zstd": COMPRESSION_ZSTD,
+    "lz4": COMPRESSION_LZ4,
+}
+
+
+def _pick_compression(name: str) -> int:
+    if name == "auto":
+        for candidate in (COMPRESSION_ZSTD, COMPRESSION_LZ4, COMPRESSION_ZLIB):
+            if candidate in _COMPRESSORS:
+                return candidate
+    method = _COMPRESSION_NAMES.get(name)
+    if method is None:
+        raise ValueError(f"Unknown cache compression: {name}")
+    if method != COMPRESSION_NONE and method not in _COMPRESSORS:
+        logger.warning(f"Cache compression {name} chưa được cài, dùng zlib")
+        return COMPRESSION_ZLIB
+    return method
+
+
+# =============================================================================
+# CODEC
+# =============================================================================
+
+
+class CacheCodec:
+    """
+    Mã hóa/giải mã giá trị cache thành bytes có header phiên bản.
+
+    dumps(value, kind) -> bytes; loads(bytes) -> (kind, value). Header sai
+    (schema version khác, pickle cũ, format/nén không hỗ trợ) -> CodecError.
+    """
+
+    def __init__(
+        self,
+        fmt: str = CODEC_FORMAT,
+        compression: str = COMPRESSION,
+        compress_min_bytes: int = COMPRESS_MIN_BYTES,
+        schema_version: int = SCHEMA_VERSION,
+    ):
+        if fmt == "msgpack":
+            try:
+                import msgpack  # noqa: F401
+            except ImportError:
+                logger.warning("msgpack chưa được cài, dùng orjson cho cache")
+                fmt = "orjson"
+        if fmt not in ("orjson", "msgpack"):
+            raise ValueError(f"Unknown cache codec: {fmt}")
+        if fmt == "orjson" and orjson is None:
+            logger.warning("orjson chưa được cài, dùng json (stdlib) cho cache")
+        self.format = FORMAT_MSGPACK if fmt == "msgpack" else FORMAT_ORJSON
+        self.name = fmt
+        self.compression = _pick_compression(compression)
+        self.compress_min_bytes = compress_min_bytes
+        self.schema_version = schema_version & 0xFF
+
+    # -------------------------------------------------------------------------
+    # Format
+    # -------------------------------------------------------------------------
+
+    def _encode(self, value: Any) -> Tuple[bytes, int]:
+        if self.format == FORMAT_MSGPACK:
+            import msgpack
+
+            return msgpack.packb(value, default=_default, use_bin_type=True), 0
+
+        tagged = False
+
+        def default(obj):
+            nonlocal tagged
+            if isinstance(obj, (bytes, bytearray, memoryview)):
+                tagged = True
+                return {_BYTES_TAG: base64.b64encode(bytes(obj)).decode("ascii")}
+            return _default(obj)
+
+        if orjson is not None:
+            data = orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+        else:
+            data = json.dumps(
+                value, default=default, ensure_ascii=False, separators=(",", ":")
+            ).encode("utf-8")
+        return data, FLAG_TAGGED if tagged else 0
+
+    @staticmethod
+    def _decode(fmt: int, payload: bytes, flags: int) -> Any:
+        if fmt == FORMAT_MSGPACK:
+            import msgpack
+
+            return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+        if fmt == FORMAT_ORJSON:
+            value = orjson.loads(payload) if orjson is not None else json.loads(payload)
+            return _untag(value) if flags & FLAG_TAGGED else value
+        raise CodecError(f"Unknown cache format: {fmt}")
+
+    # -------------------------------------------------------------------------
+    # API
+    # -------------------------------------------------------------------------
+
+    def dumps(self, value: Any, kind: int = KIND_VALUE) -> bytes:
+        payload, flags = self._encode(value)
+        compression = COMPRESSION_NONE
+        if self.compression != COMPRESSION_NONE and len(payload) >= self.compress_min_bytes:
+            compressed = _COMPRESSORS[self.compression][0](payload)
+            if len(compressed) < len(payload):
+                payload, compression = compressed, self.compression
+        header = MAGIC + bytes((self.schema_version, self.format, compression, kind, flags))
+        return header + payload
+
+    def loads(self, data: bytes) -> Tuple[int, Any]:
+        if len(data) < HEADER_SIZE or data[:2] != MAGIC:
+            raise CodecError("Not a cache codec envelope")
+        version, fmt, compression, kind, flags = data[2:HEADER_SIZE]
+        if version != self.schema_version:
+            raise CodecError(f"Cache schema version {version} != {self.schema_version}")
+        payload = memoryview(data)[HEADER_SIZE:]
+        if compression != COMPRESSION_NONE:
+            if compression not in _COMPRESSORS:
+                raise CodecError(f"Unsupported cache compression: {compression}")
+            payload = _COMPRESSORS[compression][1](payload)
+        return kind, self._decode(fmt, bytes(payload), flags)
+
+    def describe(self) -> dict:
+        names = {v: k for k, v in _COMPRESSION_NAMES.items()}
+        return {
+            "format": self.name,
+            "compression": names[self.compression],
+            "compress_min_bytes": self.compress_min_bytes,
+            "schema_version": self.schema_version,
+        }
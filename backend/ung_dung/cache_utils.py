@@ -2,9 +2,11 @@
 Cache utilities cho IVIE Wedding API
 Giúp giảm TTFB bằng cách cache response tĩnh
 """
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from fastapi import Response
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .route_rules import RouteMatcher
 
 # Cache durations (seconds)
 CACHE_TINY = 60        # 1 phút - cho banners
@@ -28,38 +30,50 @@ CACHE_RULES = {
 }
 
 
-class CacheControlMiddleware(BaseHTTPMiddleware):
+# CACHE_RULES biên dịch thành cây segment (rule khớp prefix theo segment)
+_CACHE_MATCHER = RouteMatcher((pattern, duration, True) for pattern, duration in CACHE_RULES.items())
+
+
+def _cache_duration(path: str) -> int:
+    """Thời gian cache theo rule khớp sâu nhất"""
+    found = _CACHE_MATCHER.match(path)
+    return found[0] if found else CACHE_NONE
+
+
+class CacheControlMiddleware:
     """
-    Middleware tự động thêm Cache-Control headers cho GET requests
+    Middleware tự động thêm Cache-Control headers cho GET requests.
+    ASGI thuần: chỉ sửa headers của message http.response.start, body đi thẳng.
     """
-    
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        
-        # Chỉ cache GET requests
-        if request.method != "GET":
-            response.headers["Cache-Control"] = "no-store"
-            return response
-        
-        # Tìm cache rule phù hợp
-        path = request.url.path
-        cache_duration = CACHE_NONE
-        
-        for pattern, duration in CACHE_RULES.items():
-            if path.startswith(pattern):
-                cache_duration = duration
-                break
-        
-        # Set cache headers
-        if cache_duration > 0:
-            response.headers["Cache-Control"] = f"public, max-age={cache_duration}"
-            response.headers["Vary"] = "Accept-Encoding"
-        else:
-            # Không cache cho các endpoint khác
-            if "/api/" in path:
-                response.headers["Cache-Control"] = "no-cache"
-        
-        return response
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        is_get = scope["method"] == "GET"
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                # Chỉ cache GET requests
+                if not is_get:
+                    headers["Cache-Control"] = "no-store"
+                else:
+                    cache_duration = _cache_duration(path)
+                    if cache_duration > 0:
+                        headers["Cache-Control"] = f"public, max-age={cache_duration}"
+                        headers["Vary"] = "Accept-Encoding"
+                    elif "/api/" in path:
+                        # Không cache cho các endpoint khác
+                        headers["Cache-Control"] = "no-cache"
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
 
 
 def set_cache_headers(response: Response, max_age: int = CACHE_SHORT, public: bool = True):
@@ -0,0 +1,80 @@
+"""
+Cache warmer cho IVIE Wedding Studio
+- Render trước vào response cache các URL khách mở đầu tiên: trang đầu
+  danh sách sản phẩm (mỗi danh mục, mỗi giới tính), banner, thư viện,
+  điểm nhấn trang chủ, giới thiệu, chuyên gia, combo
+- URL và query giống hệt frontend gọi (cache key gồm path và query)
+- Import module này để đăng ký warmer với cache_warmer
+"""
+
+import asyncio
+from typing import List
+from urllib.parse import urlencode
+
+from sqlalchemy import select
+
+from .cache_advanced import cache_warmer
+from .co_so_du_lieu import PhienLamViec, SanPham
+
+# Sắp xếp mặc định của trang sản phẩm (frontend: sort_by=hot)
+SAP_XEP_MAC_DINH = "hot"
+
+
+def _danh_muc_san_pham() -> List[str]:
+    """Các danh mục đang có sản phẩm"""
+    phien = PhienLamViec()
+    try:
+        return [
+            danh_muc
+            for danh_muc in phien.execute(select(SanPham.category).distinct()).scalars()
+            if danh_muc
+        ]
+    finally:
+        phien.close()
+
+
+@cache_warmer.register
+async def warm_product_lists():
+    """Trang đầu danh sách sản phẩm: tất cả, từng danh mục, từng giới tính"""
+    danh_muc = await asyncio.to_thread(_danh_muc_san_pham)
+    paths = [
+        "/api/san_pham/",
+        ("/api/san_pham/", f"sort_by={SAP_XEP_MAC_DINH}"),
+        ("/api/san_pham/", "gioi_tinh=female"),
+        ("/api/san_pham/", "gioi_tinh=male"),
+    ]
+    paths.extend(
+        ("/api/san_pham/", urlencode({"sort_by": SAP_XEP_MAC_DINH, "danh_muc": ten}))
+        for ten in danh_muc
+    )
+    return await cache_warmer.warm_paths(paths)
+
+
+@cache_warmer.register
+async def warm_banners():
+    return await cache_warmer.warm_paths(["/api/banner/"])
+
+
+@cache_warmer.register
+async def warm_gallery():
+    return await cache_warmer.warm_paths(["/api/thu_vien/"])
+
+
+@cache_warmer.register
+async def warm_home_highlights():
+    return await cache_warmer.warm_paths(["/api/noi_dung/diem_nhan"])
+
+
+@cache_warmer.register
+async def warm_about_us():
+    return await cache_warmer.warm_paths(["/api/noi_dung/gioi_thieu"])
+
+
+@cache_warmer.register
+async def warm_experts():
+    return await cache_warmer.warm_paths(["/api/dich_vu/chuyen_gia"])
+
+
+@cache_warmer.register
+async def warm_combos():
+    return await cache_warmer.warm_paths([("/pg/combo", "hoat_dong=true")])
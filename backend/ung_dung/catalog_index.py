@@ -0,0 +1,380 @@
+"""
+Chỉ mục danh mục sản phẩm trong bộ nhớ cho IVIE Wedding Studio
+- Bản ghi sản phẩm gọn (__slots__) kèm payload đã serialize sẵn cho response
+- Posting lists theo category, sub_category, gender, is_hot, is_new
+- Mảng (giá, id) đã sắp xếp để lọc khoảng giá và sort theo giá bằng bisect
+- Trả lời filter + sort + count + page không cần truy vấn database
+- Cập nhật tăng dần qua product_events khi route tạo/sửa/xóa commit
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import product_events
+from .pagination import sort_key
+
+logger = logging.getLogger(__name__)
+
+# Các trường có posting list (giá trị -> tập id sản phẩm)
+INDEXED_FIELDS = ("category", "sub_category", "gender", "is_hot", "is_new")
+
+# Sort spec (trường, giảm dần?) tương ứng với thứ tự của _ordered_ids,
+# dùng cho keyset cursor ở cả chỉ mục và truy vấn SQL dự phòng
+SORT_SPECS = {
+    "price_asc": [("rental_price_day", False), ("id", False)],
+    "price_desc": [("rental_price_day", True), ("id", True)],
+    "hot": [("is_hot", True), ("id", True)],
+    "new": [("is_new", True), ("id", True)],
+    None: [("id", True)],
+}
+
+# Build lại toàn bộ sau khoảng thời gian này (giây) để đồng bộ thay đổi
+# từ worker/instance khác. 0 = không tự build lại.
+MAX_AGE = int(os.getenv("CATALOG_INDEX_MAX_AGE", "600"))
+
+
+class _ProductRecord:
+    """Bản ghi gọn của một sản phẩm trong chỉ mục"""
+
+    __slots__ = ("id", "category", "sub_category", "gender", "is_hot", "is_new", "price", "data")
+
+    def __init__(self, data: Dict[str, Any]):
+        self.id = data["id"]
+        self.category = data.get("category")
+        self.sub_category = data.get("sub_category")
+        self.gender = data.get("gender")
+        self.is_hot = bool(data.get("is_hot"))
+        self.is_new = bool(data.get("is_new"))
+        self.price = float(data.get("rental_price_day") or 0)
+        self.data = data
+
+
+def _serialize(san_pham) -> Dict[str, Any]:
+    """ORM SanPham -> dict theo schema response SanPham"""
+    from .mo_hinh import SanPham
+
+    return SanPham.model_validate(san_pham).model_dump()
+
+
+class ProductCatalogIndex:
+    """
+    Chỉ mục sản phẩm process-local.
+
+    Thread-safe: mọi thao tác đọc/ghi đi qua một RLock. Truy vấn chỉ tốn
+    vài micro giây nên tranh chấp lock không đáng kể. Việc đọc database khi
+    build nằm ngoài RLock (chỉ giữ _build_lock) nên không chặn người đọc;
+    ghi đến trong lúc đó được ghi nhật ký và phát lại lên snapshot mới.
+
+    query() chỉ đọc chỉ mục đã build. Route async gọi ensure_loaded_async()
+    trước: build chạy trong thread riêng với session sync, không bao giờ giữ
+    lock thread trên event loop (kể cả trong run_sync).
+    """
+
+    def __init__(self, max_age: int = MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._build_lock = threading.RLock()
+        self._async_lock = asyncio.Lock()
+        self._loaded = False
+        self._built_at = 0.0
+        self._records: Dict[int, _ProductRecord] = {}
+        self._postings: Dict[str, Dict[Any, Set[int]]] = {f: {} for f in INDEXED_FIELDS}
+        self._by_price: List[Tuple[float, int]] = []
+        self._ids_desc: List[int] = []  # lưu dạng -id để bisect tăng dần
+        # Tăng ở mỗi upsert/remove/invalidate; build so sánh trước/sau khi đọc DB
+        self._generation = 0
+        # Ghi đến trong lúc build đang đọc DB (None = không có build nào)
+        self._journal: Optional[List[Tuple[str, Any]]] = None
+        self.hits = 0
+        self.rebuilds = 0
+
+    # -------------------------------------------------------------------------
+    # Build / cập nhật
+    # -------------------------------------------------------------------------
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def _is_stale(self) -> bool:
+        if not self._loaded:
+            return True
+        return self.max_age > 0 and time.time() - self._built_at > self.max_age
+
+    def build(self, csdl) -> int:
+        """
+        Build lại toàn bộ chỉ mục từ database.
+
+        Snapshot đọc từ DB có thể cũ hơn các ghi đến trong lúc đọc: nếu
+        generation đã đổi thì phát lại nhật ký lên snapshot mới; có
+        invalidate thì để chỉ mục ở trạng thái chưa load (build lại lần sau).
+        """
+        from .co_so_du_lieu import SanPham as SanPhamDB
+
+        with self._build_lock:
+            with self._lock:
+                generation = self._generation
+                self._journal = []
+            try:
+                records = [_ProductRecord(_serialize(sp)) for sp in csdl.query(SanPhamDB).all()]
+            except Exception:
+                with self._lock:
+                    self._journal = None
+                raise
+
+            with self._lock:
+                journal, self._journal = self._journal, None
+                self._records = {}
+                self._postings = {f: {} for f in INDEXED_FIELDS}
+                self._by_price = []
+                self._ids_desc = []
+                for record in records:
+                    self._add(record, sort=False)
+                self._by_price.sort()
+                self._ids_desc.sort()
+                fresh = self._replay(journal) if self._generation != generation else True
+                self._loaded = fresh
+                self._built_at = time.time()
+                self.rebuilds += 1
+
+        logger.info(f"Catalog index built: {len(records)} products")
+        return len(records)
+
+    def ensure_loaded(self) -> None:
+        """
+        Build chỉ mục (session riêng) nếu chưa có hoặc đã quá MAX_AGE.
+
+        Blocking: chỉ gọi từ thread thường (startup, threadpool), không gọi
+        trên event loop.
+        """
+        if self._is_stale():
+            with self._build_lock:
+                if self._is_stale():
+                    from .co_so_du_lieu import PhienLamViec
+
+                    csdl = PhienLamViec()
+                    try:
+                        self.build(csdl)
+                    finally:
+                        csdl.close()
+
+    async def ensure_loaded_async(self) -> None:
+        """ensure_loaded() ngoài event loop; mỗi lúc một coroutine build"""
+        if self._is_stale():
+            async with self._async_lock:
+                if self._is_stale():
+                    await asyncio.to_thread(self.ensure_loaded)
+
+    def _add(self, record: _ProductRecord, sort: bool = True) -> None:
+        self._records[record.id] = record
+        for field in INDEXED_FIELDS:
+            self._postings[field].setdefault(getattr(record, field), set()).add(record.id)
+        if sort:
+            bisect.insort(self._by_price, (record.price, record.id))
+            bisect.insort(self._ids_desc, -record.id)
+        else:
+            self._by_price.append((record.price, record.id))
+            self._ids_desc.append(-record.id)
+
+    def _remove(self, product_id: int) -> None:
+        record = self._records.pop(product_id, None)
+        if record is None:
+            return
+        for field in INDEXED_FIELDS:
+            value = getattr(record, field)
+            ids = self._postings[field].get(value)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._postings[field][value]
+        pos = bisect.bisect_left(self._by_price, (record.price, record.id))
+        if pos < len(self._by_price) and self._by_price[pos] == (record.price, record.id):
+            del self._by_price[pos]
+        pos = bisect.bisect_left(self._ids_desc, -record.id)
+        if pos < len(self._ids_desc) and self._ids_desc[pos] == -record.id:
+            del self._ids_desc[pos]
+
+    def _log_write(self, op: str, arg: Any) -> None:
+        # Gọi khi đang giữ _lock
+        self._generation += 1
+        if self._journal is not None:
+            self._journal.append((op, arg))
+
+    def _replay(self, journal: List[Tuple[str, Any]]) -> bool:
+        """Phát lại ghi trong lúc build; False nếu có invalidate"""
+        fresh = True
+        for op, arg in journal:
+            if op == "upsert":
+                for record in arg:
+                    self._remove(record.id)
+                    self._add(record)
+            elif op == "remove":
+                for product_id in arg:
+                    self._remove(product_id)
+            else:
+                fresh = False
+        return fresh
+
+    def upsert_products(self, products: Iterable[Any]) -> None:
+        """Thêm/cập nhật sản phẩm (ORM instances) vào chỉ mục"""
+        records = [_ProductRecord(_serialize(sp)) for sp in products]
+        with self._lock:
+            self._log_write("upsert", records)
+            if not self._loaded:
+                return  # Lần truy vấn đầu tiên sẽ build đầy đủ
+            for record in records:
+                self._remove(record.id)
+                self._add(record)
+
+    def remove_products(self, ids: Iterable[int]) -> None:
+        """Xóa sản phẩm khỏi chỉ mục"""
+        ids = list(ids)
+        with self._lock:
+            self._log_write("remove", ids)
+            for product_id in ids:
+                self._remove(product_id)
+
+    def invalidate(self) -> None:
+        """Đánh dấu cần build lại toàn bộ ở lần truy vấn tiếp theo"""
+        with self._lock:
+            self._log_write("invalidate", None)
+            self._loaded = False
+
+    # -------------------------------------------------------------------------
+    # Truy vấn
+    # -------------------------------------------------------------------------
+
+    def _candidates(
+        self,
+        filters: Dict[str, Any],
+        price_min: Optional[float],
+        price_max: Optional[float],
+    ) -> Optional[Set[int]]:
+        """Giao các posting lists. None = không có bộ lọc (toàn bộ sản phẩm)"""
+        sets: List[Set[int]] = []
+        for field, value in filters.items():
+            if value is None:
+                continue
+            sets.append(self._postings[field].get(value, set()))
+
+        if price_min is not None or price_max is not None:
+            lo = 0
+            hi = len(self._by_price)
+            if price_min is not None:
+                lo = bisect.bisect_left(self._by_price, (float(price_min), float("-inf")))
+            if price_max is not None:
+                hi = bisect.bisect_right(self._by_price, (float(price_max), float("inf")))
+            sets.append({pid for _, pid in self._by_price[lo:hi]})
+
+        if not sets:
+            return None
+        sets.sort(key=len)
+        result = set(sets[0])
+        for s in sets[1:]:
+            result &= s
+            if not result:
+                break
+        return result
+
+    def _ordered_ids(self, candidates: Optional[Set[int]], sort_by: Optional[str]) -> List[int]:
+        """Danh sách id đã lọc theo thứ tự sort_by"""
+        if sort_by in ("price_asc", "price_desc"):
+            source = (pid for _, pid in self._by_price)
+            if sort_by == "price_desc":
+                source = (pid for _, pid in reversed(self._by_price))
+        else:
+            source = (-neg for neg in self._ids_desc)
+
+        if candidates is None:
+            ordered = list(source)
+        else:
+            ordered = [pid for pid in source if pid in candidates]
+
+        if sort_by == "hot":
+            records = self._records
+            ordered = [p for p in ordered if records[p].is_hot] + [
+                p for p in ordered if not records[p].is_hot
+            ]
+        elif sort_by == "new":
+            records = self._records
+            ordered = [p for p in ordered if records[p].is_new] + [
+                p for p in ordered if not records[p].is_new
+            ]
+        return ordered
+
+    def query(
+        self,
+        *,
+        category: Optional[str] = None,
+        sub_category: Optional[str] = None,
+        gender: Optional[str] = None,
+        is_hot: Optional[bool] = None,
+        is_new: Optional[bool] = None,
+        price_min: Optional[float] = None,
+        price_max: Optional[float] = None,
+        sort_by: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 0,
+        after: Optional[List[Any]] = None,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Lọc + sắp xếp + đếm + phân trang trên chỉ mục đã build (không đọc
+        database, không chờ build).
+
+        Args:
+            limit: 0 = trả về tất cả
+            after: Giá trị sort key (theo SORT_SPECS) của item cuối trang
+                trước; khi có thì seek bằng bisect và bỏ qua offset
+
+        Returns:
+            (danh sách dict sản phẩm, tổng số khớp bộ lọc)
+        """
+        filters = {
+            "category": category or None,
+            "sub_category": sub_category or None,
+            "gender": gender or None,
+            "is_hot": is_hot,
+            "is_new": is_new,
+        }
+
+        with self._lock:
+            if not self._loaded:
+                raise RuntimeError("Catalog index chưa được build")
+            candidates = self._candidates(filters, price_min, price_max)
+            ordered = self._ordered_ids(candidates, sort_by)
+            total = len(ordered)
+            if after is not None:
+                spec = SORT_SPECS.get(sort_by, SORT_SPECS[None])
+                fields = [field for field, _ in spec]
+                keys = [
+                    sort_key([self._records[pid].data.get(f) for f in fields], spec)
+                    for pid in ordered
+                ]
+                offset = bisect.bisect_right(keys, sort_key(after, spec))
+            page = ordered[offset : offset + limit] if limit and limit > 0 else ordered[offset:]
+            items = [self._records[pid].data for pid in page]
+            self.hits += 1
+
+        return items, total
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê chỉ mục"""
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "products": len(self._records),
+                "categories": len(self._postings["category"]),
+                "built_at": self._built_at,
+                "rebuilds": self.rebuilds,
+                "generation": self._generation,
+                "queries": self.hits,
+            }
+
+
+# Global catalog index instance
+catalog_index = product_events.register(ProductCatalogIndex())
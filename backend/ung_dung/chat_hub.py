@@ -0,0 +1,200 @@
+"""
+Hub pub/sub cho chat thời gian thực của IVIE Wedding Studio
+- Mỗi user một kênh "user:{id}"; kênh "admin" nhận tin của mọi hội thoại
+- Subscriber là asyncio.Queue giới hạn trong event loop của worker; hàng
+  đợi đầy (client chậm) thì bỏ tin đang chờ, gửi "resync" để client tự lấy
+  bù qua /lich_su?sau_id=...
+- Có REDIS_URL: tin được publish qua Redis pub/sub nên mọi worker/instance
+  đều nhận; không có Redis thì phát trong process
+- Transport: WebSocket và Server-Sent Events (fallback) dùng chung hub
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+CHAT_CHANNEL = os.getenv("CHAT_CHANNEL", "chat:messages")
+# Số tin tối đa chờ gửi mỗi kết nối (đầy thì bỏ và gửi resync)
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", "100"))
+# Chu kỳ heartbeat của kết nối SSE / WebSocket (giây)
+CHAT_HEARTBEAT = float(os.getenv("CHAT_HEARTBEAT", "15"))
+
+ADMIN_CHANNEL = "admin"
+
+# Message gửi client khi hub có thể đã lỡ tin (mất kết nối Redis, hàng đợi đầy)
+RESYNC = {"type": "resync"}
+
+
+def user_channel(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+# =============================================================================
+# HUB
+# =============================================================================
+
+
+class ChatHub:
+    """
+    Phát tin chat tới các kết nối đang mở.
+
+    publish() gọi được từ route sync (threadpool); việc đưa tin vào hàng đợi
+    luôn chạy trên event loop của worker (call_soon_threadsafe).
+    """
+
+    def __init__(self, channel: str = CHAT_CHANNEL, queue_size: int = CHAT_QUEUE_SIZE):
+        self.channel = channel
+        self.queue_size = queue_size
+        self._broker = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def _get_broker(self):
+        if self._broker is None:
+            with self._lock:
+                if self._broker is None:
+                    # Import khi dùng lần đầu: kết nối Redis không nằm trên đường khởi động
+                    from .cache_advanced import redis_client
+
+                    broker = redis_client.broker(self.channel)
+                    broker.subscribe(self._on_message)
+                    self._broker = broker
+        return self._broker
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        """Phát một tin (dict JSON được, có user_id) tới kênh của user và admin"""
+        self.published += 1
+        self._get_broker().publish(message)
+
+    def _on_message(self, message: Dict[str, Any]) -> None:
+        # Thread của broker (Redis) hoặc thread gọi publish (trong process)
+        loop = self._loop
+        if loop is None or not self._subscribers or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._deliver, message)
+
+    def _deliver(self, message: Dict[str, Any]) -> None:
+        if message.get("all"):
+            # Broker mất kết nối: client lấy bù qua lịch sử
+            queues = [q for subs in self._subscribers.values() for q in subs]
+            event = RESYNC
+        else:
+            queues = list(self._subscribers.get(user_channel(message.get("user_id")), ()))
+            queues.extend(self._subscribers.get(ADMIN_CHANNEL, ()))
+            event = {"type": "message", "message": message}
+        for queue in queues:
+            if queue.full():
+                # Client chậm: bỏ các tin đang chờ, client lấy bù qua lịch sử
+                self.dropped += queue.qsize()
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+                continue
+            queue.put_nowait(event)
+            self.delivered += 1
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[asyncio.Queue]:
+        """Hàng đợi nhận tin của kênh trong lúc kết nối còn mở"""
+        self._loop = asyncio.get_running_loop()
+        self._get_broker()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(channel, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self._broker).__name__ if self._broker else None,
+            "connections": sum(len(s) for s in self._subscribers.values()),
+            "channels": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+chat_hub = ChatHub()
+
+
+# =============================================================================
+# TRANSPORTS
+# =============================================================================
+
+
+async def pump_websocket(websocket: WebSocket, channel: str) -> None:
+    """
+    Gửi tin của kênh qua WebSocket đã accept tới khi client ngắt.
+    Tin client gửi lên chỉ dùng làm keepalive (bỏ qua nội dung).
+    """
+
+    async def drain_incoming():
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    async with chat_hub.subscribe(channel) as queue:
+        receiver = asyncio.create_task(drain_incoming())
+        try:
+            while not receiver.done():
+                getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait(
+                    {getter, receiver},
+                    timeout=CHAT_HEARTBEAT,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if getter not in done:
+                    getter.cancel()
+                    if not done:
+                        await websocket.send_json({"type": "ping"})
+                    continue
+                await websocket.send_json(getter.result())
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            receiver.cancel()
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    if event["type"] == "message":
+        message = event["message"]
+        return f"id: {message['id']}\nevent: message\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+    return f"event: {event['type']}\ndata: {{}}\n\n"
+
+
+async def sse_events(channel: str) -> AsyncIterator[str]:
+    """Luồng Server-Sent Events của kênh (heartbeat mỗi CHAT_HEARTBEAT giây)"""
+    async with chat_hub.subscribe(channel) as queue:
+        # Gửi ngay để proxy/trình duyệt mở luồng
+        yield "retry: 3000\n: connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=CHAT_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield _sse(event)
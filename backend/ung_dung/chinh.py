@@ -1,30 +1,18 @@
 import os
 
+# Import trước thư viện nặng: mốc 0 của thời gian khởi động
+from .startup_profile import startup_profile
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
 from .cache_utils import CacheControlMiddleware
-from .co_so_du_lieu import khoi_tao_csdl
-from .dinh_tuyen import (
-    api_postgresql as api_pg,
-    anh_bia as banner,
-    bai_viet as blog,
-    tro_chuyen as chat,
-    dich_vu,
-    doi_tac,
-    don_hang,
-    lien_he,
-    nguoi_dung,
-    noi_dung,
-    san_pham,
-    tep_tin as tap_tin,
-    thong_ke,
-    thu_vien,
-    yeu_thich,
-)
+from .co_so_du_lieu import dong_co, dong_csdl_async, khoi_tao_csdl
+from .dinh_tuyen import CAC_BO_DINH_TUYEN
 
 load_dotenv()
 
@@ -59,7 +47,7 @@ ung_dung.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Total-Count"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "X-Access-Token"],
 )
 
 # Gắn thư mục tĩnh cho hình ảnh (để Admin panel và API có thể truy cập)
@@ -77,28 +65,50 @@ thu_muc_tep_tin = "tep_tin"
 os.makedirs(thu_muc_tep_tin, exist_ok=True)
 ung_dung.mount("/tep_tin", StaticFiles(directory=thu_muc_tep_tin), name="tep_tin")
 
-# Bao gồm các bộ định tuyến
-ung_dung.include_router(san_pham.bo_dinh_tuyen)
-ung_dung.include_router(dich_vu.bo_dinh_tuyen)
-ung_dung.include_router(lien_he.bo_dinh_tuyen)
-ung_dung.include_router(tap_tin.bo_dinh_tuyen)
-ung_dung.include_router(banner.bo_dinh_tuyen)
-ung_dung.include_router(noi_dung.bo_dinh_tuyen)
-ung_dung.include_router(thu_vien.bo_dinh_tuyen)
-ung_dung.include_router(nguoi_dung.bo_dinh_tuyen)
-ung_dung.include_router(chat.bo_dinh_tuyen)
-ung_dung.include_router(doi_tac.bo_dinh_tuyen)
-ung_dung.include_router(blog.bo_dinh_tuyen)
-ung_dung.include_router(yeu_thich.bo_dinh_tuyen)
-ung_dung.include_router(thong_ke.bo_dinh_tuyen)
-ung_dung.include_router(api_pg.bo_dinh_tuyen)
-ung_dung.include_router(don_hang.bo_dinh_tuyen)
+# Bao gồm các bộ định tuyến (import có đo thời gian từng module, xem /api/startup)
+for ten_module in CAC_BO_DINH_TUYEN:
+    module = startup_profile.import_module(f".dinh_tuyen.{ten_module}", __package__)
+    ung_dung.include_router(module.bo_dinh_tuyen)
+
+startup_profile.mark_app_loaded()
+
+
+def _build_indexes():
+    """Build index còn thiếu (CONCURRENTLY trên PostgreSQL)"""
+    from .co_so_du_lieu_optimized import create_indexes
+
+    create_indexes(dong_co)
+
+
+def _build_catalog_index():
+    """Build chỉ mục danh mục sản phẩm trước request đầu tiên"""
+    from .catalog_index import catalog_index
+
+    catalog_index.ensure_loaded()
 
 
 @ung_dung.on_event("startup")
 def su_kien_khoi_dong():
-    """Khởi tạo cơ sở dữ liệu khi khởi động"""
-    khoi_tao_csdl()
+    """
+    Khởi tạo cơ sở dữ liệu ở thread nền: server nhận request ngay,
+    /ready trả 200 khi migration xong
+    """
+    startup_profile.run_background(
+        [("khoi_tao_csdl", khoi_tao_csdl)],
+        after_ready=[
+            ("create_indexes", _build_indexes),
+            ("catalog_index", _build_catalog_index),
+        ],
+    )
+
+
+@ung_dung.on_event("shutdown")
+async def su_kien_tat():
+    """Đóng pool kết nối async và process pool băm mật khẩu khi tắt"""
+    from .password_hasher import password_hasher
+
+    password_hasher.shutdown()
+    await dong_csdl_async()
 
 
 @ung_dung.get("/")
@@ -115,12 +125,34 @@ def kiem_tra_suc_khoe():
     return {"trang_thai": "khoe_manh"}
 
 
+@ung_dung.get("/ready")
+def kiem_tra_san_sang():
+    """Readiness: 503 cho tới khi khởi tạo CSDL xong (health check của Render)"""
+    if not startup_profile.is_ready:
+        return JSONResponse({"ready": False}, status_code=503)
+    return {"ready": True, "ready_ms": startup_profile.ready_ms}
+
+
+@ung_dung.get("/api/startup")
+def startup_report():
+    """Thời gian import từng module và từng bước khởi tạo của process này"""
+    return startup_profile.report()
+
+
 @ung_dung.get("/api/health")
 def health_check():
     """Health check endpoint for Render"""
     return {"status": "healthy", "version": "2.0.1"}
 
 
+@ung_dung.get("/api/health/pools")
+def pool_stats():
+    """Thống kê connection pool (thời gian chờ checkout, timeout) của process này"""
+    from .db_engine import pool_stats as thong_ke_pool
+
+    return {"pools": thong_ke_pool()}
+
+
 @ung_dung.get("/api/test-products")
 def test_products():
     """Test endpoint to check products API"""
@@ -9,18 +9,23 @@ IVIE Wedding Studio API - Phiên bản tối ưu hóa
 - Health checks với cache stats
 """
 
+import asyncio
 import logging
 import os
 import time
 from contextlib import asynccontextmanager
 from datetime import datetime
 
+# Import trước thư viện nặng: mốc 0 của thời gian khởi động
+from .startup_profile import startup_profile
+
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 # Load environment variables
 load_dotenv()
@@ -36,6 +41,48 @@ logger = logging.getLogger(__name__)
 # =============================================================================
 
 
+def _init_database():
+    from .co_so_du_lieu import khoi_tao_csdl
+
+    khoi_tao_csdl()
+    logger.info("✅ Database initialized")
+
+
+def _build_indexes():
+    """Index khai báo trên models: build phần còn thiếu"""
+    from .co_so_du_lieu import dong_co
+    from .co_so_du_lieu_optimized import create_indexes
+
+    create_indexes(dong_co)
+
+
+def _build_autocomplete():
+    from .autocomplete import product_autocomplete
+    from .co_so_du_lieu import PhienLamViec
+
+    csdl = PhienLamViec()
+    try:
+        product_autocomplete.build(csdl)
+    finally:
+        csdl.close()
+    logger.info("✅ Autocomplete index built")
+
+
+def _build_catalog_index():
+    from .catalog_index import catalog_index
+
+    catalog_index.ensure_loaded()
+
+
+async def _warm_cache():
+    from . import cache_warmup  # noqa: F401 - đăng ký warmer
+    from .cache_advanced import CACHE_WARMUP_INTERVAL, cache_warmer
+
+    while not startup_profile.is_ready:
+        await asyncio.sleep(0.5)
+    await cache_warmer.run_periodic(CACHE_WARMUP_INTERVAL)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -46,33 +93,8 @@ async def lifespan(app: FastAPI):
     # STARTUP
     logger.info("🚀 Starting IVIE Wedding API...")
 
-    # Initialize database
     try:
-        from .co_so_du_lieu import khoi_tao_csdl
-
-        khoi_tao_csdl()
-        logger.info("✅ Database initialized")
-    except Exception as e:
-        logger.error(f"❌ Database initialization failed: {e}")
-
-    # Initialize optimized database with indexes
-    try:
-        from .co_so_du_lieu_optimized import (
-            create_indexes,
-            get_engine,
-            init_database_optimized,
-        )
-
-        init_database_optimized()
-        logger.info("✅ Database indexes created")
-    except ImportError:
-        logger.info("ℹ️ Optimized database module not available, using standard")
-    except Exception as e:
-        logger.warning(f"⚠️ Could not create indexes: {e}")
-
-    # Initialize cache
-    try:
-        from .cache_advanced import cache_warmer, redis_client
+        from .cache_advanced import redis_client
 
         if redis_client.is_connected:
             logger.info("✅ Redis cache connected")
@@ -81,10 +103,35 @@ async def lifespan(app: FastAPI):
     except ImportError:
         logger.info("ℹ️ Advanced cache not available")
 
+    # Khởi tạo ở thread nền: server nhận request ngay, /ready trả 200 khi
+    # migration xong; index (CONCURRENTLY trên PostgreSQL), trie autocomplete
+    # và chỉ mục danh mục build sau khi đã sẵn sàng
+    startup_profile.run_background(
+        [("khoi_tao_csdl", _init_database)],
+        after_ready=[
+            ("create_indexes", _build_indexes),
+            ("autocomplete", _build_autocomplete),
+            ("catalog_index", _build_catalog_index),
+        ],
+    )
+
+    # Warm response cache khi đã sẵn sàng, lặp lại trước khi entry hết TTL
+    warmup_task = None
+    try:
+        from .cache_advanced import CACHE_WARMUP_ENABLED
+
+        if CACHE_WARMUP_ENABLED:
+            warmup_task = asyncio.create_task(_warm_cache())
+    except ImportError:
+        pass
+
     logger.info("🎉 IVIE Wedding API started successfully!")
 
     yield  # Application runs here
 
+    if warmup_task is not None:
+        warmup_task.cancel()
+
     # SHUTDOWN
     logger.info("🛑 Shutting down IVIE Wedding API...")
 
@@ -99,6 +146,17 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"⚠️ Cleanup warning: {e}")
 
+    try:
+        from .co_so_du_lieu import dong_csdl_async
+
+        await dong_csdl_async()
+    except Exception as e:
+        logger.warning(f"⚠️ Async engine cleanup warning: {e}")
+
+    from .password_hasher import password_hasher
+
+    password_hasher.shutdown()
+
     logger.info("👋 IVIE Wedding API shutdown complete")
 
 
@@ -119,21 +177,13 @@ ung_dung = FastAPI(
 # MIDDLEWARE CONFIGURATION
 # =============================================================================
 
+# Middleware đều là ASGI thuần (không qua BaseHTTPMiddleware). Middleware
+# thêm sau nằm ngoài: Timing -> CORS -> Rate Limit -> Advanced Cache -> Cache Control -> GZip
+
 # 1. GZip Middleware - Nén response > 500 bytes
 ung_dung.add_middleware(GZipMiddleware, minimum_size=500)
 
-# 2. CORS Middleware
-nguon_goc = os.getenv("CORS_ORIGINS", "*").split(",")
-ung_dung.add_middleware(
-    CORSMiddleware,
-    allow_origins=nguon_goc,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["X-Total-Count", "X-Cache", "X-Cache-TTL", "X-Response-Time"],
-)
-
-# 3. Cache Control Middleware
+# 2. Cache Control Middleware
 try:
     from .cache_utils import CacheControlMiddleware
 
@@ -141,7 +191,7 @@ try:
 except ImportError:
     logger.info("ℹ️ Basic cache middleware not available")
 
-# 4. Advanced Cache Middleware (nếu có)
+# 3. Advanced Cache Middleware (nếu có) - hit trả trước routing
 try:
     from .cache_advanced import AdvancedCacheMiddleware
 
@@ -150,30 +200,74 @@ try:
 except ImportError:
     pass
 
+# 4. Rate Limit Middleware - đếm cả cache hit; 429 vẫn có header CORS
+from .rate_limit import RATE_LIMIT_ENABLED, RateLimitMiddleware
+
+if RATE_LIMIT_ENABLED:
+    ung_dung.add_middleware(RateLimitMiddleware)
+    logger.info("✅ Rate limit middleware enabled")
+
+# 5. CORS Middleware - nằm ngoài response cache để header CORS tính theo
+# Origin của từng request, không bị lưu kèm response
+nguon_goc = os.getenv("CORS_ORIGINS", "*").split(",")
+ung_dung.add_middleware(
+    CORSMiddleware,
+    allow_origins=nguon_goc,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=[
+        "X-Total-Count",
+        "X-Next-Cursor",
+        "X-Access-Token",
+        "X-Cache",
+        "X-Cache-TTL",
+        "X-Response-Time",
+        "ETag",
+        "RateLimit-Limit",
+        "RateLimit-Remaining",
+        "RateLimit-Reset",
+        "RateLimit-Policy",
+        "Retry-After",
+    ],
+)
+
 
 # =============================================================================
 # REQUEST TIMING MIDDLEWARE
 # =============================================================================
 
 
-@ung_dung.middleware("http")
-async def add_response_timing(request: Request, call_next):
-    """Middleware để track response time"""
-    start_time = time.time()
+class ResponseTimingMiddleware:
+    """Middleware để track response time (thời gian tới khi gửi headers)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                process_time = time.perf_counter() - start_time
+                message.setdefault("headers", []).append(
+                    (b"x-response-time", f"{process_time:.4f}s".encode("latin-1"))
+                )
+            await send(message)
 
-    response = await call_next(request)
+        await self.app(scope, receive, send_with_timing)
 
-    # Calculate response time
-    process_time = time.time() - start_time
-    response.headers["X-Response-Time"] = f"{process_time:.4f}s"
+        # Log slow requests (> 2 seconds)
+        process_time = time.perf_counter() - start_time
+        if process_time > 2.0:
+            logger.warning(f"Slow request: {scope['method']} {scope['path']} - {process_time:.2f}s")
 
-    # Log slow requests (> 2 seconds)
-    if process_time > 2.0:
-        logger.warning(
-            f"Slow request: {request.method} {request.url.path} - {process_time:.2f}s"
-        )
 
-    return response
+ung_dung.add_middleware(ResponseTimingMiddleware)
 
 
 # =============================================================================
@@ -199,52 +293,26 @@ ung_dung.mount("/tep_tin", StaticFiles(directory=thu_muc_tep_tin), name="tep_tin
 # ROUTERS
 # =============================================================================
 
-from .dinh_tuyen import (
-    api_pg,
-    banner,
-    blog,
-    chat,
-    dich_vu,
-    doi_tac,
-    don_hang,
-    lien_he,
-    nguoi_dung,
-    noi_dung,
-    san_pham,
-    tap_tin,
-    thong_ke,
-    thu_vien,
-    yeu_thich,
-)
+from .dinh_tuyen import CAC_BO_DINH_TUYEN
 
-# Standard routers
-ung_dung.include_router(san_pham.bo_dinh_tuyen)
-ung_dung.include_router(dich_vu.bo_dinh_tuyen)
-ung_dung.include_router(lien_he.bo_dinh_tuyen)
-ung_dung.include_router(tap_tin.bo_dinh_tuyen)
-ung_dung.include_router(banner.bo_dinh_tuyen)
-ung_dung.include_router(noi_dung.bo_dinh_tuyen)
-ung_dung.include_router(thu_vien.bo_dinh_tuyen)
-ung_dung.include_router(nguoi_dung.bo_dinh_tuyen)
-ung_dung.include_router(chat.bo_dinh_tuyen)
-ung_dung.include_router(doi_tac.bo_dinh_tuyen)
-ung_dung.include_router(blog.bo_dinh_tuyen)
-ung_dung.include_router(yeu_thich.bo_dinh_tuyen)
-ung_dung.include_router(thong_ke.bo_dinh_tuyen)
-ung_dung.include_router(api_pg.bo_dinh_tuyen)
-ung_dung.include_router(don_hang.bo_dinh_tuyen)
+# Standard routers (import có đo thời gian từng module, xem /api/startup)
+for ten_module in CAC_BO_DINH_TUYEN:
+    module = startup_profile.import_module(f".dinh_tuyen.{ten_module}", __package__)
+    ung_dung.include_router(module.bo_dinh_tuyen)
 
 # Include optimized routers if available
 try:
-    from .dinh_tuyen import san_pham_optimized
+    san_pham_toi_uu = startup_profile.import_module(".dinh_tuyen.san_pham_toi_uu", __package__)
 
     ung_dung.include_router(
-        san_pham_optimized.bo_dinh_tuyen, prefix="/v2", tags=["san_pham_v2"]
+        san_pham_toi_uu.bo_dinh_tuyen, prefix="/v2", tags=["san_pham_v2"]
     )
     logger.info("✅ Optimized product router enabled at /v2")
 except ImportError:
     pass
 
+startup_profile.mark_app_loaded()
+
 
 # =============================================================================
 # ROOT ENDPOINTS
@@ -260,6 +328,7 @@ def doc_goc():
         "tai_lieu": "/docs",
         "redoc": "/redoc",
         "suc_khoe": "/api/health",
+        "san_sang": "/ready",
         "thoi_gian": datetime.now().isoformat(),
     }
 
@@ -275,6 +344,20 @@ def kiem_tra_suc_khoe():
 # =============================================================================
 
 
+@ung_dung.get("/ready")
+def readiness_check():
+    """Readiness: 503 cho tới khi khởi tạo CSDL xong"""
+    if not startup_profile.is_ready:
+        return JSONResponse({"ready": False}, status_code=503)
+    return {"ready": True, "ready_ms": startup_profile.ready_ms}
+
+
+@ung_dung.get("/api/startup")
+def startup_report():
+    """Thời gian import từng module và từng bước khởi tạo của process này"""
+    return startup_profile.report()
+
+
 @ung_dung.get("/api/health")
 def health_check():
     """
@@ -413,29 +496,43 @@ def test_database():
 # =============================================================================
 
 
+@ung_dung.get("/api/health/pools")
+def pool_stats():
+    """Connection pool statistics (checkout wait time, timeouts) của process này"""
+    from .db_engine import pool_stats as get_pool_stats
+
+    return {"pools": get_pool_stats()}
+
+
 @ung_dung.get("/api/cache/stats")
 def cache_stats():
     """Get cache statistics"""
     try:
-        from .cache_advanced import redis_client, response_cache
+        from .cache_advanced import cache_warmer, redis_client, response_cache
+        from .principal_cache import principal_cache
 
         return {
             "cache": redis_client.stats(),
             "response_cache_rules": len(response_cache.rules),
+            "response_cache": response_cache.stats(),
+            "warmup": cache_warmer.stats(),
+            "auth": principal_cache.stats(),
         }
     except ImportError:
         return {"message": "Advanced cache not configured"}
 
 
 @ung_dung.post("/api/cache/clear")
-def clear_cache(pattern: str = None):
+def clear_cache(pattern: str = None, tag: str = None):
     """
-    Clear cache entries.
+    Clear cache entries (theo tag, pattern hoặc toàn bộ).
     Admin only - should be protected in production.
     """
     try:
         from .cache_advanced import invalidator, redis_client
 
+        if tag:
+            return {"cleared": invalidator.invalidate_tags(tag), "tag": tag}
         if pattern:
             count = redis_client.delete_pattern(f"*{pattern}*")
             return {"cleared": count, "pattern": pattern}
@@ -447,7 +544,7 @@ def clear_cache(pattern: str = None):
 
 
 @ung_dung.post("/api/cache/warmup")
-def warmup_cache():
+async def warmup_cache():
     """
     Warm up cache with frequently accessed data.
     Admin only - should be protected in production.
@@ -455,8 +552,8 @@ def warmup_cache():
     try:
         from .cache_advanced import cache_warmer
 
-        cache_warmer.warmup_all()
-        return {"message": "Cache warmup completed"}
+        await cache_warmer.warmup_all_async()
+        return {"message": "Cache warmup completed", "warmup": cache_warmer.stats()}
     except ImportError:
         return {"message": "Cache warmer not configured"}
 
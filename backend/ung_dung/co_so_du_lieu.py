@@ -1,24 +1,20 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, Text, ForeignKey, DateTime, Date
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Index, Integer, String, Float, Boolean, Text, ForeignKey, DateTime, Date
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
-import os
 import json
 from dotenv import load_dotenv
+from .db_engine import database_url, dispose_all_async, get_async_engine, get_engine
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ivie.db")
+# Render's postgres:// đã được đổi thành postgresql:// cho SQLAlchemy
+DATABASE_URL = database_url()
 
-# Fix Render's postgres:// to postgresql:// for SQLAlchemy compatibility
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-
-dong_co = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+# Engine dùng chung cả process (pool cấu hình qua DB_* env, xem db_engine)
+dong_co = get_engine(DATABASE_URL)
 
 PhienLamViec = sessionmaker(autocommit=False, autoflush=False, bind=dong_co)
 CoSo = declarative_base()
@@ -26,6 +22,16 @@ CoSo = declarative_base()
 # Database Models (Mô hình CSDL)
 class SanPham(CoSo):
     __tablename__ = "products"
+    # Lọc danh mục/giới tính và sắp xếp theo giá ở nhánh truy vấn database
+    __table_args__ = (
+        Index("ix_products_category_gender", "category", "gender"),
+        Index("ix_products_sub_category", "sub_category"),
+        Index("ix_products_rental_price_day", "rental_price_day"),
+        # Tìm kiếm toàn văn (search_engine), chỉ có trên PostgreSQL
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin").ddl_if(
+            dialect="postgresql"
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
@@ -52,6 +58,8 @@ class SanPham(CoSo):
     # Gallery images và accessories (JSON strings)
     gallery_images = Column(Text)  # JSON string of image URLs
     accessories = Column(Text)  # JSON string of accessories
+    # tsvector do search_engine cập nhật; deferred: không nạp khi đọc sản phẩm
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text(), "sqlite")))
 
 class ChuyenGia(CoSo):
     __tablename__ = "experts"
@@ -125,6 +133,7 @@ class ThuVien(CoSo):
 
 class LienHeGui(CoSo):
     __tablename__ = "contact_submissions"
+    __table_args__ = (Index("ix_contact_submissions_status", "status"),)
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
@@ -145,6 +154,8 @@ class NguoiDung(CoSo):
     address = Column(String) # New field
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
+    # Tăng khi đổi mật khẩu: token cũ (claim "ver") hết hiệu lực
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     orders = relationship("DonHang", back_populates="user")
     chat_messages = relationship("TinNhanChat", back_populates="user")
@@ -159,6 +170,7 @@ class GioHang(CoSo):
 
 class ChiTietGioHang(CoSo):
     __tablename__ = "cart_items"
+    __table_args__ = (Index("ix_cart_items_cart_id", "cart_id"),)
     id = Column(Integer, primary_key=True, index=True)
     cart_id = Column(Integer, ForeignKey("carts.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
@@ -169,6 +181,11 @@ class ChiTietGioHang(CoSo):
 
 class DonHang(CoSo):
     __tablename__ = "orders"
+    # Lịch sử đơn của user (mới nhất trước) và thống kê/lọc theo trạng thái
+    __table_args__ = (
+        Index("ix_orders_user_id_order_date", "user_id", "order_date"),
+        Index("ix_orders_status_order_date", "status", "order_date"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     customer_name = Column(String, nullable=False)
@@ -184,6 +201,10 @@ class DonHang(CoSo):
 
 class ChiTietDonHang(CoSo):
     __tablename__ = "order_items"
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+        Index("ix_order_items_product_id", "product_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
@@ -195,6 +216,8 @@ class ChiTietDonHang(CoSo):
 
 class TinNhanChat(CoSo):
     __tablename__ = "chat_messages"
+    # Hội thoại của user theo thời gian, tin cuối của từng user
+    __table_args__ = (Index("ix_chat_messages_user_id_thoi_gian", "user_id", "thoi_gian"),)
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     tin_nhan = Column(Text, nullable=False)
@@ -228,6 +251,7 @@ class KhieuNai(CoSo):
 
 class HoSoDoiTac(CoSo):
     __tablename__ = "partner_applications"
+    __table_args__ = (Index("ix_partner_applications_user_id_status", "user_id", "status"),)
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     partner_type = Column(String) # makeup, media (photo/video)
@@ -245,6 +269,10 @@ class HoSoDoiTac(CoSo):
 class DanhGia(CoSo):
 
     __tablename__ = "product_reviews"
+    # Đánh giá đã duyệt của sản phẩm, mới nhất trước
+    __table_args__ = (
+        Index("ix_product_reviews_product_id_is_approved_created_at", "product_id", "is_approved", "created_at"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     user_name = Column(String, nullable=False)
@@ -259,6 +287,10 @@ class DanhGia(CoSo):
 # Blog / Tin tức
 class BaiViet(CoSo):
     __tablename__ = "blog_posts"
+    # Danh sách bài đã đăng (lọc category), mới nhất trước
+    __table_args__ = (
+        Index("ix_blog_posts_is_published_created_at", "is_published", "created_at"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     slug = Column(String, unique=True, index=True)
@@ -278,6 +310,11 @@ class BaiViet(CoSo):
 # Danh sách yêu thích
 class YeuThich(CoSo):
     __tablename__ = "wishlists"
+    # Mỗi sản phẩm chỉ một lần trong danh sách yêu thích của user
+    __table_args__ = (
+        Index("ux_wishlists_user_id_product_id", "user_id", "product_id", unique=True),
+        Index("ix_wishlists_product_id", "product_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
@@ -289,6 +326,7 @@ class YeuThich(CoSo):
 # Combo packages
 class Combo(CoSo):
     __tablename__ = "combos"
+    __table_args__ = (Index("ix_combos_hoat_dong", "hoat_dong"),)
     id = Column(Integer, primary_key=True, index=True)
     ten = Column(String, nullable=False)
     gia = Column(Float, nullable=False)
@@ -320,18 +358,50 @@ def lay_csdl():
     finally:
         db.close()
 
+
+# Async engine (asyncpg / aiosqlite) cho các route đọc công khai: request chờ
+# database không giữ thread của threadpool. Tạo lazy để app chỉ dùng đường
+# sync vẫn chạy khi thiếu driver async.
+_PhienLamViecAsync = None
+
+def lay_dong_co_async():
+    """Async engine dùng chung (tạo ở lần gọi đầu)"""
+    global _PhienLamViecAsync
+    dong_co_async = get_async_engine()
+    if _PhienLamViecAsync is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        # expire_on_commit=False: serialize response sau commit không cần lazy load
+        _PhienLamViecAsync = async_sessionmaker(
+            dong_co_async, autoflush=False, expire_on_commit=False
+        )
+    return dong_co_async
+
+async def lay_csdl_async():
+    """Dependency AsyncSession cho các route đọc (ghi admin vẫn dùng lay_csdl)"""
+    lay_dong_co_async()
+    async with _PhienLamViecAsync() as db:
+        yield db
+
+async def dong_csdl_async():
+    """Đóng pool của async engine (khi shutdown)"""
+    await dispose_all_async()
+
 # Create tables and handle migrations
 def khoi_tao_csdl():
-    """Khởi tạo CSDL và tự động nâng cấp schema nếu cần (Có cơ chế thử lại)"""
+    """
+    Khởi tạo CSDL và nâng cấp schema nếu cần (Có cơ chế thử lại).
+    Schema đã mới nhất: chỉ một truy vấn kiểm tra schema_version.
+    """
     import time
+    from .migrations import migrate
+
     max_retries = 5
     retry_delay = 5
     
     for i in range(max_retries):
         try:
-            print(f"Attempting to connect to database (Attempt {i+1}/{max_retries})...")
-            CoSo.metadata.create_all(bind=dong_co)
-            print("Database connection and table creation successful!")
+            migrate(dong_co)
             break
         except Exception as e:
             if i == max_retries - 1:
@@ -340,75 +410,3 @@ def khoi_tao_csdl():
             print(f"Database connection failed, retrying in {retry_delay}s... Error: {e}")
             time.sleep(retry_delay)
             retry_delay *= 2  # Exponential backoff
-    
-    # Migration mechanism for existing tables
-    if "postgresql" in DATABASE_URL:
-        from sqlalchemy import text
-        with dong_co.connect() as conn:
-            # Tables and columns to check/add
-            migrations = {
-                "users": [
-                    ("username", "VARCHAR", "NULL"),
-                    ("phone", "VARCHAR", "NULL"),
-                    ("address", "VARCHAR", "NULL"),
-                ],
-                "products": [
-                    ("so_luong", "INTEGER", "DEFAULT 10"),
-                    ("het_hang", "BOOLEAN", "DEFAULT FALSE"),
-                    ("fabric_type", "VARCHAR", "NULL"),
-                    ("color", "VARCHAR", "NULL"),
-                    ("recommended_size", "TEXT", "NULL"),
-                    ("makeup_tone", "TEXT", "NULL"),
-                    ("gallery_images", "TEXT", "NULL"),
-                    ("accessories", "TEXT", "NULL"),
-                ],
-                "banners": [
-                    ("order", "INTEGER", "DEFAULT 0"),
-                ],
-                "home_highlights": [
-                    ("order", "INTEGER", "DEFAULT 0"),
-                ],
-                "gallery": [
-                    ("order", "INTEGER", "DEFAULT 0"),
-                ],
-                "contact_submissions": [
-                     ("address", "VARCHAR", "NULL"),
-                ],
-                "combos": [
-                    ("noi_bat", "BOOLEAN", "DEFAULT FALSE"),
-                    ("hoat_dong", "BOOLEAN", "DEFAULT TRUE"),
-                ],
-                "blog_posts": [
-                    ("seo_title", "VARCHAR", "NULL"),
-                    ("seo_description", "VARCHAR", "NULL"),
-                    ("seo_keywords", "VARCHAR", "NULL"),
-                ]
-            }
-            
-            for table_name, columns in migrations.items():
-                for col_name, col_type, col_params in columns:
-                    try:
-                        # Check if column exists
-                        conn.execute(text(f"SELECT {col_name} FROM {table_name} LIMIT 1"))
-                    except Exception:
-                        # If error, column might be missing
-                        print(f"Adding missing column {col_name} to {table_name} table...")
-                        try:
-                            # Use a separate transaction for each column add to avoid total failure
-                            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {col_name} {col_type} {col_params}"))
-                            conn.commit()
-                        except Exception as inner_e:
-                            print(f"Failed to add column {col_name} to {table_name}: {inner_e}")
-                            # No need to rollback on ALTER if it failed before execution
-                            pass
-    
-    # Extra check for users.username (must not be null if we use it for login)
-    if "postgresql" in DATABASE_URL:
-        from sqlalchemy import text
-        with dong_co.connect() as conn:
-            try:
-                # Update null usernames to a default value
-                conn.execute(text("UPDATE users SET username = 'user_' || id::text WHERE username IS NULL"))
-                conn.commit()
-            except Exception:
-                pass
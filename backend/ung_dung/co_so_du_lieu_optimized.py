@@ -9,15 +9,15 @@ Cơ sở dữ liệu tối ưu hóa cho IVIE Wedding Studio
 import logging
 import os
 import threading
-import time
 from contextlib import contextmanager
-from datetime import datetime, timedelta
-from functools import lru_cache
+from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from sqlalchemy import Index, create_engine, event, text
+from sqlalchemy import Index, text
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.pool import QueuePool, StaticPool
+
+from . import db_engine
+from .bounded_cache import BoundedCache
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
@@ -26,29 +26,55 @@ logger = logging.getLogger(__name__)
 # Base cho models
 Base = declarative_base()
 
+# Khóa advisory (PostgreSQL) cho việc build index lúc startup
+INDEX_LOCK_KEY = 7_240_017
+
 # =============================================================================
 # QUERY CACHE - In-memory cache với TTL
 # =============================================================================
 
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2000"))
+QUERY_CACHE_MAX_BYTES = int(float(os.getenv("QUERY_CACHE_MAX_MB", "32")) * 1024 * 1024)
+QUERY_CACHE_POLICY = os.getenv("QUERY_CACHE_POLICY", "tinylfu")
+
 
 class QueryCache:
     """
-    Simple in-memory cache với TTL cho database queries.
-    Thread-safe implementation.
+    In-memory cache với TTL cho database queries.
+    Thread-safe, giới hạn số entry/dung lượng (BoundedCache).
     """
 
-    def __init__(self, default_ttl: int = 300):
+    def __init__(
+        self,
+        default_ttl: int = 300,
+        max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+        max_bytes: int = QUERY_CACHE_MAX_BYTES,
+        policy: str = QUERY_CACHE_POLICY,
+    ):
         """
         Khởi tạo cache.
 
         Args:
             default_ttl: Thời gian cache mặc định (giây), default 5 phút
+            max_entries: Số entry tối đa
+            max_bytes: Tổng dung lượng tối đa (bytes ước lượng)
+            policy: Chính sách loại bỏ: lru hoặc tinylfu
         """
-        self._cache: Dict[str, Dict[str, Any]] = {}
-        self._lock = threading.RLock()
+        self._cache = BoundedCache(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            policy=policy,
+            default_ttl=default_ttl,
+        )
         self.default_ttl = default_ttl
-        self.hits = 0
-        self.misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._cache.misses
 
     def _generate_key(self, query: str, params: Optional[tuple] = None) -> str:
         """Tạo cache key từ query và params"""
@@ -58,71 +84,38 @@ class QueryCache:
 
     def get(self, key: str) -> Optional[Any]:
         """Lấy giá trị từ cache nếu còn hợp lệ"""
-        with self._lock:
-            if key in self._cache:
-                item = self._cache[key]
-                if datetime.now() < item["expires"]:
-                    self.hits += 1
-                    return item["value"]
-                else:
-                    # Xóa item hết hạn
-                    del self._cache[key]
-            self.misses += 1
-            return None
+        return self._cache.get(key)
 
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """Lưu giá trị vào cache"""
-        with self._lock:
-            expires = datetime.now() + timedelta(seconds=ttl or self.default_ttl)
-            self._cache[key] = {
-                "value": value,
-                "expires": expires,
-                "created": datetime.now(),
-            }
+        self._cache.set(key, value, ttl or self.default_ttl)
 
     def delete(self, key: str) -> bool:
         """Xóa một key khỏi cache"""
-        with self._lock:
-            if key in self._cache:
-                del self._cache[key]
-                return True
-            return False
+        return self._cache.delete(key)
 
     def invalidate_pattern(self, pattern: str) -> int:
         """Xóa tất cả keys match với pattern"""
-        with self._lock:
-            keys_to_delete = [k for k in self._cache.keys() if pattern in k]
-            for key in keys_to_delete:
-                del self._cache[key]
-            return len(keys_to_delete)
+        keys_to_delete = [k for k in self._cache.keys() if pattern in k]
+        for key in keys_to_delete:
+            self._cache.delete(key)
+        return len(keys_to_delete)
 
     def clear(self) -> None:
         """Xóa toàn bộ cache"""
-        with self._lock:
-            self._cache.clear()
-            self.hits = 0
-            self.misses = 0
+        self._cache.clear()
+        self._cache.hits = 0
+        self._cache.misses = 0
 
     def cleanup_expired(self) -> int:
         """Dọn dẹp các items hết hạn"""
-        with self._lock:
-            now = datetime.now()
-            expired_keys = [k for k, v in self._cache.items() if now >= v["expires"]]
-            for key in expired_keys:
-                del self._cache[key]
-            return len(expired_keys)
+        return self._cache.purge_expired()
 
     def stats(self) -> Dict[str, Any]:
         """Thống kê cache"""
-        with self._lock:
-            total = self.hits + self.misses
-            hit_rate = (self.hits / total * 100) if total > 0 else 0
-            return {
-                "size": len(self._cache),
-                "hits": self.hits,
-                "misses": self.misses,
-                "hit_rate": f"{hit_rate:.2f}%",
-            }
+        stats = self._cache.stats()
+        stats["size"] = stats["entries"]
+        return stats
 
 
 # Global cache instance
@@ -135,23 +128,16 @@ query_cache = QueryCache(default_ttl=300)
 
 
 def get_database_url() -> str:
-    """Lấy database URL từ environment variables"""
-    # Ưu tiên PostgreSQL nếu có
-    database_url = os.getenv("DATABASE_URL")
-
-    if database_url:
-        # Render.com sử dụng postgres:// nhưng SQLAlchemy cần postgresql://
-        if database_url.startswith("postgres://"):
-            database_url = database_url.replace("postgres://", "postgresql://", 1)
-        return database_url
-
-    # Fallback về SQLite
-    return "sqlite:///./ivie.db"
+    """Lấy database URL từ environment variables (fallback SQLite)"""
+    return db_engine.database_url()
 
 
 def create_optimized_engine(database_url: Optional[str] = None):
     """
-    Tạo database engine với connection pooling tối ưu.
+    Engine với connection pooling tối ưu.
+
+    Engine lấy từ registry dùng chung (db_engine): cùng URL thì cùng pool
+    với co_so_du_lieu và /pg; cấu hình pool qua các biến DB_* env.
 
     Args:
         database_url: URL kết nối database (optional)
@@ -159,64 +145,7 @@ def create_optimized_engine(database_url: Optional[str] = None):
     Returns:
         SQLAlchemy Engine với connection pool
     """
-    url = database_url or get_database_url()
-    is_sqlite = url.startswith("sqlite")
-
-    # Cấu hình cho SQLite
-    if is_sqlite:
-        engine = create_engine(
-            url,
-            connect_args={"check_same_thread": False},
-            poolclass=StaticPool,  # SQLite không hỗ trợ multiple connections tốt
-            echo=False,
-        )
-
-        # Tối ưu SQLite với PRAGMA
-        @event.listens_for(engine, "connect")
-        def set_sqlite_pragma(dbapi_connection, connection_record):
-            cursor = dbapi_connection.cursor()
-            # WAL mode cho concurrent reads
-            cursor.execute("PRAGMA journal_mode=WAL")
-            # Cache size lớn hơn (negative = KB)
-            cursor.execute("PRAGMA cache_size=-64000")  # 64MB
-            # Synchronous normal cho tốc độ
-            cursor.execute("PRAGMA synchronous=NORMAL")
-            # Temp store in memory
-            cursor.execute("PRAGMA temp_store=MEMORY")
-            # Memory mapped I/O
-            cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
-            cursor.close()
-
-        return engine
-
-    # Cấu hình cho PostgreSQL với connection pooling
-    engine = create_engine(
-        url,
-        poolclass=QueuePool,
-        pool_size=5,  # Số connection cơ bản
-        max_overflow=10,  # Số connection thêm khi cần
-        pool_timeout=30,  # Timeout khi đợi connection
-        pool_recycle=1800,  # Recycle connection sau 30 phút
-        pool_pre_ping=True,  # Kiểm tra connection trước khi sử dụng
-        echo=False,  # Không log SQL (production)
-        connect_args={"connect_timeout": 10, "application_name": "ivie_wedding_admin"},
-    )
-
-    # Event listeners cho monitoring
-    @event.listens_for(engine, "before_cursor_execute")
-    def before_cursor_execute(
-        conn, cursor, statement, parameters, context, executemany
-    ):
-        conn.info.setdefault("query_start_time", []).append(time.time())
-
-    @event.listens_for(engine, "after_cursor_execute")
-    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-        total = time.time() - conn.info["query_start_time"].pop()
-        # Log slow queries (> 1 giây)
-        if total > 1.0:
-            logger.warning(f"Slow query ({total:.2f}s): {statement[:100]}...")
-
-    return engine
+    return db_engine.get_engine(database_url)
 
 
 # =============================================================================
@@ -289,60 +218,140 @@ def get_db_session():
 # =============================================================================
 
 
-def create_indexes(engine):
+def _declared_indexes(dialect_name: str):
     """
-    Tạo các indexes cần thiết để tăng tốc queries.
-    Gọi hàm này sau khi tạo tables.
+    Mọi Index khai báo trên models (kể cả Column(index=True / unique=True)),
+    bỏ index chỉ dành cho dialect khác (Index(...).ddl_if(dialect=...))
     """
-    indexes = [
-        # Sản phẩm indexes
-        "CREATE INDEX IF NOT EXISTS idx_san_pham_category ON san_pham(category)",
-        "CREATE INDEX IF NOT EXISTS idx_san_pham_sub_category ON san_pham(sub_category)",
-        "CREATE INDEX IF NOT EXISTS idx_san_pham_gender ON san_pham(gender)",
-        "CREATE INDEX IF NOT EXISTS idx_san_pham_is_hot ON san_pham(is_hot)",
-        "CREATE INDEX IF NOT EXISTS idx_san_pham_is_new ON san_pham(is_new)",
-        "CREATE INDEX IF NOT EXISTS idx_san_pham_code ON san_pham(code)",
-        "CREATE INDEX IF NOT EXISTS idx_san_pham_category_gender ON san_pham(category, gender)",
-        "CREATE INDEX IF NOT EXISTS idx_san_pham_price ON san_pham(rental_price_day)",
-        # Đơn hàng indexes
-        "CREATE INDEX IF NOT EXISTS idx_don_hang_status ON don_hang(status)",
-        "CREATE INDEX IF NOT EXISTS idx_don_hang_user_id ON don_hang(user_id)",
-        "CREATE INDEX IF NOT EXISTS idx_don_hang_order_date ON don_hang(order_date)",
-        "CREATE INDEX IF NOT EXISTS idx_don_hang_status_date ON don_hang(status, order_date)",
-        # Chi tiết đơn hàng indexes
-        "CREATE INDEX IF NOT EXISTS idx_chi_tiet_don_hang_product ON chi_tiet_don_hang(product_id)",
-        "CREATE INDEX IF NOT EXISTS idx_chi_tiet_don_hang_order ON chi_tiet_don_hang(order_id)",
-        # Liên hệ indexes
-        "CREATE INDEX IF NOT EXISTS idx_lien_he_status ON lien_he_gui(status)",
-        "CREATE INDEX IF NOT EXISTS idx_lien_he_date ON lien_he_gui(created_at)",
-        # Đánh giá indexes
-        "CREATE INDEX IF NOT EXISTS idx_danh_gia_product ON danh_gia(product_id)",
-        "CREATE INDEX IF NOT EXISTS idx_danh_gia_approved ON danh_gia(is_approved)",
-        "CREATE INDEX IF NOT EXISTS idx_danh_gia_product_approved ON danh_gia(product_id, is_approved)",
-        # Người dùng indexes
-        "CREATE INDEX IF NOT EXISTS idx_nguoi_dung_email ON nguoi_dung(email)",
-        "CREATE INDEX IF NOT EXISTS idx_nguoi_dung_phone ON nguoi_dung(phone)",
-        # Blog indexes
-        "CREATE INDEX IF NOT EXISTS idx_blog_slug ON bai_viet(slug)",
-        "CREATE INDEX IF NOT EXISTS idx_blog_published ON bai_viet(is_published)",
-        "CREATE INDEX IF NOT EXISTS idx_blog_category ON bai_viet(category)",
-        # Yêu thích indexes
-        "CREATE INDEX IF NOT EXISTS idx_yeu_thich_user ON yeu_thich(user_id)",
-        "CREATE INDEX IF NOT EXISTS idx_yeu_thich_product ON yeu_thich(product_id)",
-        # Combo indexes
-        "CREATE INDEX IF NOT EXISTS idx_combo_active ON combo(is_active)",
-    ]
-
-    with engine.connect() as conn:
-        for idx_sql in indexes:
-            try:
-                conn.execute(text(idx_sql))
-                conn.commit()
-            except Exception as e:
-                # Index có thể đã tồn tại hoặc table chưa có
-                logger.debug(f"Index creation note: {e}")
+    from .co_so_du_lieu import CoSo
+
+    for table in CoSo.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            ddl_if = index._ddl_if
+            if ddl_if is not None and ddl_if.dialect is not None:
+                dialects = (ddl_if.dialect,) if isinstance(ddl_if.dialect, str) else ddl_if.dialect
+                if dialect_name not in dialects:
+                    continue
+            yield table, index
+
 
-    logger.info("✅ Database indexes created/verified successfully")
+def index_report(engine) -> Dict[str, Any]:
+    """
+    So sánh index khai báo trên models với database.
+
+    Returns:
+        {"present": [...], "missing": [...], "invalid": [...]} (tên index);
+        invalid: index PostgreSQL build CONCURRENTLY dở (indisvalid = false)
+    """
+    from sqlalchemy import inspect as sa_inspect
+
+    inspector = sa_inspect(engine)
+    tables = set(inspector.get_table_names())
+    report: Dict[str, Any] = {"present": [], "missing": [], "invalid": []}
+
+    invalid = set()
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            invalid = set(
+                conn.execute(
+                    text(
+                        "SELECT c.relname FROM pg_index i "
+                        "JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+                    )
+                ).scalars()
+            )
+
+    existing: Dict[str, set] = {}
+    for table, index in _declared_indexes(engine.dialect.name):
+        if table.name not in tables:
+            # Bảng chưa có: create_all sẽ tạo cùng index
+            continue
+        if table.name not in existing:
+            existing[table.name] = {i["name"] for i in inspector.get_indexes(table.name)}
+        if index.name in invalid:
+            report["invalid"].append(index.name)
+        elif index.name in existing[table.name]:
+            report["present"].append(index.name)
+        else:
+            report["missing"].append(index.name)
+    return report
+
+
+def create_indexes(engine) -> Dict[str, Any]:
+    """
+    Tạo các index khai báo trên models mà database còn thiếu.
+
+    PostgreSQL: CREATE INDEX CONCURRENTLY (không khóa ghi của bảng đang chạy),
+    mỗi index một câu lệnh autocommit, không áp statement timeout; index dở
+    dang (invalid) được drop rồi build lại. Chỉ một process làm việc này nhờ
+    advisory lock.
+
+    Returns:
+        Báo cáo: created / failed (tên -> lỗi) / missing (còn thiếu sau khi chạy)
+    """
+    from sqlalchemy.schema import CreateIndex
+
+    is_postgres = engine.dialect.name == "postgresql"
+    indexes = {index.name: index for _, index in _declared_indexes(engine.dialect.name)}
+    result: Dict[str, Any] = {"created": [], "failed": {}, "missing": []}
+
+    with engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as conn, db_engine.without_statement_timeout(conn):
+        if is_postgres and not conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": INDEX_LOCK_KEY}
+        ).scalar():
+            logger.info("ℹ️ Index build đang chạy ở process khác, bỏ qua")
+            return result
+        try:
+            before = index_report(engine)
+            for name in before["invalid"] + before["missing"]:
+                index = indexes[name]
+                ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+                try:
+                    if is_postgres:
+                        if name in before["invalid"]:
+                            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+                        ddl = ddl.replace("INDEX", "INDEX CONCURRENTLY", 1)
+                    conn.execute(text(ddl))
+                    result["created"].append(name)
+                except Exception as e:
+                    # Vd. unique index gặp dữ liệu trùng: bỏ bản build dở
+                    result["failed"][name] = str(e).splitlines()[0]
+                    if is_postgres:
+                        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+        finally:
+            if is_postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INDEX_LOCK_KEY})
+
+    result["missing"] = index_report(engine)["missing"]
+    if result["created"]:
+        logger.info(f"✅ Created indexes: {', '.join(result['created'])}")
+    for name, error in result["failed"].items():
+        logger.warning(f"⚠️ Index {name} failed: {error}")
+    if result["missing"]:
+        logger.warning(f"⚠️ Missing indexes: {', '.join(result['missing'])}")
+    else:
+        logger.info("✅ Database indexes verified")
+    return result
+
+
+def create_indexes_background(engine=None) -> threading.Thread:
+    """Build index trong thread nền để không chặn startup"""
+    thread = threading.Thread(
+        target=lambda: _safe_create_indexes(engine or get_engine()),
+        name="create-indexes",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _safe_create_indexes(engine) -> None:
+    try:
+        create_indexes(engine)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not create indexes: {e}")
 
 
 def analyze_tables(engine):
@@ -350,27 +359,19 @@ def analyze_tables(engine):
     Chạy ANALYZE để cập nhật statistics cho query optimizer.
     Chỉ dùng cho PostgreSQL.
     """
-    database_url = get_database_url()
-    if "postgresql" not in database_url:
+    if engine.dialect.name != "postgresql":
         return
 
-    tables = [
-        "san_pham",
-        "don_hang",
-        "chi_tiet_don_hang",
-        "lien_he_gui",
-        "danh_gia",
-        "nguoi_dung",
-        "bai_viet",
-    ]
-
-    with engine.connect() as conn:
-        for table in tables:
+    from .co_so_du_lieu import CoSo
+
+    with engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as conn, db_engine.without_statement_timeout(conn):
+        for table in CoSo.metadata.sorted_tables:
             try:
-                conn.execute(text(f"ANALYZE {table}"))
-                conn.commit()
+                conn.execute(text(f'ANALYZE "{table.name}"'))
             except Exception as e:
-                logger.debug(f"ANALYZE {table}: {e}")
+                logger.debug(f"ANALYZE {table.name}: {e}")
 
     logger.info("✅ Table statistics updated")
 
@@ -395,7 +396,6 @@ def cached_query(cache_key: str, ttl: int = 300):
     """
 
     def decorator(func):
-        @lru_cache(maxsize=128)
         def wrapper(*args, **kwargs):
             # Tạo full cache key từ arguments
             key_parts = [cache_key]
@@ -504,6 +504,7 @@ def check_database_health() -> Dict[str, Any]:
         "pool_checkedout": engine.pool.checkedout()
         if hasattr(engine.pool, "checkedout")
         else "N/A",
+        "pools": db_engine.pool_stats(),
         "cache_stats": query_cache.stats(),
         "timestamp": datetime.now().isoformat(),
     }
@@ -513,6 +514,8 @@ def check_database_health() -> Dict[str, Any]:
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
         result["connection"] = "OK"
+        report = index_report(engine)
+        result["missing_indexes"] = report["missing"] + report["invalid"]
     except Exception as e:
         result["status"] = "unhealthy"
         result["connection"] = str(e)
@@ -533,12 +536,12 @@ def init_database_optimized():
     engine = get_engine()
 
     # Import models để đảm bảo tables được tạo
-    from .co_so_du_lieu import Base as OriginalBase
+    from .co_so_du_lieu import CoSo
 
     # Tạo tables nếu chưa có
-    OriginalBase.metadata.create_all(bind=engine)
+    CoSo.metadata.create_all(bind=engine)
 
-    # Tạo indexes
+    # Tạo indexes còn thiếu
     create_indexes(engine)
 
     # Update statistics (PostgreSQL)
@@ -552,8 +555,7 @@ def init_database_optimized():
 def cleanup():
     """Dọn dẹp resources khi shutdown"""
     global _engine
-    if _engine:
-        _engine.dispose()
-        _engine = None
+    db_engine.dispose_all()
+    _engine = None
     query_cache.clear()
     logger.info("✅ Database connections cleaned up")
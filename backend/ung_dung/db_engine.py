@@ -0,0 +1,337 @@
+"""
+Registry engine SQLAlchemy dùng chung cho IVIE Wedding Studio
+- Mỗi database URL chỉ có một engine (một pool) cho cả process: co_so_du_lieu
+  (kể cả /pg), ket_noi_postgresql và co_so_du_lieu_optimized đều lấy engine ở đây
+- Cấu hình pool qua env: size, overflow, timeout, recycle, pre-ping,
+  statement timeout, application_name
+- Đo thời gian chờ checkout connection theo từng pool (histogram), số lần
+  timeout, số connection DBAPI đã mở
+- Async engine (asyncpg / aiosqlite) cùng cấu hình và cùng bộ đo
+- without_statement_timeout(): bỏ statement timeout cho việc dài có chủ đích
+  (build index CONCURRENTLY, ANALYZE, migration/backfill)
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# Giới hạn thời gian mỗi câu lệnh phía PostgreSQL (ms, 0 = không giới hạn)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "ivie_wedding")
+DB_SLOW_QUERY_SECONDS = float(os.getenv("DB_SLOW_QUERY_SECONDS", "1.0"))
+
+DEFAULT_DATABASE_URL = "sqlite:///./ivie.db"
+
+# Biên histogram thời gian chờ checkout (ms)
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def normalize_url(url: str) -> str:
+    """Render dùng postgres:// nhưng SQLAlchemy cần postgresql://"""
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+def database_url() -> str:
+    """DATABASE_URL (mặc định SQLite local)"""
+    return normalize_url(os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL))
+
+
+def async_url(url: str) -> str:
+    """sqlite:// -> sqlite+aiosqlite://, postgresql:// -> postgresql+asyncpg://"""
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite" + url[url.index(":"):]
+    if url.startswith("postgresql"):
+        url = "postgresql+asyncpg" + url[url.index(":"):]
+        # asyncpg không nhận sslmode (URL của Render thường có ?sslmode=require)
+        return url.replace("sslmode=", "ssl=")
+    return url
+
+
+# =============================================================================
+# POOL METRICS
+# =============================================================================
+
+
+class PoolMetrics:
+    """Thống kê checkout của một pool (thread-safe)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, timed_out: bool = False) -> None:
+        ms = seconds * 1000
+        index = next((i for i, edge in enumerate(WAIT_BUCKETS_MS) if ms <= edge), len(WAIT_BUCKETS_MS))
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.buckets[index] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            observed = self.checkouts + self.timeouts
+            histogram = {f"le_{edge}ms": count for edge, count in zip(WAIT_BUCKETS_MS, self.buckets)}
+            histogram["inf"] = self.buckets[-1]
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "wait_avg_ms": round(self.wait_total / observed * 1000, 3) if observed else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+                "wait_histogram": histogram,
+            }
+
+
+class _TimedPoolMixin:
+    """Đo thời gian chờ lấy connection từ pool (gồm cả chờ khi pool đã đầy)"""
+
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.observe(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.observe(time.perf_counter() - started)
+        return connection
+
+
+def _timed_pool_class(base, metrics: PoolMetrics):
+    # Lớp riêng cho mỗi engine: pool.recreate() (dispose) dùng lại self.__class__.
+    # Giữ __module__ của SQLAlchemy để log của pool vẫn thuộc logger "sqlalchemy"
+    return type(
+        f"Timed{base.__name__}",
+        (_TimedPoolMixin, base),
+        {"metrics": metrics, "__module__": base.__module__},
+    )
+
+
+# =============================================================================
+# ENGINE REGISTRY
+# =============================================================================
+
+_engines: Dict[str, Any] = {}
+_async_engines: Dict[str, Any] = {}
+_metrics: Dict[str, PoolMetrics] = {}
+_registry_lock = threading.Lock()
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":"))
+
+
+def _engine_kwargs(url: str, metrics: PoolMetrics, pool_base, is_async: bool) -> Dict[str, Any]:
+    if _is_memory_sqlite(url):
+        return {"connect_args": {"check_same_thread": False}}
+
+    kwargs: Dict[str, Any] = {
+        "poolclass": _timed_pool_class(pool_base, metrics),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    if url.startswith("sqlite"):
+        kwargs["connect_args"] = {"check_same_thread": False}
+        return kwargs
+
+    if is_async:
+        settings = {"application_name": DB_APPLICATION_NAME}
+        if DB_STATEMENT_TIMEOUT_MS > 0:
+            settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+        connect_args = {"server_settings": settings, "timeout": DB_CONNECT_TIMEOUT}
+    else:
+        connect_args = {
+            "connect_timeout": DB_CONNECT_TIMEOUT,
+            "application_name": DB_APPLICATION_NAME,
+        }
+        if DB_STATEMENT_TIMEOUT_MS > 0:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    kwargs.update(
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    return kwargs
+
+
+def _instrument(engine, url: str, metrics: PoolMetrics) -> None:
+    """Listener đo connection mới / bị invalidate, slow query, PRAGMA SQLite"""
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.connects += 1
+        if url.startswith("sqlite") and not _is_memory_sqlite(url):
+            cursor = dbapi_connection.cursor()
+            # WAL cho đọc song song với ghi; các PRAGMA còn lại chỉ có hiệu lực theo connection
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA cache_size=-64000")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.close()
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.invalidations += 1
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        total = time.perf_counter() - conn.info["query_start_time"].pop()
+        if total > DB_SLOW_QUERY_SECONDS:
+            logger.warning(f"Slow query ({total:.2f}s): {statement[:100]}...")
+
+
+def get_engine(url: Optional[str] = None, name: Optional[str] = None):
+    """
+    Engine sync dùng chung cho URL (mặc định DATABASE_URL).
+
+    name: nhãn pool trong metrics (mặc định "default" cho DATABASE_URL)
+    """
+    url = normalize_url(url) if url else database_url()
+    engine = _engines.get(url)
+    if engine is not None:
+        return engine
+    with _registry_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            label = name or ("default" if url == database_url() else f"pool{len(_engines)}")
+            metrics = _metrics.setdefault(label, PoolMetrics(label))
+            engine = create_engine(url, **_engine_kwargs(url, metrics, QueuePool, False))
+            _instrument(engine, url, metrics)
+            _engines[url] = engine
+            logger.info(f"Database engine '{label}' created ({engine.dialect.name})")
+    return engine
+
+
+def get_async_engine(url: Optional[str] = None, name: Optional[str] = None):
+    """Async engine dùng chung (ASYNC_DATABASE_URL hoặc suy ra từ DATABASE_URL)"""
+    url = url or os.getenv("ASYNC_DATABASE_URL") or async_url(database_url())
+    engine = _async_engines.get(url)
+    if engine is not None:
+        return engine
+    with _registry_lock:
+        engine = _async_engines.get(url)
+        if engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+            label = name or ("default_async" if not _async_engines else f"async{len(_async_engines)}")
+            metrics = _metrics.setdefault(label, PoolMetrics(label))
+            engine = create_async_engine(
+                url, **_engine_kwargs(url, metrics, AsyncAdaptedQueuePool, True)
+            )
+            _instrument(engine.sync_engine, url, metrics)
+            _async_engines[url] = engine
+            logger.info(f"Database engine '{label}' created ({engine.dialect.name}, async)")
+    return engine
+
+
+@contextmanager
+def without_statement_timeout(conn) -> Iterator[Any]:
+    """
+    Tắt DB_STATEMENT_TIMEOUT_MS trên một kết nối PostgreSQL trong khối with.
+
+    Gọi khi kết nối không có transaction dở (SET/RESET được commit ngay).
+    Ra khỏi khối thì RESET về mặc định trước khi kết nối trở lại pool; RESET
+    lỗi thì bỏ hẳn kết nối khỏi pool.
+    """
+    if conn.dialect.name != "postgresql" or DB_STATEMENT_TIMEOUT_MS <= 0:
+        yield conn
+        return
+    conn.execute(text("SET statement_timeout = 0"))
+    conn.commit()
+    try:
+        yield conn
+    finally:
+        try:
+            conn.execute(text("RESET statement_timeout"))
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"RESET statement_timeout failed, discarding connection: {e}")
+            conn.invalidate()
+
+
+# =============================================================================
+# MONITORING & CLEANUP
+# =============================================================================
+
+
+def _pool_state(pool) -> Dict[str, Any]:
+    state = {"class": type(pool).__name__}
+    for attr in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, attr):
+            state[attr] = getattr(pool, attr)()
+    return state
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """Trạng thái và thống kê checkout của mọi pool trong process"""
+    stats = []
+    for engines, kind in ((_engines, "sync"), (_async_engines, "async")):
+        for engine in list(engines.values()):
+            sync_engine = getattr(engine, "sync_engine", engine)
+            metrics = getattr(sync_engine.pool, "metrics", None)
+            stats.append(
+                {
+                    "name": metrics.name if metrics else "unmetered",
+                    "kind": kind,
+                    "dialect": sync_engine.dialect.name,
+                    "driver": sync_engine.dialect.driver,
+                    **_pool_state(sync_engine.pool),
+                    **(metrics.snapshot() if metrics else {}),
+                }
+            )
+    return stats
+
+
+def dispose_all() -> None:
+    """Đóng connection của mọi engine sync (khi shutdown / sau fork)"""
+    for engine in list(_engines.values()):
+        engine.dispose()
+
+
+async def dispose_all_async() -> None:
+    """Đóng connection của mọi async engine"""
+    for engine in list(_async_engines.values()):
+        await engine.dispose()
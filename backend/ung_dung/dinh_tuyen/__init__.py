@@ -0,0 +1,19 @@
+# Module router (mỗi module có bo_dinh_tuyen), theo thứ tự đăng ký vào app.
+# App import từng module qua startup_profile để đo thời gian import
+CAC_BO_DINH_TUYEN = (
+    "san_pham",
+    "dich_vu",
+    "lien_he",
+    "tep_tin",
+    "anh_bia",
+    "noi_dung",
+    "thu_vien",
+    "nguoi_dung",
+    "tro_chuyen",
+    "doi_tac",
+    "bai_viet",
+    "yeu_thich",
+    "thong_ke",
+    "api_postgresql",
+    "don_hang",
+)
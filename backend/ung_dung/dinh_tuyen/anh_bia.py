@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
-from ..co_so_du_lieu import lay_csdl, Banner as BannerDB
+from ..co_so_du_lieu import lay_csdl, lay_csdl_async, Banner as BannerDB
 from ..mo_hinh import Banner, BannerTao
 
 bo_dinh_tuyen = APIRouter(
@@ -10,9 +12,12 @@ bo_dinh_tuyen = APIRouter(
 )
 
 @bo_dinh_tuyen.get("/", response_model=List[Banner])
-def lay_danh_sach_banner(csdl: Session = Depends(lay_csdl)):
+async def lay_danh_sach_banner(csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy tất cả banner (công khai)"""
-    return csdl.query(BannerDB).filter(BannerDB.is_active == True).order_by(BannerDB.order).all()
+    ket_qua = await csdl.scalars(
+        select(BannerDB).filter(BannerDB.is_active == True).order_by(BannerDB.order)
+    )
+    return ket_qua.all()
 
 @bo_dinh_tuyen.get("/tat_ca", response_model=List[Banner])
 def lay_tat_ca_banner_admin(csdl: Session = Depends(lay_csdl)):
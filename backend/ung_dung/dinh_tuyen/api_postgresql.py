@@ -1,17 +1,15 @@
 """
 API Endpoints cho PostgreSQL - IVIE Studio
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
+from sqlalchemy import func
 from sqlalchemy.orm import Session
+from datetime import datetime
 from typing import List, Optional
-import sys
-import os
 
-# Thêm đường dẫn backend vào sys.path
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-
-from ket_noi_postgresql import PhienLamViec, dong_co, CoSo
+from ung_dung.bao_mat import bam_mat_khau
+from ung_dung.co_so_du_lieu import PhienLamViec, dong_co, CoSo
 from ung_dung.co_so_du_lieu import SanPham, NguoiDung, DonHang, ChiTietDonHang, LienHeGui as LienHe, ThuVien as ThuVienAnh, Combo
 from ung_dung.luoc_do_pg import (
     SanPhamTao, SanPhamCapNhat, SanPhamPhanHoi,
@@ -22,13 +20,13 @@ from ung_dung.luoc_do_pg import (
     ThuVienAnhTao, ThuVienAnhCapNhat, ThuVienAnhPhanHoi,
     ComboTao, ComboCapNhat, ComboPhanHoi
 )
-from passlib.context import CryptContext
+from ung_dung import product_events
+from ung_dung.pagination import (
+    COUNT_NONE, NEXT_CURSOR_HEADER, count_rows, paginate_keyset, validate_count_mode
+)
 
 bo_dinh_tuyen = APIRouter(prefix="/pg", tags=["PostgreSQL API"])
 
-# Mã hóa mật khẩu
-ma_hoa = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 def lay_phien():
     """Dependency để lấy phiên làm việc database"""
@@ -39,6 +37,17 @@ def lay_phien():
         phien.close()
 
 
+def _trang_keyset(truy_van, cot, spec, ten_sap_xep, cursor, gioi_han, dem_tong, phan_hoi, mac_dinh=None):
+    """Trả một trang keyset, ghi X-Next-Cursor và X-Total-Count (nếu đếm)"""
+    tong_so = count_rows(truy_van, validate_count_mode(dem_tong, COUNT_NONE))
+    items, cursor_tiep = paginate_keyset(truy_van, cot, spec, ten_sap_xep, cursor, gioi_han, mac_dinh)
+    if tong_so is not None:
+        phan_hoi.headers["X-Total-Count"] = str(tong_so)
+    if cursor_tiep:
+        phan_hoi.headers[NEXT_CURSOR_HEADER] = cursor_tiep
+    return items
+
+
 # ============ KHỞI TẠO BẢNG ============
 @bo_dinh_tuyen.post("/khoi-tao-bang", summary="Khởi tạo tất cả bảng trong PostgreSQL")
 def khoi_tao_bang():
@@ -59,6 +68,9 @@ def lay_danh_sach_san_pham(
     gioi_tinh: Optional[str] = None,
     la_moi: Optional[bool] = None,
     la_hot: Optional[bool] = None,
+    cursor: Optional[str] = Query(None, description="Keyset cursor, để rỗng cho trang đầu"),
+    dem_tong: Optional[str] = Query(None, description="exact, estimated, none"),
+    phan_hoi: Response = None,
     phien: Session = Depends(lay_phien)
 ):
     truy_van = phien.query(SanPham)
@@ -72,6 +84,11 @@ def lay_danh_sach_san_pham(
     if la_hot is not None:
         truy_van = truy_van.filter(SanPham.is_hot == la_hot)
     
+    if cursor is not None:
+        return _trang_keyset(
+            truy_van, [SanPham.id], [("id", False)], "id_asc",
+            cursor, gioi_han, dem_tong, phan_hoi,
+        )
     return truy_van.offset(bo_qua).limit(gioi_han).all()
 
 
@@ -103,6 +120,7 @@ def tao_san_pham(du_lieu: SanPhamTao, phien: Session = Depends(lay_phien)):
     phien.add(san_pham)
     phien.commit()
     phien.refresh(san_pham)
+    product_events.notify_saved([san_pham])
     return san_pham
 
 
@@ -117,6 +135,7 @@ def cap_nhat_san_pham(san_pham_id: int, du_lieu: SanPhamCapNhat, phien: Session
     
     phien.commit()
     phien.refresh(san_pham)
+    product_events.notify_saved([san_pham])
     return san_pham
 
 
@@ -128,6 +147,7 @@ def xoa_san_pham(san_pham_id: int, phien: Session = Depends(lay_phien)):
     
     phien.delete(san_pham)
     phien.commit()
+    product_events.notify_deleted([san_pham_id])
     return {"thong_bao": "Đã xóa sản phẩm thành công"}
 
 
@@ -203,7 +223,7 @@ def tao_nguoi_dung(du_lieu: NguoiDungTao, phien: Session = Depends(lay_phien)):
     # Mã hóa mật khẩu
     du_lieu_dict = du_lieu.model_dump()
     mat_khau = du_lieu_dict.pop("password")
-    du_lieu_dict["hashed_password"] = ma_hoa.hash(mat_khau)
+    du_lieu_dict["hashed_password"] = bam_mat_khau(mat_khau)
     
     nguoi_dung = NguoiDung(**du_lieu_dict)
     phien.add(nguoi_dung)
@@ -243,11 +263,24 @@ def lay_danh_sach_don_hang(
     bo_qua: int = Query(0, ge=0),
     gioi_han: int = Query(100, ge=1, le=1000),
     trang_thai: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Keyset cursor, để rỗng cho trang đầu"),
+    dem_tong: Optional[str] = Query(None, description="exact, estimated, none"),
+    phan_hoi: Response = None,
     phien: Session = Depends(lay_phien)
 ):
     truy_van = phien.query(DonHang)
     if trang_thai:
         truy_van = truy_van.filter(DonHang.status == trang_thai)
+    if cursor is not None:
+        # order_date có thể NULL: coalesce về mốc nhỏ nhất để seek được
+        return _trang_keyset(
+            truy_van,
+            [func.coalesce(DonHang.order_date, datetime.min), DonHang.id],
+            [("order_date", True), ("id", True)],
+            "order_date_desc",
+            cursor, gioi_han, dem_tong, phan_hoi,
+            mac_dinh=[datetime.min, None],
+        )
     return truy_van.order_by(DonHang.order_date.desc()).offset(bo_qua).limit(gioi_han).all()
 
 
@@ -299,11 +332,19 @@ def lay_danh_sach_lien_he(
     bo_qua: int = Query(0, ge=0),
     gioi_han: int = Query(100, ge=1, le=1000),
     trang_thai: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Keyset cursor, để rỗng cho trang đầu"),
+    dem_tong: Optional[str] = Query(None, description="exact, estimated, none"),
+    phan_hoi: Response = None,
     phien: Session = Depends(lay_phien)
 ):
     truy_van = phien.query(LienHe)
     if trang_thai:
         truy_van = truy_van.filter(LienHe.status == trang_thai)
+    if cursor is not None:
+        return _trang_keyset(
+            truy_van, [LienHe.id], [("id", True)], "id_desc",
+            cursor, gioi_han, dem_tong, phan_hoi,
+        )
     return truy_van.order_by(LienHe.id.desc()).offset(bo_qua).limit(gioi_han).all()
 
 
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
-from ..co_so_du_lieu import lay_csdl, BaiViet as BaiVietDB
-import re
+from ..co_so_du_lieu import lay_csdl, lay_csdl_async, BaiViet as BaiVietDB
+from ..tien_ich_chuoi import tao_slug
 
 bo_dinh_tuyen = APIRouter(
     prefix="/api/blog",
@@ -41,41 +43,27 @@ class BaiVietPhanHoi(BaseModel):
     class Config:
         from_attributes = True
 
-def tao_slug(title: str) -> str:
-    """Tạo slug từ tiêu đề"""
-    slug = title.lower()
-    slug = re.sub(r'[àáạảãâầấậẩẫăằắặẳẵ]', 'a', slug)
-    slug = re.sub(r'[èéẹẻẽêềếệểễ]', 'e', slug)
-    slug = re.sub(r'[ìíịỉĩ]', 'i', slug)
-    slug = re.sub(r'[òóọỏõôồốộổỗơờớợởỡ]', 'o', slug)
-    slug = re.sub(r'[ùúụủũưừứựửữ]', 'u', slug)
-    slug = re.sub(r'[ỳýỵỷỹ]', 'y', slug)
-    slug = re.sub(r'đ', 'd', slug)
-    slug = re.sub(r'[^a-z0-9\s-]', '', slug)
-    slug = re.sub(r'[\s_-]+', '-', slug)
-    slug = slug.strip('-')
-    return slug
-
 # API endpoints
 @bo_dinh_tuyen.get("/", response_model=List[BaiVietPhanHoi])
-def lay_danh_sach_bai_viet(category: Optional[str] = None, published_only: bool = True, csdl: Session = Depends(lay_csdl)):
+async def lay_danh_sach_bai_viet(category: Optional[str] = None, published_only: bool = True, csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy danh sách bài viết blog"""
-    query = csdl.query(BaiVietDB)
+    query = select(BaiVietDB)
     if published_only:
         query = query.filter(BaiVietDB.is_published == True)
     if category:
         query = query.filter(BaiVietDB.category == category)
-    return query.order_by(BaiVietDB.created_at.desc()).all()
+    ket_qua = await csdl.scalars(query.order_by(BaiVietDB.created_at.desc()))
+    return ket_qua.all()
 
 @bo_dinh_tuyen.get("/{slug}", response_model=BaiVietPhanHoi)
-def lay_bai_viet(slug: str, csdl: Session = Depends(lay_csdl)):
+async def lay_bai_viet(slug: str, csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy chi tiết một bài viết theo slug"""
-    bai_viet = csdl.query(BaiVietDB).filter(BaiVietDB.slug == slug).first()
+    bai_viet = await csdl.scalar(select(BaiVietDB).filter(BaiVietDB.slug == slug).limit(1))
     if not bai_viet:
         raise HTTPException(status_code=404, detail="Không tìm thấy bài viết")
     # Tăng lượt xem
     bai_viet.views += 1
-    csdl.commit()
+    await csdl.commit()
     return bai_viet
 
 @bo_dinh_tuyen.post("/", response_model=BaiVietPhanHoi)
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 import json
-from ..co_so_du_lieu import lay_csdl, ChuyenGia as ChuyenGiaDB, DichVu as DichVuDB
+from ..co_so_du_lieu import lay_csdl, lay_csdl_async, ChuyenGia as ChuyenGiaDB, DichVu as DichVuDB
 from ..mo_hinh import ChuyenGia, ChuyenGiaTao, DichVu, DichVuTao
 
 bo_dinh_tuyen = APIRouter(
@@ -12,9 +14,9 @@ bo_dinh_tuyen = APIRouter(
 
 # --- Chuyên gia ---
 @bo_dinh_tuyen.get("/chuyen_gia", response_model=List[ChuyenGia])
-def lay_danh_sach_chuyen_gia(csdl: Session = Depends(lay_csdl)):
+async def lay_danh_sach_chuyen_gia(csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy tất cả hồ sơ chuyên gia"""
-    chuyen_gia = csdl.query(ChuyenGiaDB).all()
+    chuyen_gia = (await csdl.scalars(select(ChuyenGiaDB))).all()
     # Deserialize JSON strings
     for cg in chuyen_gia:
         if isinstance(cg.specialties, str):
@@ -27,9 +29,9 @@ def lay_danh_sach_chuyen_gia(csdl: Session = Depends(lay_csdl)):
     return chuyen_gia
 
 @bo_dinh_tuyen.get("/chuyen_gia/{id_chuyen_gia}", response_model=ChuyenGia)
-def lay_chuyen_gia(id_chuyen_gia: int, csdl: Session = Depends(lay_csdl)):
+async def lay_chuyen_gia(id_chuyen_gia: int, csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy chuyên gia cụ thể theo ID"""
-    chuyen_gia = csdl.query(ChuyenGiaDB).filter(ChuyenGiaDB.id == id_chuyen_gia).first()
+    chuyen_gia = await csdl.get(ChuyenGiaDB, id_chuyen_gia)
     if not chuyen_gia:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Không tìm thấy chuyên gia")
@@ -92,9 +94,9 @@ def xoa_chuyen_gia(id_chuyen_gia: int, csdl: Session = Depends(lay_csdl)):
 
 # --- Dịch vụ ---
 @bo_dinh_tuyen.get("/", response_model=List[DichVu])
-def lay_danh_sach_dich_vu(csdl: Session = Depends(lay_csdl)):
+async def lay_danh_sach_dich_vu(csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy tất cả dịch vụ trang điểm"""
-    dich_vu = csdl.query(DichVuDB).all()
+    dich_vu = (await csdl.scalars(select(DichVuDB))).all()
     # Deserialize JSON strings
     for dv in dich_vu:
         if isinstance(dv.features, str):
@@ -1,40 +1,97 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from ..co_so_du_lieu import lay_csdl, NguoiDung as NguoiDungDB, DonHang as DonHangDB, MaGiamGia as MaGiamGiaDB
+from ..co_so_du_lieu import lay_csdl, PhienLamViec, NguoiDung as NguoiDungDB, DonHang as DonHangDB, MaGiamGia as MaGiamGiaDB
 from ..mo_hinh import (
     NguoiDungTao, NguoiDung as NguoiDungSchema, 
     NguoiDungCapNhat, DonHang as DonHangSchema, MaGiamGia as MaGiamGiaSchema
 )
-from ..bao_mat import bam_mat_khau, xac_minh_mat_khau, tao_token_truy_cap
-from jose import jwt, JWTError
+from ..bao_mat import MAT_KHAU_KHONG_DUNG, VAI_TRO_KHACH_HANG, giai_ma_token, tao_token_nguoi_dung
+from ..password_hasher import PASSWORD_HASH_RETRY_AFTER, HashingOverloaded, password_hasher
+from ..principal_cache import Principal, principal_cache
+from jose import JWTError
 from decouple import config
 from pydantic import BaseModel
 from typing import Optional
 import traceback
-import os
 
 bo_dinh_tuyen = APIRouter(
     prefix="/api/nguoi_dung",
     tags=["nguoi_dung"]
 )
 
-# Sync with bao_mat.py default or env
-SECRET_KEY = os.getenv("SECRET_KEY", "ivie_wedding_secret_key_super_secure_123")
-ALGORITHM = "HS256"
+# Header trả token mới khi token cũ hết hiệu lực (đổi mật khẩu)
+ACCESS_TOKEN_HEADER = "X-Access-Token"
 
-def lay_user_tu_token(token: str, csdl: Session):
-    """Giải mã token và lấy user"""
+def _giai_ma(token: Optional[str]) -> dict:
     if not token:
         raise HTTPException(status_code=401, detail="Token không được cung cấp")
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Token không hợp lệ")
+        payload = giai_ma_token(token)
     except JWTError:
         raise HTTPException(status_code=401, detail="Token không hợp lệ")
-    
-    user = csdl.query(NguoiDungDB).filter(NguoiDungDB.username == username).first()
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Token không hợp lệ")
+    return payload
+
+def lay_username_tu_token(token: str) -> str:
+    """Giải mã token, trả username (không truy vấn database)"""
+    return _giai_ma(token)["sub"]
+
+def _doc_principal(user_id: int) -> Optional[Principal]:
+    phien = PhienLamViec()
+    try:
+        user = phien.get(NguoiDungDB, user_id)
+        return Principal.from_user(user, VAI_TRO_KHACH_HANG) if user is not None else None
+    finally:
+        phien.close()
+
+def lay_principal(token: Optional[str]) -> Principal:
+    """
+    User đã xác thực từ token (không truy vấn database khi cache hit).
+
+    Token có uid/ver: lấy từ principal_cache theo (uid, ver); ver khác
+    token_version hiện tại (đã đổi mật khẩu) -> 401.
+    Token cũ chỉ có sub: tra theo username, thiếu ver coi là 0 (user đã đổi
+    mật khẩu sau khi có token_version -> 401).
+    """
+    payload = _giai_ma(token)
+    user_id = payload.get("uid")
+    if user_id is None:
+        phien = PhienLamViec()
+        try:
+            user = phien.query(NguoiDungDB).filter(NguoiDungDB.username == payload["sub"]).first()
+            principal = Principal.from_user(user, VAI_TRO_KHACH_HANG) if user is not None else None
+        finally:
+            phien.close()
+        if principal is None:
+            raise HTTPException(status_code=401, detail="Người dùng không tồn tại")
+        if principal.token_version != payload.get("ver", 0):
+            raise HTTPException(status_code=401, detail="Token đã hết hiệu lực, vui lòng đăng nhập lại")
+        return principal
+
+    principal = principal_cache.resolve(
+        user_id, payload.get("ver", 0), lambda: _doc_principal(user_id)
+    )
+    if principal is None:
+        raise HTTPException(status_code=401, detail="Token đã hết hiệu lực, vui lòng đăng nhập lại")
+    return principal
+
+def principal_tu_query(token: str) -> Principal:
+    """Dependency: token trong query (?token=...)"""
+    return lay_principal(token)
+
+def principal_tu_header(authorization: Optional[str] = Header(None, alias="Authorization")) -> Principal:
+    """Dependency: header Authorization: Bearer <token>"""
+    token = None
+    if authorization and authorization.startswith("Bearer "):
+        token = authorization[7:]
+    return lay_principal(token)
+
+def lay_user_tu_token(token: str, csdl: Session):
+    """Xác thực token và lấy bản ghi user trong phiên csdl (khi cần sửa user)"""
+    principal = lay_principal(token)
+    user = csdl.get(NguoiDungDB, principal.id)
     if user is None:
         raise HTTPException(status_code=401, detail="Người dùng không tồn tại")
     return user
@@ -43,6 +100,27 @@ def lay_user_tu_token(token: str, csdl: Session):
 def lay_user_hien_tai(token: str, csdl: Session):
     return lay_user_tu_token(token, csdl)
 
+def _qua_tai() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Hệ thống đang bận, vui lòng thử lại sau giây lát",
+        headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+    )
+
+async def _bam_mat_khau(mat_khau: str) -> str:
+    """Băm mật khẩu trong process pool (quá tải -> 503)"""
+    try:
+        return await password_hasher.hash(mat_khau)
+    except HashingOverloaded:
+        raise _qua_tai()
+
+async def _xac_minh_mat_khau(mat_khau: str, mat_khau_bam: str):
+    """(khớp, mã băm mới nếu cost bcrypt đã đổi)"""
+    try:
+        return await password_hasher.verify(mat_khau, mat_khau_bam)
+    except HashingOverloaded:
+        raise _qua_tai()
+
 class DangNhapForm(BaseModel):
     username: str
     password: str
@@ -52,23 +130,32 @@ class Token(BaseModel):
     token_type: str
     user: NguoiDungSchema
 
+def _kiem_tra_trung(csdl: Session, du_lieu: NguoiDungTao) -> None:
+    # Kiểm tra username đã tồn tại chưa
+    db_user = csdl.query(NguoiDungDB).filter(NguoiDungDB.username == du_lieu.username).first()
+    if db_user:
+        raise HTTPException(status_code=400, detail="Tên đăng nhập đã tồn tại")
+    
+    # Kiểm tra email đã tồn tại chưa (nếu có cung cấp)
+    if du_lieu.email:
+        db_email = csdl.query(NguoiDungDB).filter(NguoiDungDB.email == du_lieu.email).first()
+        if db_email:
+            raise HTTPException(status_code=400, detail="Email đã được sử dụng")
+
+def _luu(csdl: Session, user: NguoiDungDB) -> NguoiDungDB:
+    csdl.add(user)
+    csdl.commit()
+    csdl.refresh(user)
+    return user
+
 @bo_dinh_tuyen.post("/dang_ky", response_model=NguoiDungSchema)
-def dang_ky(du_lieu: NguoiDungTao, csdl: Session = Depends(lay_csdl)):
-    """Đăng ký người dùng mới"""
+async def dang_ky(du_lieu: NguoiDungTao, csdl: Session = Depends(lay_csdl)):
+    """Đăng ký người dùng mới (truy vấn DB ở threadpool, băm mật khẩu ở process pool)"""
     try:
-        # Kiểm tra username đã tồn tại chưa
-        db_user = csdl.query(NguoiDungDB).filter(NguoiDungDB.username == du_lieu.username).first()
-        if db_user:
-            raise HTTPException(status_code=400, detail="Tên đăng nhập đã tồn tại")
-        
-        # Kiểm tra email đã tồn tại chưa (nếu có cung cấp)
-        if du_lieu.email:
-            db_email = csdl.query(NguoiDungDB).filter(NguoiDungDB.email == du_lieu.email).first()
-            if db_email:
-                raise HTTPException(status_code=400, detail="Email đã được sử dụng")
+        await run_in_threadpool(_kiem_tra_trung, csdl, du_lieu)
         
         # Tạo người dùng mới
-        mat_khau_ma_hoa = bam_mat_khau(du_lieu.password)
+        mat_khau_ma_hoa = await _bam_mat_khau(du_lieu.password)
         user_moi = NguoiDungDB(
             username=du_lieu.username,
             email=du_lieu.email,
@@ -78,31 +165,41 @@ def dang_ky(du_lieu: NguoiDungTao, csdl: Session = Depends(lay_csdl)):
             hashed_password=mat_khau_ma_hoa,
             is_active=True
         )
-        csdl.add(user_moi)
-        csdl.commit()
-        csdl.refresh(user_moi)
-        return user_moi
+        return await run_in_threadpool(_luu, csdl, user_moi)
     except HTTPException:
         raise
     except Exception as e:
-        csdl.rollback()
+        await run_in_threadpool(csdl.rollback)
         print(f"Lỗi đăng ký: {str(e)}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Lỗi server: {str(e)}")
 
+def _cap_nhat_ma_bam(csdl: Session, user: NguoiDungDB, mat_khau_bam: str) -> None:
+    # Cùng mật khẩu, chỉ đổi cost: token_version giữ nguyên
+    user.hashed_password = mat_khau_bam
+    csdl.commit()
+    csdl.refresh(user)
+
 @bo_dinh_tuyen.post("/dang_nhap", response_model=Token)
-def dang_nhap(du_lieu: DangNhapForm, csdl: Session = Depends(lay_csdl)):
-    """Đăng nhập và lấy token"""
+async def dang_nhap(du_lieu: DangNhapForm, csdl: Session = Depends(lay_csdl)):
+    """Đăng nhập và lấy token (mã băm dùng cost bcrypt cũ được băm lại)"""
     try:
-        user = csdl.query(NguoiDungDB).filter(NguoiDungDB.username == du_lieu.username).first()
-        if not user or not xac_minh_mat_khau(du_lieu.password, user.hashed_password):
+        user = await run_in_threadpool(
+            lambda: csdl.query(NguoiDungDB).filter(NguoiDungDB.username == du_lieu.username).first()
+        )
+        khop, ma_bam_moi = (
+            await _xac_minh_mat_khau(du_lieu.password, user.hashed_password) if user else (False, None)
+        )
+        if not khop:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Tên đăng nhập hoặc mật khẩu không chính xác",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        if ma_bam_moi:
+            await run_in_threadpool(_cap_nhat_ma_bam, csdl, user, ma_bam_moi)
         
-        access_token = tao_token_truy_cap(du_lieu={"sub": user.username})
+        access_token = tao_token_nguoi_dung(user)
         return {
             "access_token": access_token,
             "token_type": "bearer",
@@ -116,13 +213,11 @@ def dang_nhap(du_lieu: DangNhapForm, csdl: Session = Depends(lay_csdl)):
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Lỗi server: {str(e)}")
 
-@bo_dinh_tuyen.put("/cap_nhat", response_model=NguoiDungSchema)
-def cap_nhat_profile(du_lieu: NguoiDungCapNhat, authorization: Optional[str] = Header(None, alias="Authorization"), csdl: Session = Depends(lay_csdl)):
-    """Cập nhật thông tin cá nhân"""
-    token = None
-    if authorization and authorization.startswith("Bearer "):
-        token = authorization[7:]
-    user = lay_user_tu_token(token, csdl)
+def _cap_nhat_user(csdl: Session, user_id: int, du_lieu: NguoiDungCapNhat, mat_khau_bam: Optional[str]):
+    user = csdl.get(NguoiDungDB, user_id)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Người dùng không tồn tại")
+    phien_ban_cu = user.token_version or 0
     
     if du_lieu.full_name:
         user.full_name = du_lieu.full_name
@@ -132,22 +227,29 @@ def cap_nhat_profile(du_lieu: NguoiDungCapNhat, authorization: Optional[str] = H
         user.address = du_lieu.address
     if du_lieu.email:
         user.email = du_lieu.email
-    if du_lieu.password:
-        user.hashed_password = bam_mat_khau(du_lieu.password)
+    if mat_khau_bam:
+        user.hashed_password = mat_khau_bam
+        user.token_version = phien_ban_cu + 1
         
     csdl.commit()
     csdl.refresh(user)
+    principal_cache.invalidate(user.id, phien_ban_cu)
+    return user, phien_ban_cu
+
+@bo_dinh_tuyen.put("/cap_nhat", response_model=NguoiDungSchema)
+async def cap_nhat_profile(du_lieu: NguoiDungCapNhat, response: Response, principal: Principal = Depends(principal_tu_header), csdl: Session = Depends(lay_csdl)):
+    """Cập nhật thông tin cá nhân (đổi mật khẩu: token cũ hết hiệu lực, token mới ở header X-Access-Token)"""
+    mat_khau_bam = await _bam_mat_khau(du_lieu.password) if du_lieu.password else None
+    user, phien_ban_cu = await run_in_threadpool(_cap_nhat_user, csdl, principal.id, du_lieu, mat_khau_bam)
+    if user.token_version != phien_ban_cu:
+        response.headers[ACCESS_TOKEN_HEADER] = tao_token_nguoi_dung(user)
     return user
 
 @bo_dinh_tuyen.get("/don_hang")
-def lay_lich_su_don_hang(authorization: Optional[str] = Header(None, alias="Authorization"), csdl: Session = Depends(lay_csdl)):
+def lay_lich_su_don_hang(principal: Principal = Depends(principal_tu_header), csdl: Session = Depends(lay_csdl)):
     """Lấy danh sách đơn hàng của người dùng"""
-    token = None
-    if authorization and authorization.startswith("Bearer "):
-        token = authorization[7:]
-    user = lay_user_tu_token(token, csdl)
     # Trả về danh sách đơn hàng dạng dict
-    orders = csdl.query(DonHangDB).filter(DonHangDB.user_id == user.id).order_by(DonHangDB.order_date.desc()).all()
+    orders = csdl.query(DonHangDB).filter(DonHangDB.user_id == principal.id).order_by(DonHangDB.order_date.desc()).all()
     return [
         {
             "id": o.id,
@@ -163,16 +265,11 @@ def lay_lich_su_don_hang(authorization: Optional[str] = Header(None, alias="Auth
     ]
 
 @bo_dinh_tuyen.post("/kiem_tra_giam_gia")
-def kiem_tra_giam_gia(authorization: Optional[str] = Header(None, alias="Authorization"), csdl: Session = Depends(lay_csdl)):
+def kiem_tra_giam_gia(principal: Principal = Depends(principal_tu_header), csdl: Session = Depends(lay_csdl)):
     """Kiểm tra quyền lợi giảm giá 5% cho khách cũ"""
-    token = None
-    if authorization and authorization.startswith("Bearer "):
-        token = authorization[7:]
-    user = lay_user_tu_token(token, csdl)
-    
     # Kiểm tra xem có đơn hàng thành công nào chưa
     don_hang_cu = csdl.query(DonHangDB).filter(
-        DonHangDB.user_id == user.id,
+        DonHangDB.user_id == principal.id,
         DonHangDB.status.in_(['processing', 'shipped', 'delivered'])
     ).first()
     
@@ -209,19 +306,16 @@ def dang_nhap_social(du_lieu: DangNhapSocialForm, csdl: Session = Depends(lay_cs
                     # Cập nhật username để có thể đăng nhập bằng social
                     existing_email.username = username
                     csdl.commit()
+                    principal_cache.invalidate(existing_email.id, existing_email.token_version or 0)
                     user = existing_email
             
             if not user:
-                # Tạo user mới
-                import secrets
-                random_password = secrets.token_urlsafe(32)
-                mat_khau_ma_hoa = bam_mat_khau(random_password)
-                
+                # Tạo user mới: đăng nhập qua provider, không có mật khẩu để băm
                 user = NguoiDungDB(
                     username=username,
                     email=du_lieu.email,
                     full_name=du_lieu.full_name or f"User {du_lieu.provider.title()}",
-                    hashed_password=mat_khau_ma_hoa,
+                    hashed_password=MAT_KHAU_KHONG_DUNG,
                     is_active=True
                 )
                 csdl.add(user)
@@ -229,15 +323,20 @@ def dang_nhap_social(du_lieu: DangNhapSocialForm, csdl: Session = Depends(lay_cs
                 csdl.refresh(user)
         else:
             # Cập nhật thông tin nếu có thay đổi
+            co_thay_doi = False
             if du_lieu.full_name and not user.full_name:
                 user.full_name = du_lieu.full_name
+                co_thay_doi = True
             if du_lieu.email and not user.email:
                 user.email = du_lieu.email
+                co_thay_doi = True
             csdl.commit()
             csdl.refresh(user)
+            if co_thay_doi:
+                principal_cache.invalidate(user.id, user.token_version or 0)
         
         # Tạo token
-        access_token = tao_token_truy_cap(du_lieu={"sub": user.username})
+        access_token = tao_token_nguoi_dung(user)
         
         return {
             "access_token": access_token,
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
-from ..co_so_du_lieu import lay_csdl, GioiThieu as GioiThieuDB, DiemNhanHome as DiemNhanDB
+from ..co_so_du_lieu import lay_csdl, lay_csdl_async, GioiThieu as GioiThieuDB, DiemNhanHome as DiemNhanDB
 from ..mo_hinh import GioiThieu, GioiThieuCoBan, DiemNhanHome, DiemNhanHomeTao
 
 bo_dinh_tuyen = APIRouter(
@@ -11,8 +13,8 @@ bo_dinh_tuyen = APIRouter(
 
 # --- Giới thiệu (About Us) ---
 @bo_dinh_tuyen.get("/gioi_thieu", response_model=GioiThieu)
-def lay_gioi_thieu(csdl: Session = Depends(lay_csdl)):
-    gt = csdl.query(GioiThieuDB).first()
+async def lay_gioi_thieu(csdl: AsyncSession = Depends(lay_csdl_async)):
+    gt = await csdl.scalar(select(GioiThieuDB).limit(1))
     if not gt:
         # Tạo mặc định nếu chưa có
         gt = GioiThieuDB(
@@ -25,8 +27,8 @@ def lay_gioi_thieu(csdl: Session = Depends(lay_csdl)):
             stat3_number="100%", stat3_label="Hài Lòng"
         )
         csdl.add(gt)
-        csdl.commit()
-        csdl.refresh(gt)
+        await csdl.commit()
+        await csdl.refresh(gt)
     return gt
 
 @bo_dinh_tuyen.put("/gioi_thieu", response_model=GioiThieu)
@@ -45,8 +47,9 @@ def cap_nhat_gioi_thieu(du_lieu: GioiThieuCoBan, csdl: Session = Depends(lay_csd
 
 # --- Điểm nhấn trang chủ (Home Highlights) ---
 @bo_dinh_tuyen.get("/diem_nhan", response_model=List[DiemNhanHome])
-def lay_danh_sach_diem_nhan(csdl: Session = Depends(lay_csdl)):
-    return csdl.query(DiemNhanDB).order_by(DiemNhanDB.order).all()
+async def lay_danh_sach_diem_nhan(csdl: AsyncSession = Depends(lay_csdl_async)):
+    ket_qua = await csdl.scalars(select(DiemNhanDB).order_by(DiemNhanDB.order))
+    return ket_qua.all()
 
 @bo_dinh_tuyen.post("/diem_nhan", response_model=DiemNhanHome)
 def tao_diem_nhan(diem_nhan: DiemNhanHomeTao, csdl: Session = Depends(lay_csdl)):
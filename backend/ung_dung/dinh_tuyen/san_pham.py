@@ -1,11 +1,19 @@
 from fastapi import APIRouter, Depends, Query, File, UploadFile, Form, Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
 import shutil
 from datetime import datetime
-from ..co_so_du_lieu import lay_csdl, SanPham as SanPhamDB, DanhGia as DanhGiaDB
+from ..co_so_du_lieu import lay_csdl, lay_csdl_async, SanPham as SanPhamDB, DanhGia as DanhGiaDB
 from ..mo_hinh import SanPham, SanPhamTao, SanPhamCapNhat, DanhGia, DanhGiaCoBan
+from .. import product_events
+from ..catalog_index import SORT_SPECS, catalog_index
+from ..pagination import (
+    NEXT_CURSOR_HEADER, COUNT_NONE, count_rows, cursor_values, decode_cursor,
+    encode_cursor, paginate_keyset, validate_count_mode,
+)
 
 bo_dinh_tuyen = APIRouter(
     prefix="/api/san_pham",
@@ -13,19 +21,55 @@ bo_dinh_tuyen = APIRouter(
 )
 
 @bo_dinh_tuyen.get("/", response_model=List[SanPham])
-def lay_danh_sach_san_pham(
+async def lay_danh_sach_san_pham(
     danh_muc: Optional[str] = Query(None, description="Lọc theo danh mục: wedding_modern, traditional, vest"),
     sub_category: Optional[str] = Query(None, description="Lọc theo tiểu mục"),
     gioi_tinh: Optional[str] = Query(None, description="Lọc theo giới tính: male, female"),
     sort_by: Optional[str] = Query(None, description="Sắp xếp: price_asc, price_desc, hot, new"),
     bo_qua: int = Query(0, ge=0),
     gioi_han: int = Query(0, ge=0, le=1000),
+    cursor: Optional[str] = Query(None, description="Phân trang keyset: cursor từ header X-Next-Cursor, để rỗng cho trang đầu"),
+    dem_tong: Optional[str] = Query(None, description="Đếm tổng: exact, estimated, none"),
     phan_hoi: Response = None,
-    csdl: Session = Depends(lay_csdl)
+    csdl: AsyncSession = Depends(lay_csdl_async)
 ):
     """Lấy tất cả sản phẩm với bộ lọc và sắp xếp tùy chọn"""
+    # Build chỉ mục (nếu chưa có/quá hạn) trong thread riêng, ngoài event loop;
+    # lỗi build thì rơi về truy vấn database bên dưới
     try:
-        truy_van = csdl.query(SanPhamDB)
+        await catalog_index.ensure_loaded_async()
+    except Exception as e:
+        print(f"[WARN] không build được catalog index: {str(e)}")
+
+    # Chế độ keyset khi có tham số cursor (kể cả rỗng); bo_qua bị bỏ qua
+    if cursor is not None:
+        dem_tong = validate_count_mode(dem_tong, COUNT_NONE)
+        # Query API dự phòng là sync: chạy qua run_sync trên cùng kết nối async
+        return await csdl.run_sync(
+            lambda phien: _lay_trang_theo_cursor(
+                danh_muc, sub_category, gioi_tinh, sort_by, cursor,
+                gioi_han or 20, dem_tong, phan_hoi, phien,
+            )
+        )
+
+    try:
+        # Trả lời từ chỉ mục trong bộ nhớ, không truy vấn database
+        items, tong_so = catalog_index.query(
+            category=danh_muc,
+            sub_category=sub_category,
+            gender=gioi_tinh,
+            sort_by=sort_by,
+            offset=bo_qua if gioi_han else 0,
+            limit=gioi_han,
+        )
+        if phan_hoi is not None:
+            phan_hoi.headers["X-Total-Count"] = str(tong_so)
+        return items
+    except Exception as e:
+        print(f"[WARN] catalog index không khả dụng, truy vấn database: {str(e)}")
+
+    try:
+        truy_van = select(SanPhamDB)
         
         if danh_muc:
             # Support combined categories like 'vest'
@@ -48,13 +92,15 @@ def lay_danh_sach_san_pham(
             # Default sort by ID desc
             truy_van = truy_van.order_by(SanPhamDB.id.desc())
         
-        tong_so = truy_van.count()
+        tong_so = await csdl.scalar(
+            select(func.count()).select_from(truy_van.order_by(None).subquery())
+        )
         if phan_hoi is not None:
             phan_hoi.headers["X-Total-Count"] = str(tong_so)
 
         if gioi_han and gioi_han > 0:
-            return truy_van.offset(bo_qua).limit(gioi_han).all()
-        return truy_van.all()
+            truy_van = truy_van.offset(bo_qua).limit(gioi_han)
+        return (await csdl.scalars(truy_van)).all()
     except Exception as e:
         from fastapi import HTTPException
         import traceback
@@ -63,10 +109,61 @@ def lay_danh_sach_san_pham(
         raise HTTPException(status_code=500, detail=f"Lỗi database: {str(e)}")
 
 
+def _lay_trang_theo_cursor(danh_muc, sub_category, gioi_tinh, sort_by, cursor, kich_thuoc, dem_tong, phan_hoi, csdl):
+    """Trang keyset: seek theo (sort key, id) thay vì OFFSET"""
+    khoa_sap_xep = sort_by if sort_by in SORT_SPECS else None
+    spec = SORT_SPECS[khoa_sap_xep]
+    ten_sap_xep = khoa_sap_xep or "id_desc"
+    sau = decode_cursor(cursor, ten_sap_xep, spec)
+
+    try:
+        items, tong_so = catalog_index.query(
+            category=danh_muc,
+            sub_category=sub_category,
+            gender=gioi_tinh,
+            sort_by=khoa_sap_xep,
+            limit=kich_thuoc + 1,
+            after=sau,
+        )
+        cursor_tiep = None
+        if len(items) > kich_thuoc:
+            items = items[:kich_thuoc]
+            cursor_tiep = encode_cursor(ten_sap_xep, cursor_values(items[-1], spec))
+    except Exception as e:
+        print(f"[WARN] catalog index không khả dụng, truy vấn database: {str(e)}")
+        truy_van = csdl.query(SanPhamDB)
+        if danh_muc:
+            truy_van = truy_van.filter(SanPhamDB.category == danh_muc)
+        if sub_category:
+            truy_van = truy_van.filter(SanPhamDB.sub_category == sub_category)
+        if gioi_tinh:
+            truy_van = truy_van.filter(SanPhamDB.gender == gioi_tinh)
+
+        cot = {
+            "id": SanPhamDB.id,
+            "rental_price_day": SanPhamDB.rental_price_day,
+            "is_hot": func.coalesce(SanPhamDB.is_hot, False),
+            "is_new": func.coalesce(SanPhamDB.is_new, False),
+        }
+        mac_dinh = [False if truong in ("is_hot", "is_new") else None for truong, _ in spec]
+        tong_so = count_rows(truy_van, dem_tong)
+        items, cursor_tiep = paginate_keyset(
+            truy_van, [cot[truong] for truong, _ in spec], spec, ten_sap_xep, cursor,
+            kich_thuoc, mac_dinh,
+        )
+
+    if phan_hoi is not None:
+        if tong_so is not None and dem_tong != COUNT_NONE:
+            phan_hoi.headers["X-Total-Count"] = str(tong_so)
+        if cursor_tiep:
+            phan_hoi.headers[NEXT_CURSOR_HEADER] = cursor_tiep
+    return items
+
+
 @bo_dinh_tuyen.get("/{id_san_pham}", response_model=SanPham)
-def lay_san_pham(id_san_pham: int, csdl: Session = Depends(lay_csdl)):
+async def lay_san_pham(id_san_pham: int, csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy sản phẩm cụ thể theo ID"""
-    san_pham = csdl.query(SanPhamDB).filter(SanPhamDB.id == id_san_pham).first()
+    san_pham = await csdl.get(SanPhamDB, id_san_pham)
     if not san_pham:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Không tìm thấy sản phẩm")
@@ -88,6 +185,7 @@ def tao_san_pham(san_pham: SanPhamTao, csdl: Session = Depends(lay_csdl)):
     csdl.add(san_pham_moi)
     csdl.commit()
     csdl.refresh(san_pham_moi)
+    product_events.notify_saved([san_pham_moi])
     return san_pham_moi
 
 @bo_dinh_tuyen.put("/{id_san_pham}", response_model=SanPham)
@@ -112,6 +210,7 @@ def cap_nhat_san_pham(id_san_pham: int, san_pham: SanPhamCapNhat, csdl: Session
     
     csdl.commit()
     csdl.refresh(san_pham_cu)
+    product_events.notify_saved([san_pham_cu])
     return san_pham_cu
 
 @bo_dinh_tuyen.delete("/{id_san_pham}")
@@ -124,16 +223,18 @@ def xoa_san_pham(id_san_pham: int, csdl: Session = Depends(lay_csdl)):
     
     csdl.delete(san_pham)
     csdl.commit()
+    product_events.notify_deleted([id_san_pham])
     return {"thong_bao": "Đã xóa sản phẩm thành công"}
 
 # Endpoints for Reviews
 @bo_dinh_tuyen.get("/{id_san_pham}/danh_gia", response_model=List[DanhGia])
-def lay_danh_gia_san_pham(id_san_pham: int, csdl: Session = Depends(lay_csdl)):
+async def lay_danh_gia_san_pham(id_san_pham: int, csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy danh sách đánh giá ĐÃ DUYỆT của một sản phẩm"""
-    return csdl.query(DanhGiaDB).filter(
+    ket_qua = await csdl.scalars(select(DanhGiaDB).filter(
         DanhGiaDB.product_id == id_san_pham,
         DanhGiaDB.is_approved == True # Only approved
-    ).order_by(DanhGiaDB.created_at.desc()).all()
+    ).order_by(DanhGiaDB.created_at.desc()))
+    return ket_qua.all()
 
 def quet_virus_gia_lap(file_path: str) -> bool:
     """
@@ -225,6 +326,8 @@ def duyet_danh_gia(id_danh_gia: int, csdl: Session = Depends(lay_csdl)):
         return {"loi": "Không tìm thấy đánh giá"}
     dg.is_approved = True
     csdl.commit()
+    # Đánh giá hiển thị trong chi tiết sản phẩm: báo để xóa cache của sản phẩm
+    product_events.notify_saved([csdl.get(SanPhamDB, dg.product_id)])
     return {"thong_bao": "Đã duyệt đánh giá thành công"}
 
 @bo_dinh_tuyen.delete("/admin/xoa_danh_gia/{id_danh_gia}")
@@ -233,6 +336,8 @@ def xoa_danh_gia(id_danh_gia: int, csdl: Session = Depends(lay_csdl)):
     dg = csdl.query(DanhGiaDB).filter(DanhGiaDB.id == id_danh_gia).first()
     if not dg:
         return {"loi": "Không tìm thấy đánh giá"}
+    product_id = dg.product_id
     csdl.delete(dg)
     csdl.commit()
+    product_events.notify_saved([csdl.get(SanPhamDB, product_id)])
     return {"thong_bao": "Đã xóa đánh giá"}
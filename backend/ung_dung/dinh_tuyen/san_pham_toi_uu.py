@@ -13,17 +13,29 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
-from sqlalchemy import and_, asc, desc, func, or_
+from sqlalchemy import and_, asc, case, desc, func, or_
 from sqlalchemy.orm import Session, joinedload
 
 from ..co_so_du_lieu import DanhGia as DanhGiaDB
 from ..co_so_du_lieu import SanPham as SanPhamDB
 from ..co_so_du_lieu import lay_csdl
+from .. import product_events
+from ..autocomplete import product_autocomplete
+from ..search_engine import product_search
+from ..pagination import (
+    COUNT_EXACT,
+    COUNT_NONE,
+    NEXT_CURSOR_HEADER,
+    count_rows,
+    paginate_keyset,
+    validate_count_mode,
+)
 from ..mo_hinh import DanhGia, SanPham, SanPhamCapNhat, SanPhamTao
 
 # Import caching utilities
 try:
     from ..cache_advanced import (
+        CACHE_TAGS,
         CACHE_TTL,
         cached,
         get_or_set,
@@ -32,6 +44,9 @@ try:
     )
 
     HAS_CACHE = True
+
+    # Tags của các cache dạng danh sách/tổng hợp sản phẩm
+    LIST_TAGS = [CACHE_TAGS["PRODUCTS"], CACHE_TAGS["PRODUCT_LISTS"]]
 except ImportError:
     HAS_CACHE = False
 
@@ -68,9 +83,21 @@ class PaginatedResponse:
 
 
 def create_paginated_response(
-    items: List[Any], total: int, page: int, page_size: int
+    items: List[Any], total: Optional[int], page: int, page_size: int
 ) -> Dict[str, Any]:
-    """Tạo paginated response dict"""
+    """Tạo paginated response dict (total=None khi không đếm tổng)"""
+    if total is None:
+        return {
+            "items": items,
+            "pagination": {
+                "total": None,
+                "page": page,
+                "page_size": page_size,
+                "total_pages": None,
+                "has_next": False,
+                "has_prev": page > 1,
+            },
+        }
     total_pages = (total + page_size - 1) // page_size if page_size > 0 else 0
     return {
         "items": items,
@@ -89,6 +116,30 @@ def create_paginated_response(
 # OPTIMIZED LIST ENDPOINT
 # =============================================================================
 
+# Sort keyset: (cột SQL, sort spec) - luôn kết thúc bằng id để thứ tự ổn định
+KEYSET_SORTS = {
+    "price_asc": (
+        [SanPhamDB.rental_price_day, SanPhamDB.id],
+        [("rental_price_day", False), ("id", False)],
+    ),
+    "price_desc": (
+        [SanPhamDB.rental_price_day, SanPhamDB.id],
+        [("rental_price_day", True), ("id", True)],
+    ),
+    "hot": (
+        [func.coalesce(SanPhamDB.is_hot, False), SanPhamDB.id],
+        [("is_hot", True), ("id", True)],
+    ),
+    "new": (
+        [func.coalesce(SanPhamDB.is_new, False), SanPhamDB.id],
+        [("is_new", True), ("id", True)],
+    ),
+    "id_asc": ([SanPhamDB.id], [("id", False)]),
+    "id_desc": ([SanPhamDB.id], [("id", True)]),
+    "name_asc": ([SanPhamDB.name, SanPhamDB.id], [("name", False), ("id", False)]),
+    "name_desc": ([SanPhamDB.name, SanPhamDB.id], [("name", True), ("id", True)]),
+}
+
 
 @bo_dinh_tuyen.get("/")
 def lay_danh_sach_san_pham_optimized(
@@ -103,12 +154,20 @@ def lay_danh_sach_san_pham_optimized(
     search: Optional[str] = Query(None, description="Tìm kiếm theo tên/mã"),
     # Sorting
     sort_by: Optional[str] = Query(
-        "id_desc",
-        description="Sắp xếp: price_asc, price_desc, hot, new, id_asc, id_desc",
+        None,
+        description="Sắp xếp: relevance, price_asc, price_desc, hot, new, id_asc, id_desc "
+        "(mặc định: relevance khi có search, ngược lại id_desc)",
     ),
     # Pagination
     page: int = Query(1, ge=1, description="Số trang"),
     page_size: int = Query(20, ge=1, le=100, description="Số item mỗi trang"),
+    # Keyset pagination
+    cursor: Optional[str] = Query(
+        None, description="Cursor trang trước (keyset), để rỗng cho trang đầu"
+    ),
+    dem_tong: Optional[str] = Query(
+        None, description="Đếm tổng: exact, estimated, none"
+    ),
     # Legacy support
     bo_qua: Optional[int] = Query(None, ge=0, description="Skip (legacy)"),
     gioi_han: Optional[int] = Query(None, ge=0, le=1000, description="Limit (legacy)"),
@@ -119,21 +178,27 @@ def lay_danh_sach_san_pham_optimized(
     """
     Lấy danh sách sản phẩm với pagination và filters tối ưu.
 
-    Hỗ trợ cả pagination mới (page/page_size) và legacy (bo_qua/gioi_han).
+    Hỗ trợ pagination theo trang (page/page_size), keyset (cursor) và
+    legacy (bo_qua/gioi_han).
     """
+    che_do_dem = validate_count_mode(
+        dem_tong, COUNT_NONE if cursor is not None else COUNT_EXACT
+    )
 
     # Generate cache key từ parameters
-    cache_key = f"products:{danh_muc}:{sub_category}:{gioi_tinh}:{is_hot}:{is_new}:{price_min}:{price_max}:{search}:{sort_by}:{page}:{page_size}"
+    cache_key = f"products:{danh_muc}:{sub_category}:{gioi_tinh}:{is_hot}:{is_new}:{price_min}:{price_max}:{search}:{sort_by}:{page}:{page_size}:{cursor}:{che_do_dem}"
 
     # Try cache first
     if HAS_CACHE:
         cached_result = redis_client.get(cache_key)
         if cached_result is not None:
             if phan_hoi:
+                pagination = cached_result.get("pagination", {})
                 phan_hoi.headers["X-Cache"] = "HIT"
-                phan_hoi.headers["X-Total-Count"] = str(
-                    cached_result.get("pagination", {}).get("total", 0)
-                )
+                if pagination.get("total") is not None:
+                    phan_hoi.headers["X-Total-Count"] = str(pagination["total"])
+                if pagination.get("next_cursor"):
+                    phan_hoi.headers[NEXT_CURSOR_HEADER] = pagination["next_cursor"]
             return cached_result
 
     # Build optimized query
@@ -163,19 +228,55 @@ def lay_danh_sach_san_pham_optimized(
     if price_max is not None:
         filters.append(SanPhamDB.rental_price_day <= price_max)
 
+    # Tìm kiếm toàn văn không dấu: danh sách id đã xếp hạng
+    xep_hang = None
     if search:
-        search_term = f"%{search}%"
-        filters.append(
-            or_(
-                SanPhamDB.name.ilike(search_term),
-                SanPhamDB.code.ilike(search_term),
-                SanPhamDB.description.ilike(search_term),
+        xep_hang = _tim_kiem_xep_hang(csdl, search)
+        if xep_hang is None:
+            search_term = f"%{search}%"
+            filters.append(
+                or_(
+                    SanPhamDB.name.ilike(search_term),
+                    SanPhamDB.code.ilike(search_term),
+                    SanPhamDB.description.ilike(search_term),
+                )
             )
-        )
+        else:
+            filters.append(SanPhamDB.id.in_([pid for pid, _ in xep_hang]))
 
     if filters:
         truy_van = truy_van.filter(and_(*filters))
 
+    # Keyset pagination: seek theo (sort key, id), không OFFSET
+    if cursor is not None:
+        ten_sap_xep = sort_by if sort_by in KEYSET_SORTS else "id_desc"
+        cot, spec = KEYSET_SORTS[ten_sap_xep]
+        mac_dinh = [False if truong in ("is_hot", "is_new") else None for truong, _ in spec]
+        tong_so = count_rows(truy_van, che_do_dem)
+        items, next_cursor = paginate_keyset(
+            truy_van, cot, spec, ten_sap_xep, cursor, page_size, mac_dinh
+        )
+
+        if phan_hoi:
+            if tong_so is not None:
+                phan_hoi.headers["X-Total-Count"] = str(tong_so)
+            if next_cursor:
+                phan_hoi.headers[NEXT_CURSOR_HEADER] = next_cursor
+            phan_hoi.headers["X-Cache"] = "MISS"
+
+        result = {
+            "items": items,
+            "pagination": {
+                "total": tong_so,
+                "page_size": page_size,
+                "next_cursor": next_cursor,
+                "has_next": next_cursor is not None,
+            },
+        }
+        if HAS_CACHE:
+            redis_client.set(cache_key, result, CACHE_TTL["MEDIUM"], LIST_TAGS)
+        return result
+
     # Apply sorting
     sort_mapping = {
         "price_asc": SanPhamDB.rental_price_day.asc(),
@@ -190,15 +291,19 @@ def lay_danh_sach_san_pham_optimized(
 
     if sort_by in sort_mapping:
         truy_van = truy_van.order_by(sort_mapping[sort_by])
+    elif xep_hang and sort_by in (None, "relevance"):
+        thu_tu = {pid: vi_tri for vi_tri, (pid, _) in enumerate(xep_hang)}
+        truy_van = truy_van.order_by(case(thu_tu, value=SanPhamDB.id))
     else:
         truy_van = truy_van.order_by(SanPhamDB.id.desc())
 
     # Count total (optimized - chỉ count một lần)
-    tong_so = truy_van.count()
+    tong_so = count_rows(truy_van, che_do_dem)
 
     # Set response headers
     if phan_hoi:
-        phan_hoi.headers["X-Total-Count"] = str(tong_so)
+        if tong_so is not None:
+            phan_hoi.headers["X-Total-Count"] = str(tong_so)
         phan_hoi.headers["X-Cache"] = "MISS"
 
     # Handle legacy pagination
@@ -214,10 +319,12 @@ def lay_danh_sach_san_pham_optimized(
 
     # Create response
     result = create_paginated_response(items, tong_so, page, page_size)
+    if tong_so is None:
+        result["pagination"]["has_next"] = len(items) == page_size
 
     # Cache result
     if HAS_CACHE:
-        redis_client.set(cache_key, result, CACHE_TTL["MEDIUM"])
+        redis_client.set(cache_key, result, CACHE_TTL["MEDIUM"], LIST_TAGS)
 
     return result
 
@@ -271,7 +378,12 @@ def lay_san_pham_optimized(
 
     # Cache
     if HAS_CACHE:
-        redis_client.set(cache_key, result, CACHE_TTL["LONG"])
+        redis_client.set(
+            cache_key,
+            result,
+            CACHE_TTL["LONG"],
+            [CACHE_TAGS["PRODUCTS"], CACHE_TAGS["PRODUCT"].format(id=id_san_pham)],
+        )
 
     return result
 
@@ -293,14 +405,16 @@ def tao_nhieu_san_pham(
         raise HTTPException(status_code=400, detail="Tối đa 100 sản phẩm mỗi lần")
 
     try:
-        # Bulk insert
+        # Insert một lần flush (cần id để cập nhật chỉ mục từng sản phẩm)
         san_pham_moi = [SanPhamDB(**sp.dict()) for sp in san_pham_list]
-        csdl.bulk_save_objects(san_pham_moi)
+        csdl.add_all(san_pham_moi)
+        csdl.flush()
+        ids = [sp.id for sp in san_pham_moi]
         csdl.commit()
-
-        # Invalidate cache
-        if HAS_CACHE:
-            invalidator.invalidate_products()
+        # Tối đa 100 dòng: cập nhật chỉ mục theo dòng thay vì build lại toàn bộ
+        product_events.notify_saved(
+            csdl.query(SanPhamDB).filter(SanPhamDB.id.in_(ids)).all()
+        )
 
         return {
             "success": True,
@@ -324,6 +438,7 @@ def cap_nhat_nhieu_san_pham(
         raise HTTPException(status_code=400, detail="Tối đa 100 sản phẩm mỗi lần")
 
     updated_count = 0
+    updated_ids = []
     errors = []
 
     try:
@@ -341,14 +456,15 @@ def cap_nhat_nhieu_san_pham(
 
             if result:
                 updated_count += 1
+                updated_ids.append(product_id)
             else:
                 errors.append({"error": "Not found", "id": product_id})
 
         csdl.commit()
-
-        # Invalidate cache
-        if HAS_CACHE:
-            invalidator.invalidate_products()
+        if updated_ids:
+            product_events.notify_saved(
+                csdl.query(SanPhamDB).filter(SanPhamDB.id.in_(updated_ids)).all()
+            )
 
         return {
             "success": True,
@@ -374,10 +490,7 @@ def xoa_nhieu_san_pham(ids: List[int], csdl: Session = Depends(lay_csdl)):
         )
 
         csdl.commit()
-
-        # Invalidate cache
-        if HAS_CACHE:
-            invalidator.invalidate_products()
+        product_events.notify_deleted(ids)
 
         return {
             "success": True,
@@ -403,9 +516,7 @@ def toggle_hot(id_san_pham: int, csdl: Session = Depends(lay_csdl)):
 
     san_pham.is_hot = not san_pham.is_hot
     csdl.commit()
-
-    if HAS_CACHE:
-        invalidator.invalidate_products()
+    product_events.notify_saved([san_pham])
 
     return {"id": id_san_pham, "is_hot": san_pham.is_hot}
 
@@ -419,9 +530,7 @@ def toggle_new(id_san_pham: int, csdl: Session = Depends(lay_csdl)):
 
     san_pham.is_new = not san_pham.is_new
     csdl.commit()
-
-    if HAS_CACHE:
-        invalidator.invalidate_products()
+    product_events.notify_saved([san_pham])
 
     return {"id": id_san_pham, "is_new": san_pham.is_new}
 
@@ -478,7 +587,7 @@ def thong_ke_san_pham(csdl: Session = Depends(lay_csdl)):
     stats["by_gender"] = {gender: count for gender, count in gender_counts if gender}
 
     if HAS_CACHE:
-        redis_client.set(cache_key, stats, CACHE_TTL["MEDIUM"])
+        redis_client.set(cache_key, stats, CACHE_TTL["MEDIUM"], LIST_TAGS)
 
     return stats
 
@@ -514,7 +623,9 @@ def danh_muc_san_pham(csdl: Session = Depends(lay_csdl)):
             categories[cat]["sub_categories"][sub_cat] = count
 
     if HAS_CACHE:
-        redis_client.set(cache_key, categories, CACHE_TTL["LONG"])
+        redis_client.set(
+            cache_key, categories, CACHE_TTL["LONG"], LIST_TAGS + [CACHE_TAGS["CATEGORIES"]]
+        )
 
     return categories
 
@@ -524,6 +635,22 @@ def danh_muc_san_pham(csdl: Session = Depends(lay_csdl)):
 # =============================================================================
 
 
+def _tim_kiem_xep_hang(csdl: Session, tu_khoa: str) -> Optional[List[Any]]:
+    """
+    Tìm kiếm toàn văn qua search_engine.
+
+    Returns:
+        [(id, điểm)] xếp hạng giảm dần, hoặc None nếu search engine lỗi
+        (khi đó route quay về lọc ilike)
+    """
+    try:
+        return product_search.search(csdl, tu_khoa)
+    except Exception as e:
+        print(f"[WARN] search engine không khả dụng, dùng ilike: {str(e)}")
+        csdl.rollback()
+        return None
+
+
 @bo_dinh_tuyen.get("/search/suggestions")
 def goi_y_tim_kiem(
     q: str = Query(..., min_length=2, description="Từ khóa tìm kiếm"),
@@ -533,7 +660,16 @@ def goi_y_tim_kiem(
     """
     Gợi ý tìm kiếm nhanh cho autocomplete.
     Trả về danh sách tên và mã sản phẩm matching.
+
+    Trả lời từ prefix trie trong bộ nhớ (không truy vấn database); chỉ khi
+    trie không có kết quả mới dùng tìm kiếm toàn văn.
     """
+    try:
+        suggestions = product_autocomplete.suggest(q, limit, csdl)
+        if suggestions:
+            return suggestions
+    except Exception as e:
+        print(f"[WARN] autocomplete trie không khả dụng: {str(e)}")
 
     cache_key = f"products:search:suggestions:{q}:{limit}"
 
@@ -542,17 +678,22 @@ def goi_y_tim_kiem(
         if cached:
             return cached
 
-    search_term = f"%{q}%"
-
     # Chỉ lấy các trường cần thiết cho performance
-    results = (
-        csdl.query(SanPhamDB.id, SanPhamDB.name, SanPhamDB.code, SanPhamDB.category)
-        .filter(
-            or_(SanPhamDB.name.ilike(search_term), SanPhamDB.code.ilike(search_term))
+    truy_van = csdl.query(SanPhamDB.id, SanPhamDB.name, SanPhamDB.code, SanPhamDB.category)
+    xep_hang = _tim_kiem_xep_hang(csdl, q)
+    if xep_hang is None:
+        search_term = f"%{q}%"
+        results = (
+            truy_van.filter(
+                or_(SanPhamDB.name.ilike(search_term), SanPhamDB.code.ilike(search_term))
+            )
+            .limit(limit)
+            .all()
         )
-        .limit(limit)
-        .all()
-    )
+    else:
+        ids = [pid for pid, _ in xep_hang[:limit]]
+        rows = {r.id: r for r in truy_van.filter(SanPhamDB.id.in_(ids)).all()} if ids else {}
+        results = [rows[pid] for pid in ids if pid in rows]
 
     suggestions = [
         {"id": r.id, "name": r.name, "code": r.code, "category": r.category}
@@ -560,7 +701,7 @@ def goi_y_tim_kiem(
     ]
 
     if HAS_CACHE:
-        redis_client.set(cache_key, suggestions, CACHE_TTL["SHORT"])
+        redis_client.set(cache_key, suggestions, CACHE_TTL["SHORT"], LIST_TAGS)
 
     return suggestions
 
@@ -577,9 +718,7 @@ def tao_san_pham(san_pham: SanPhamTao, csdl: Session = Depends(lay_csdl)):
     csdl.add(san_pham_moi)
     csdl.commit()
     csdl.refresh(san_pham_moi)
-
-    if HAS_CACHE:
-        invalidator.invalidate_products()
+    product_events.notify_saved([san_pham_moi])
 
     return san_pham_moi
 
@@ -599,10 +738,7 @@ def cap_nhat_san_pham(
 
     csdl.commit()
     csdl.refresh(san_pham_cu)
-
-    if HAS_CACHE:
-        invalidator.invalidate_products()
-        redis_client.delete(f"product:{id_san_pham}")
+    product_events.notify_saved([san_pham_cu])
 
     return san_pham_cu
 
@@ -616,10 +752,7 @@ def xoa_san_pham(id_san_pham: int, csdl: Session = Depends(lay_csdl)):
 
     csdl.delete(san_pham)
     csdl.commit()
-
-    if HAS_CACHE:
-        invalidator.invalidate_products()
-        redis_client.delete(f"product:{id_san_pham}")
+    product_events.notify_deleted([id_san_pham])
 
     return {"success": True, "message": "Đã xóa sản phẩm"}
 
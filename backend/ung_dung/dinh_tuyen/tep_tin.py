@@ -1,7 +1,6 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
 import os
 import base64
-import httpx
 
 bo_dinh_tuyen = APIRouter(
     prefix="/api/tap_tin",
@@ -36,7 +35,9 @@ async def tai_len_anh(file: UploadFile = File(...)):
         # Encode sang base64
         base64_image = base64.b64encode(contents).decode('utf-8')
         
-        # Upload lên ImgBB
+        # Upload lên ImgBB (import httpx khi cần, không nằm trên đường khởi động)
+        import httpx
+
         async with httpx.AsyncClient() as client:
             response = await client.post(
                 "https://api.imgbb.com/1/upload",
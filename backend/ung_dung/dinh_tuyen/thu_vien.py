@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
-from ..co_so_du_lieu import lay_csdl, ThuVien as ThuVienDB
+from ..co_so_du_lieu import lay_csdl, lay_csdl_async, ThuVien as ThuVienDB
 from ..mo_hinh import ThuVien, ThuVienTao
 
 bo_dinh_tuyen = APIRouter(
@@ -10,9 +12,10 @@ bo_dinh_tuyen = APIRouter(
 )
 
 @bo_dinh_tuyen.get("/", response_model=List[ThuVien])
-def lay_danh_sach_thu_vien(csdl: Session = Depends(lay_csdl)):
+async def lay_danh_sach_thu_vien(csdl: AsyncSession = Depends(lay_csdl_async)):
     """Lấy tất cả ảnh trong thư viện"""
-    return csdl.query(ThuVienDB).order_by(ThuVienDB.order).all()
+    ket_qua = await csdl.scalars(select(ThuVienDB).order_by(ThuVienDB.order))
+    return ket_qua.all()
 
 @bo_dinh_tuyen.post("/", response_model=ThuVien)
 def tao_thu_vien(item: ThuVienTao, csdl: Session = Depends(lay_csdl)):
@@ -1,19 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException
+import os
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, WebSocket, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from ..co_so_du_lieu import lay_csdl, TinNhanChat as TinNhanDB
+from ..chat_hub import ADMIN_CHANNEL, chat_hub, pump_websocket, sse_events, user_channel
+from ..co_so_du_lieu import lay_csdl, NguoiDung, TinNhanChat as TinNhanDB
 from ..mo_hinh import TinNhanChatTao, TinNhanChat as TinNhanSchema
-from .nguoi_dung import lay_user_hien_tai
+from ..pagination import NEXT_CURSOR_HEADER, paginate_keyset
+from ..principal_cache import Principal
+from .nguoi_dung import lay_principal, principal_tu_query
 
 bo_dinh_tuyen = APIRouter(
     prefix="/api/chat",
     tags=["chat"]
 )
 
+# Header SSE: không cache, không buffer ở proxy (nginx)
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Khóa cho kênh realtime admin (/admin/ws, /admin/su_kien): nhận tin của mọi
+# khách hàng nên bắt buộc xác thực; để rỗng = tắt kênh admin
+CHAT_ADMIN_KEY = os.getenv("CHAT_ADMIN_KEY", "")
+
+
+def _khoa_admin(
+    admin_key: Optional[str] = Query(None, description="Khóa admin (WebSocket không gửi được header)"),
+    x_admin_key: Optional[str] = Header(None),
+) -> Optional[str]:
+    """Dependency: khóa admin từ header X-Admin-Key hoặc query ?admin_key="""
+    return x_admin_key or admin_key
+
+
+def _khoa_admin_hop_le(khoa: Optional[str]) -> bool:
+    if not CHAT_ADMIN_KEY or not khoa:
+        return False
+    return secrets.compare_digest(khoa.encode(), CHAT_ADMIN_KEY.encode())
+
+
+def _phat_tin(tin: TinNhanDB) -> None:
+    """Đẩy tin vừa lưu tới kết nối realtime của user và admin"""
+    chat_hub.publish(TinNhanSchema.model_validate(tin).model_dump(mode="json"))
+
+
+def _lich_su(csdl: Session, user_id: int, sau_id: Optional[int]):
+    """Tin nhắn của user theo thời gian; sau_id: chỉ tin mới hơn (id > sau_id)"""
+    truy_van = csdl.query(TinNhanDB).filter(TinNhanDB.user_id == user_id)
+    if sau_id is not None:
+        truy_van = truy_van.filter(TinNhanDB.id > sau_id)
+    return truy_van.order_by(TinNhanDB.thoi_gian.asc(), TinNhanDB.id.asc()).all()
+
 @bo_dinh_tuyen.post("/gui", response_model=TinNhanSchema)
-def gui_tin_nhan(du_lieu: TinNhanChatTao, token: str, csdl: Session = Depends(lay_csdl)):
+def gui_tin_nhan(du_lieu: TinNhanChatTao, user: Principal = Depends(principal_tu_query), csdl: Session = Depends(lay_csdl)):
     """Gửi tin nhắn lên admin"""
-    user = lay_user_hien_tai(token, csdl)
-    
     tin_moi = TinNhanDB(
         user_id=user.id,
         tin_nhan=du_lieu.tin_nhan,
@@ -22,43 +64,122 @@ def gui_tin_nhan(du_lieu: TinNhanChatTao, token: str, csdl: Session = Depends(la
     csdl.add(tin_moi)
     csdl.commit()
     csdl.refresh(tin_moi)
+    _phat_tin(tin_moi)
     return tin_moi
 
 @bo_dinh_tuyen.get("/lich_su", response_model=list[TinNhanSchema])
-def lay_lich_su_chat(token: str, csdl: Session = Depends(lay_csdl)):
-    """Lấy lịch sử chat của người dùng"""
-    user = lay_user_hien_tai(token, csdl)
-    
-    tin_nhans = csdl.query(TinNhanDB).filter(TinNhanDB.user_id == user.id).order_by(TinNhanDB.thoi_gian.asc()).all()
-    return tin_nhans
+def lay_lich_su_chat(
+    user: Principal = Depends(principal_tu_query),
+    sau_id: Optional[int] = Query(None, description="Chỉ lấy tin có id lớn hơn (tin cuối client đã có)"),
+    csdl: Session = Depends(lay_csdl)
+):
+    """Lấy lịch sử chat của người dùng (toàn bộ hoặc phần mới sau sau_id)"""
+    return _lich_su(csdl, user.id, sau_id)
+
+@bo_dinh_tuyen.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, token: str):
+    """Realtime: nhận tin mới của hội thoại ({"type": "message" | "resync" | "ping"})"""
+    try:
+        user_id = (await run_in_threadpool(lay_principal, token)).id
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    await pump_websocket(websocket, user_channel(user_id))
+
+@bo_dinh_tuyen.get("/su_kien")
+async def chat_su_kien(token: str):
+    """Realtime qua Server-Sent Events (fallback khi không mở được WebSocket)"""
+    user_id = (await run_in_threadpool(lay_principal, token)).id
+    return StreamingResponse(
+        sse_events(user_channel(user_id)), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+# Hộp thư admin: hội thoại mới nhất trước (id user phá hòa)
+SAP_XEP_HOP_THU = [("last_time", True), ("id", True)]
 
 @bo_dinh_tuyen.get("/admin/cac_phien_chat")
-def lay_cac_phien_chat_admin(csdl: Session = Depends(lay_csdl)):
-    """Admin: Lấy danh sách người dùng đã chat"""
-    from ..co_so_du_lieu import NguoiDung
-    from sqlalchemy import func
-    
-    # Lấy các user_id duy nhất từ bảng tin nhắn
-    subquery = csdl.query(TinNhanDB.user_id).distinct().subquery()
-    users = csdl.query(NguoiDung).filter(NguoiDung.id.in_(subquery)).all()
-    
-    res = []
-    for u in users:
-        # Lấy tin nhắn cuối cùng
-        last_msg = csdl.query(TinNhanDB).filter(TinNhanDB.user_id == u.id).order_by(TinNhanDB.thoi_gian.desc()).first()
-        res.append({
-            "id": u.id,
-            "username": u.username,
-            "full_name": u.full_name,
-            "last_message": last_msg.tin_nhan if last_msg else "",
-            "last_time": last_msg.thoi_gian if last_msg else None
-        })
-    return sorted(res, key=lambda x: x["last_time"] or "", reverse=True)
+def lay_cac_phien_chat_admin(
+    gioi_han: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Cursor từ header X-Next-Cursor, để trống cho trang đầu"),
+    phan_hoi: Response = None,
+    csdl: Session = Depends(lay_csdl)
+):
+    """
+    Admin: Danh sách hội thoại kèm tin nhắn cuối, mới nhất trước.
+    Một truy vấn (row_number() theo user lấy tin cuối), phân trang keyset theo last_time.
+    """
+    thu_tu = func.row_number().over(
+        partition_by=TinNhanDB.user_id,
+        order_by=(TinNhanDB.thoi_gian.desc(), TinNhanDB.id.desc()),
+    )
+    tin_cuoi = csdl.query(
+        TinNhanDB.user_id,
+        TinNhanDB.tin_nhan,
+        TinNhanDB.thoi_gian,
+        thu_tu.label("thu_tu"),
+    ).subquery()
+
+    truy_van = (
+        csdl.query(
+            NguoiDung.id,
+            NguoiDung.username,
+            NguoiDung.full_name,
+            tin_cuoi.c.tin_nhan.label("last_message"),
+            tin_cuoi.c.thoi_gian.label("last_time"),
+        )
+        .join(tin_cuoi, tin_cuoi.c.user_id == NguoiDung.id)
+        .filter(tin_cuoi.c.thu_tu == 1)
+    )
+    rows, cursor_tiep = paginate_keyset(
+        truy_van,
+        [tin_cuoi.c.thoi_gian, NguoiDung.id],
+        SAP_XEP_HOP_THU,
+        "hop_thu",
+        cursor,
+        gioi_han,
+    )
+    if cursor_tiep and phan_hoi is not None:
+        phan_hoi.headers[NEXT_CURSOR_HEADER] = cursor_tiep
+    return [
+        {
+            "id": row.id,
+            "username": row.username,
+            "full_name": row.full_name,
+            "last_message": row.last_message or "",
+            "last_time": row.last_time,
+        }
+        for row in rows
+    ]
 
 @bo_dinh_tuyen.get("/admin/lich_su/{user_id}", response_model=list[TinNhanSchema])
-def lay_lich_su_chat_admin(user_id: int, csdl: Session = Depends(lay_csdl)):
+def lay_lich_su_chat_admin(
+    user_id: int,
+    sau_id: Optional[int] = Query(None, description="Chỉ lấy tin có id lớn hơn"),
+    csdl: Session = Depends(lay_csdl)
+):
     """Admin: Lấy lịch sử chat với một user cụ thể"""
-    return csdl.query(TinNhanDB).filter(TinNhanDB.user_id == user_id).order_by(TinNhanDB.thoi_gian.asc()).all()
+    return _lich_su(csdl, user_id, sau_id)
+
+@bo_dinh_tuyen.websocket("/admin/ws")
+async def chat_admin_websocket(websocket: WebSocket, khoa: Optional[str] = Depends(_khoa_admin)):
+    """Admin realtime: tin mới của mọi hội thoại (cần CHAT_ADMIN_KEY)"""
+    if not _khoa_admin_hop_le(khoa):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    await pump_websocket(websocket, ADMIN_CHANNEL)
+
+@bo_dinh_tuyen.get("/admin/su_kien")
+async def chat_admin_su_kien(khoa: Optional[str] = Depends(_khoa_admin)):
+    """Admin realtime qua Server-Sent Events (cần CHAT_ADMIN_KEY)"""
+    if not CHAT_ADMIN_KEY:
+        raise HTTPException(status_code=503, detail="Kênh realtime admin chưa được cấu hình")
+    if not _khoa_admin_hop_le(khoa):
+        raise HTTPException(status_code=401, detail="Khóa admin không hợp lệ")
+    return StreamingResponse(
+        sse_events(ADMIN_CHANNEL), media_type="text/event-stream", headers=SSE_HEADERS
+    )
 
 @bo_dinh_tuyen.post("/admin/tra_loi/{user_id}", response_model=TinNhanSchema)
 def admin_tra_loi(user_id: int, du_lieu: TinNhanChatTao, csdl: Session = Depends(lay_csdl)):
@@ -71,4 +192,5 @@ def admin_tra_loi(user_id: int, du_lieu: TinNhanChatTao, csdl: Session = Depends
     csdl.add(tin_moi)
     csdl.commit()
     csdl.refresh(tin_moi)
+    _phat_tin(tin_moi)
     return tin_moi
@@ -1,16 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List
 from pydantic import BaseModel
 from datetime import datetime
 from ..co_so_du_lieu import lay_csdl, YeuThich as YeuThichDB, SanPham as SanPhamDB
-from .nguoi_dung import lay_user_hien_tai
+from ..principal_cache import Principal
+from .nguoi_dung import principal_tu_query
 
 bo_dinh_tuyen = APIRouter(
     prefix="/api/yeu_thich",
     tags=["wishlist"]
 )
 
+# Số sản phẩm tối đa mỗi lần kiểm tra hàng loạt
+SO_SAN_PHAM_KIEM_TRA_TOI_DA = 200
+
 # Pydantic models
 class YeuThichItem(BaseModel):
     id: int
@@ -20,31 +24,48 @@ class YeuThichItem(BaseModel):
     product_price: float | None = None
     created_at: datetime | None
 
+class KiemTraYeuThichPhanHoi(BaseModel):
+    is_favorite: Dict[int, bool]
+
+
+def _yeu_thich_cua(csdl: Session, user: Principal, *cot):
+    """Wishlist của user (lọc theo user_id lấy từ token, không join users)"""
+    return csdl.query(*cot).filter(YeuThichDB.user_id == user.id)
+
 # API endpoints
 @bo_dinh_tuyen.get("/", response_model=List[YeuThichItem])
-def lay_danh_sach_yeu_thich(token: str, csdl: Session = Depends(lay_csdl)):
-    """Lấy danh sách sản phẩm yêu thích của user"""
-    user = lay_user_hien_tai(token, csdl)
-    
-    items = csdl.query(YeuThichDB).filter(YeuThichDB.user_id == user.id).all()
-    result = []
-    for item in items:
-        product = csdl.query(SanPhamDB).filter(SanPhamDB.id == item.product_id).first()
-        result.append({
-            "id": item.id,
-            "product_id": item.product_id,
-            "product_name": product.name if product else None,
-            "product_image": product.image_url if product else None,
-            "product_price": product.rental_price_day if product else None,
-            "created_at": item.created_at
-        })
-    return result
+def lay_danh_sach_yeu_thich(user: Principal = Depends(principal_tu_query), csdl: Session = Depends(lay_csdl)):
+    """Lấy danh sách sản phẩm yêu thích của user (một truy vấn, chỉ lấy cột cần hiển thị)"""
+    rows = (
+        _yeu_thich_cua(
+            csdl,
+            user,
+            YeuThichDB.id,
+            YeuThichDB.product_id,
+            YeuThichDB.created_at,
+            SanPhamDB.name,
+            SanPhamDB.image_url,
+            SanPhamDB.rental_price_day,
+        )
+        .outerjoin(SanPhamDB, SanPhamDB.id == YeuThichDB.product_id)
+        .order_by(YeuThichDB.id)
+        .all()
+    )
+    return [
+        {
+            "id": row.id,
+            "product_id": row.product_id,
+            "product_name": row.name,
+            "product_image": row.image_url,
+            "product_price": row.rental_price_day,
+            "created_at": row.created_at,
+        }
+        for row in rows
+    ]
 
 @bo_dinh_tuyen.post("/them/{product_id}")
-def them_yeu_thich(product_id: int, token: str, csdl: Session = Depends(lay_csdl)):
+def them_yeu_thich(product_id: int, user: Principal = Depends(principal_tu_query), csdl: Session = Depends(lay_csdl)):
     """Thêm sản phẩm vào danh sách yêu thích"""
-    user = lay_user_hien_tai(token, csdl)
-    
     # Kiểm tra đã có trong wishlist chưa
     existing = csdl.query(YeuThichDB).filter(
         YeuThichDB.user_id == user.id,
@@ -67,10 +88,8 @@ def them_yeu_thich(product_id: int, token: str, csdl: Session = Depends(lay_csdl
     return {"message": "Đã thêm vào yêu thích", "id": yeu_thich.id}
 
 @bo_dinh_tuyen.delete("/xoa/{product_id}")
-def xoa_yeu_thich(product_id: int, token: str, csdl: Session = Depends(lay_csdl)):
+def xoa_yeu_thich(product_id: int, user: Principal = Depends(principal_tu_query), csdl: Session = Depends(lay_csdl)):
     """Xóa sản phẩm khỏi danh sách yêu thích"""
-    user = lay_user_hien_tai(token, csdl)
-    
     item = csdl.query(YeuThichDB).filter(
         YeuThichDB.user_id == user.id,
         YeuThichDB.product_id == product_id
@@ -83,14 +102,30 @@ def xoa_yeu_thich(product_id: int, token: str, csdl: Session = Depends(lay_csdl)
     csdl.commit()
     return {"message": "Đã xóa khỏi yêu thích"}
 
+@bo_dinh_tuyen.get("/kiem_tra", response_model=KiemTraYeuThichPhanHoi)
+def kiem_tra_nhieu_yeu_thich(
+    user: Principal = Depends(principal_tu_query),
+    product_ids: List[int] = Query(..., description="Nhiều id: ?product_ids=1&product_ids=2"),
+    csdl: Session = Depends(lay_csdl)
+):
+    """Kiểm tra nhiều sản phẩm có trong wishlist không (một truy vấn cho cả lưới sản phẩm)"""
+    if len(product_ids) > SO_SAN_PHAM_KIEM_TRA_TOI_DA:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Tối đa {SO_SAN_PHAM_KIEM_TRA_TOI_DA} sản phẩm mỗi lần kiểm tra"
+        )
+    yeu_thich = {
+        product_id
+        for (product_id,) in _yeu_thich_cua(csdl, user, YeuThichDB.product_id)
+        .filter(YeuThichDB.product_id.in_(set(product_ids)))
+    }
+    return {"is_favorite": {product_id: product_id in yeu_thich for product_id in product_ids}}
+
 @bo_dinh_tuyen.get("/kiem_tra/{product_id}")
-def kiem_tra_yeu_thich(product_id: int, token: str, csdl: Session = Depends(lay_csdl)):
+def kiem_tra_yeu_thich(product_id: int, user: Principal = Depends(principal_tu_query), csdl: Session = Depends(lay_csdl)):
     """Kiểm tra sản phẩm có trong wishlist không"""
-    user = lay_user_hien_tai(token, csdl)
-    
-    existing = csdl.query(YeuThichDB).filter(
-        YeuThichDB.user_id == user.id,
+    existing = _yeu_thich_cua(csdl, user, YeuThichDB.id).filter(
         YeuThichDB.product_id == product_id
     ).first()
-    
+
     return {"is_favorite": existing is not None}
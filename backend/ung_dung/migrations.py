@@ -0,0 +1,241 @@
+"""
+Migration schema có phiên bản cho IVIE Wedding Studio
+- Bảng schema_version ghi các migration đã chạy
+- Khởi động khi schema đã mới nhất: đúng một truy vấn kiểm tra version
+- Migration còn thiếu chạy trong advisory lock (PostgreSQL) nên nhiều
+  worker/instance khởi động cùng lúc không chạy trùng; mỗi migration một
+  transaction, ghi version cùng transaction; không áp statement timeout
+  (ALTER/backfill trên bảng lớn, chờ lock của worker khác)
+- Thêm migration: nối một Migration mới vào MIGRATIONS (version tăng dần),
+  không sửa migration đã phát hành
+
+Chạy tay: python -m ung_dung.migrations
+"""
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .db_engine import without_statement_timeout
+
+logger = logging.getLogger(__name__)
+
+# Khóa advisory (PostgreSQL) cho migration
+MIGRATION_LOCK_KEY = 7_240_018
+
+SCHEMA_VERSION_TABLE = "schema_version"
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+# =============================================================================
+# MIGRATIONS
+# =============================================================================
+
+
+def _create_tables(conn: Connection) -> None:
+    """Tạo các bảng chưa có (kèm index khai báo trên models)"""
+    from .co_so_du_lieu import CoSo
+
+    CoSo.metadata.create_all(bind=conn)
+
+
+# Cột được thêm sau khi bảng đã có dữ liệu production
+_LEGACY_COLUMNS = {
+    "users": [
+        ("username", "VARCHAR", "NULL"),
+        ("phone", "VARCHAR", "NULL"),
+        ("address", "VARCHAR", "NULL"),
+    ],
+    "products": [
+        ("so_luong", "INTEGER", "DEFAULT 10"),
+        ("het_hang", "BOOLEAN", "DEFAULT FALSE"),
+        ("fabric_type", "VARCHAR", "NULL"),
+        ("color", "VARCHAR", "NULL"),
+        ("recommended_size", "TEXT", "NULL"),
+        ("makeup_tone", "TEXT", "NULL"),
+        ("gallery_images", "TEXT", "NULL"),
+        ("accessories", "TEXT", "NULL"),
+    ],
+    "banners": [("order", "INTEGER", "DEFAULT 0")],
+    "home_highlights": [("order", "INTEGER", "DEFAULT 0")],
+    "gallery": [("order", "INTEGER", "DEFAULT 0")],
+    "contact_submissions": [("address", "VARCHAR", "NULL")],
+    "combos": [
+        ("noi_bat", "BOOLEAN", "DEFAULT FALSE"),
+        ("hoat_dong", "BOOLEAN", "DEFAULT TRUE"),
+    ],
+    "blog_posts": [
+        ("seo_title", "VARCHAR", "NULL"),
+        ("seo_description", "VARCHAR", "NULL"),
+        ("seo_keywords", "VARCHAR", "NULL"),
+    ],
+}
+
+
+def _add_missing_columns(conn: Connection, columns_by_table) -> None:
+    """ALTER TABLE ADD COLUMN cho các cột chưa có (bảng chưa có thì bỏ qua)"""
+    inspector = sa_inspect(conn)
+    tables = set(inspector.get_table_names())
+    quote = conn.dialect.identifier_preparer.quote
+    for table_name, columns in columns_by_table.items():
+        if table_name not in tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        for col_name, col_type, col_params in columns:
+            if col_name in existing:
+                continue
+            logger.info(f"Adding missing column {col_name} to {table_name} table...")
+            conn.execute(
+                text(
+                    f"ALTER TABLE {quote(table_name)} "
+                    f"ADD COLUMN {quote(col_name)} {col_type} {col_params}"
+                )
+            )
+
+
+def _add_legacy_columns(conn: Connection) -> None:
+    """Thêm các cột mà database cũ (trước khi có schema_version) còn thiếu"""
+    _add_missing_columns(conn, _LEGACY_COLUMNS)
+
+
+def _backfill_usernames(conn: Connection) -> None:
+    """users.username dùng để đăng nhập: điền giá trị cho tài khoản cũ bị NULL"""
+    conn.execute(
+        text("UPDATE users SET username = 'user_' || CAST(id AS VARCHAR) WHERE username IS NULL")
+    )
+
+
+def _add_token_version(conn: Connection) -> None:
+    """users.token_version: phiên bản token, tăng khi đổi mật khẩu"""
+    _add_missing_columns(conn, {"users": [("token_version", "INTEGER", "NOT NULL DEFAULT 0")]})
+
+
+def _add_search_vector(conn: Connection) -> None:
+    """
+    products.search_vector cho tìm kiếm toàn văn, backfill trên PostgreSQL.
+    GIN index khai báo trên model, create_indexes build CONCURRENTLY.
+    """
+    is_postgres = conn.dialect.name == "postgresql"
+    _add_missing_columns(
+        conn, {"products": [("search_vector", "tsvector" if is_postgres else "TEXT", "NULL")]}
+    )
+    if is_postgres:
+        from .search_engine import update_search_vectors
+
+        count = update_search_vectors(conn, "WHERE search_vector IS NULL")
+        logger.info(f"Backfilled search_vector for {count} products")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create tables", _create_tables),
+    Migration(2, "add legacy columns", _add_legacy_columns),
+    Migration(3, "backfill users.username", _backfill_usernames),
+    Migration(4, "add users.token_version", _add_token_version),
+    Migration(5, "products.search_vector", _add_search_vector),
+]
+
+# Version tạo cột products.search_vector (search_engine kiểm tra trước khi dùng)
+SEARCH_VECTOR_VERSION = 5
+
+LATEST_VERSION = max(m.version for m in MIGRATIONS)
+
+
+# =============================================================================
+# RUNNER
+# =============================================================================
+
+
+def current_version(engine: Engine) -> Optional[int]:
+    """Version hiện tại, hoặc None nếu chưa có bảng schema_version"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                text(f"SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}")
+            ).scalar() or 0
+    except Exception:
+        return None
+
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ("
+            "version INTEGER PRIMARY KEY, "
+            "description VARCHAR NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        )
+    )
+
+
+def _applied_versions(conn: Connection) -> set:
+    return set(conn.execute(text(f"SELECT version FROM {SCHEMA_VERSION_TABLE}")).scalars())
+
+
+def migrate(engine: Engine) -> List[int]:
+    """
+    Chạy các migration chưa áp dụng.
+
+    Returns:
+        Danh sách version vừa chạy (rỗng nếu schema đã mới nhất)
+    """
+    # Đường nhanh: một truy vấn, không lock
+    if current_version(engine) == LATEST_VERSION:
+        return []
+
+    is_postgres = engine.dialect.name == "postgresql"
+    applied_now: List[int] = []
+    with engine.connect() as conn, without_statement_timeout(conn):
+        if is_postgres:
+            # Lock theo session: worker khác chờ ở đây rồi thấy schema đã mới
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            conn.commit()
+        try:
+            with conn.begin():
+                _ensure_version_table(conn)
+            applied = _applied_versions(conn)
+            conn.commit()
+            for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+                if migration.version in applied:
+                    continue
+                logger.info(f"Applying migration {migration.version}: {migration.description}")
+                with conn.begin():
+                    migration.upgrade(conn)
+                    conn.execute(
+                        text(
+                            f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description, applied_at) "
+                            "VALUES (:version, :description, :applied_at)"
+                        ),
+                        {
+                            "version": migration.version,
+                            "description": migration.description,
+                            "applied_at": datetime.utcnow(),
+                        },
+                    )
+                applied_now.append(migration.version)
+        finally:
+            if is_postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
+
+    if applied_now:
+        logger.info(f"✅ Schema migrated to version {LATEST_VERSION} (applied {applied_now})")
+    return applied_now
+
+
+if __name__ == "__main__":
+    from .co_so_du_lieu import dong_co
+
+    logging.basicConfig(level=logging.INFO)
+    applied = migrate(dong_co)
+    print(f"Schema version {LATEST_VERSION}" + (f", applied {applied}" if applied else " (up to date)"))
@@ -0,0 +1,264 @@
+"""
+Near cache (L1) trong từng worker process cho IVIE Wedding Studio
+- Đặt trước Redis (L2): hit không tốn round trip mạng và giải mã payload
+- TTL ngắn + giới hạn entry/bytes (BoundedCache; dung lượng entry = độ dài payload L2)
+- Đồng bộ giữa các worker/instance qua kênh invalidation pub/sub
+- LocalBroker: broker trong process để chạy/kiểm thử không cần Redis
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .bounded_cache import POLICY_LRU, BoundedCache
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+Handler = Callable[[Dict[str, Any]], None]
+
+
+# =============================================================================
+# INVALIDATION BROKERS
+# =============================================================================
+
+
+class LocalBroker:
+    """
+    Broker trong process: phát message đồng bộ tới mọi subscriber.
+    Nhiều NearCache dùng chung một LocalBroker mô phỏng nhiều worker.
+    """
+
+    def __init__(self):
+        self._handlers: List[Handler] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, handler: Handler) -> None:
+        with self._lock:
+            self._handlers.append(handler)
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error(f"Near cache handler error: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._handlers.clear()
+
+
+class RedisPubSubBroker:
+    """
+    Broker qua Redis pub/sub.
+
+    Thread nền lắng nghe kênh; khi mất kết nối, subscriber nhận message
+    {"all": True} (có thể đã lỡ message) rồi kết nối lại.
+    """
+
+    def __init__(self, redis, channel: str, reconnect_delay: float = 1.0):
+        self._redis = redis
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._handlers: List[Handler] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, handler: Handler) -> None:
+        with self._lock:
+            self._handlers.append(handler)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._listen, name=f"pubsub:{self.channel}", daemon=True
+                )
+                self._thread.start()
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        try:
+            self._redis.publish(self.channel, json.dumps(message))
+        except Exception as e:
+            logger.error(f"Redis PUBLISH error: {e}")
+
+    def _dispatch(self, message: Dict[str, Any]) -> None:
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error(f"Pub/sub handler error ({self.channel}): {e}")
+
+    def _listen(self) -> None:
+        while not self._stopped.is_set():
+            pubsub = None
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                while not self._stopped.is_set():
+                    raw = pubsub.get_message(timeout=1.0)
+                    if raw is None or raw.get("type") != "message":
+                        continue
+                    try:
+                        self._dispatch(json.loads(raw["data"]))
+                    except ValueError:
+                        logger.warning(f"Pub/sub {self.channel}: bỏ qua message không hợp lệ")
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning(f"Pub/sub {self.channel} lost, reconnecting: {e}")
+                self._dispatch({"all": True})
+                time.sleep(self.reconnect_delay)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def close(self) -> None:
+        self._stopped.set()
+
+
+# =============================================================================
+# NEAR CACHE
+# =============================================================================
+
+
+class NearCache:
+    """
+    Cache L1 theo process, luôn đứng trước một L2 dùng chung (Redis).
+
+    - Giá trị lưu là object đã deserialize và được dùng chung giữa các
+      caller: không sửa tại chỗ giá trị lấy từ cache
+    - Ghi/xóa ở process này publish {"keys": [...]} để process khác bỏ
+      bản L1 của các key đó; {"all": True} xóa toàn bộ L1
+    - Chống nạp lại giá trị cũ: fill() chỉ lưu nếu không có invalidation
+      nào đến trong lúc đọc L2 (so generation lấy từ begin())
+    """
+
+    def __init__(
+        self,
+        broker=None,
+        ttl: float = 5.0,
+        max_entries: int = 2000,
+        max_bytes: int = 16 * 1024 * 1024,
+        policy: str = POLICY_LRU,
+    ):
+        self.id = uuid.uuid4().hex
+        self.ttl = ttl
+        self._store = BoundedCache(
+            max_entries=max_entries, max_bytes=max_bytes, policy=policy, default_ttl=ttl
+        )
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.invalidations = 0
+        self._broker = broker
+        if broker is not None:
+            broker.subscribe(self.handle)
+
+    # -------------------------------------------------------------------------
+    # Đọc / ghi
+    # -------------------------------------------------------------------------
+
+    def get(self, key: str) -> Any:
+        """Giá trị trong L1 hoặc MISSING"""
+        return self._store.get(key, MISSING)
+
+    def begin(self) -> int:
+        """Generation hiện tại, lấy trước khi đọc L2"""
+        return self._generation
+
+    def fill(
+        self,
+        key: str,
+        value: Any,
+        generation: int,
+        ttl: Optional[float] = None,
+        size: Optional[int] = None,
+    ) -> None:
+        """
+        Nạp giá trị vừa đọc từ L2 nếu chưa có invalidation nào xen vào.
+
+        size: độ dài payload L2 (nếu có) làm dung lượng entry, khỏi ước lượng
+        """
+        if value is None:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            if generation == self._generation and ttl > 0:
+                self._store.set(key, value, ttl, size=size)
+
+    def put(
+        self, key: str, value: Any, ttl: Optional[float] = None, size: Optional[int] = None
+    ) -> None:
+        """Ghi bởi chính process này: cập nhật L1 và báo process khác"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._generation += 1
+            if ttl > 0:
+                self._store.set(key, value, ttl, size=size)
+            else:
+                self._store.delete(key)
+        self._publish({"keys": [key]})
+
+    # -------------------------------------------------------------------------
+    # Invalidation
+    # -------------------------------------------------------------------------
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        """Xóa keys ở L1 của mọi process"""
+        keys = list(keys)
+        if not keys:
+            return
+        self._drop(keys)
+        self._publish({"keys": keys})
+
+    def discard(self, key: str) -> None:
+        """Chỉ bỏ bản L1 của process này (không publish)"""
+        self._drop([key])
+
+    def invalidate_all(self) -> None:
+        """Xóa toàn bộ L1 của mọi process"""
+        self._clear()
+        self._publish({"all": True})
+
+    def handle(self, message: Dict[str, Any]) -> None:
+        """Xử lý message từ broker (bỏ qua message do chính mình gửi)"""
+        if message.get("origin") == self.id:
+            return
+        self.invalidations += 1
+        if message.get("all"):
+            self._clear()
+        else:
+            self._drop(message.get("keys") or ())
+
+    def _drop(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._store.delete(key)
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._store.clear()
+
+    def _publish(self, message: Dict[str, Any]) -> None:
+        if self._broker is not None:
+            self._broker.publish({**message, "origin": self.id})
+
+    def close(self) -> None:
+        if self._broker is not None:
+            self._broker.close()
+        self._clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._store.stats(), "ttl": self.ttl, "invalidations": self.invalidations}
@@ -0,0 +1,233 @@
+"""
+Phân trang keyset (cursor) cho IVIE Wedding Studio
+- Cursor token mờ (opaque) mã hóa giá trị (sort key, id) của item cuối trang
+- Seek thẳng tới trang tiếp theo bằng điều kiện WHERE thay vì OFFSET
+- Đếm tổng tùy chọn: exact, estimated (PostgreSQL EXPLAIN) hoặc none
+- Dùng chung cho truy vấn SQLAlchemy và chỉ mục trong bộ nhớ
+"""
+
+import base64
+import json
+import logging
+from datetime import date, datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, literal, or_, text
+
+logger = logging.getLogger(__name__)
+
+# Header trả về cursor của trang tiếp theo
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Chế độ đếm tổng
+COUNT_EXACT = "exact"
+COUNT_ESTIMATED = "estimated"
+COUNT_NONE = "none"
+COUNT_MODES = (COUNT_EXACT, COUNT_ESTIMATED, COUNT_NONE)
+
+# Một sort spec là danh sách (tên trường, giảm dần?) - trường cuối luôn là id
+SortSpec = Sequence[Tuple[str, bool]]
+
+
+# =============================================================================
+# CURSOR TOKEN
+# =============================================================================
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"$d": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "$dt" in value:
+            return datetime.fromisoformat(value["$dt"])
+        if "$d" in value:
+            return date.fromisoformat(value["$d"])
+    return value
+
+
+def encode_cursor(sort_name: str, values: Sequence[Any]) -> str:
+    """Mã hóa giá trị sort key của item cuối trang thành cursor token"""
+    payload = {"s": sort_name, "k": [_encode_value(v) for v in values]}
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str], sort_name: str, spec: SortSpec) -> Optional[List[Any]]:
+    """
+    Giải mã cursor token.
+
+    Returns:
+        None nếu token rỗng (trang đầu), ngược lại danh sách giá trị sort key
+
+    Raises:
+        HTTPException 400 nếu token không hợp lệ hoặc thuộc kiểu sắp xếp khác
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw.decode("utf-8"))
+        values = [_decode_value(v) for v in payload["k"]]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+    if payload.get("s") != sort_name or len(values) != len(spec):
+        raise HTTPException(status_code=400, detail="Cursor không khớp kiểu sắp xếp")
+    return values
+
+
+def cursor_values(
+    item: Any, spec: SortSpec, defaults: Optional[Sequence[Any]] = None
+) -> List[Any]:
+    """
+    Lấy giá trị sort key từ ORM instance hoặc dict.
+
+    defaults: giá trị thay cho NULL theo từng trường, khớp với coalesce()
+    trên cột SQL tương ứng (None = giữ nguyên)
+    """
+    if isinstance(item, dict):
+        values = [item.get(field) for field, _ in spec]
+    else:
+        values = [getattr(item, field) for field, _ in spec]
+    return _fill_nulls(values, defaults)
+
+
+def _fill_nulls(values: List[Any], defaults: Optional[Sequence[Any]]) -> List[Any]:
+    if not defaults:
+        return values
+    return [d if v is None and d is not None else v for v, d in zip(values, defaults)]
+
+
+# =============================================================================
+# SQLALCHEMY
+# =============================================================================
+
+
+def keyset_condition(columns: Sequence[Any], spec: SortSpec, values: Sequence[Any]):
+    """
+    Điều kiện WHERE "sau item cuối" cho sort nhiều cột, hỗ trợ trộn asc/desc:
+        (c1 > v1) OR (c1 = v1 AND c2 > v2) OR ...
+    """
+    # literal(): so sánh cột boolean với True/False như giá trị bind thường
+    values = [literal(v) for v in values]
+    clauses = []
+    for i, (column, (_, descending)) in enumerate(zip(columns, spec)):
+        equal = [columns[j] == values[j] for j in range(i)]
+        after = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal, after) if equal else after)
+    return or_(*clauses)
+
+
+def order_clauses(columns: Sequence[Any], spec: SortSpec) -> List[Any]:
+    """ORDER BY tương ứng với sort spec"""
+    return [c.desc() if descending else c.asc() for c, (_, descending) in zip(columns, spec)]
+
+
+def paginate_keyset(
+    truy_van,
+    columns: Sequence[Any],
+    spec: SortSpec,
+    sort_name: str,
+    cursor: Optional[str],
+    limit: int,
+    defaults: Optional[Sequence[Any]] = None,
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    Áp dụng keyset pagination cho một SQLAlchemy Query.
+
+    Args:
+        truy_van: Query đã có filters (chưa order_by)
+        columns: Biểu thức cột theo thứ tự spec
+        spec: Sort spec (tên trường trên item, giảm dần?)
+        sort_name: Tên kiểu sắp xếp, ghi vào cursor để kiểm tra
+        cursor: Cursor token của trang trước ("" hoặc None = trang đầu)
+        limit: Số item mỗi trang
+        defaults: Giá trị thay NULL cho từng cột đã bọc coalesce()
+
+    Returns:
+        (items, cursor của trang tiếp theo hoặc None nếu hết)
+    """
+    values = decode_cursor(cursor, sort_name, spec)
+    if values is not None:
+        values = _fill_nulls(values, defaults)
+        truy_van = truy_van.filter(keyset_condition(columns, spec, values))
+
+    rows = truy_van.order_by(*order_clauses(columns, spec)).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = encode_cursor(sort_name, cursor_values(rows[-1], spec, defaults))
+    return rows, next_cursor
+
+
+def count_rows(truy_van, mode: Optional[str]) -> Optional[int]:
+    """
+    Đếm tổng số dòng theo chế độ.
+
+    estimated dùng ước lượng của planner PostgreSQL (EXPLAIN) nên không quét
+    bảng; với SQLite hoặc khi EXPLAIN lỗi thì quay về đếm chính xác. EXPLAIN
+    chạy trong savepoint: lỗi chỉ rollback savepoint, transaction của request
+    vẫn dùng được cho câu đếm dự phòng.
+    """
+    if mode == COUNT_NONE:
+        return None
+
+    truy_van = truy_van.order_by(None)
+    if mode == COUNT_ESTIMATED:
+        bind = truy_van.session.get_bind()
+        if bind.dialect.name == "postgresql":
+            try:
+                sql = truy_van.statement.compile(
+                    dialect=bind.dialect, compile_kwargs={"literal_binds": True}
+                )
+                with truy_van.session.begin_nested():
+                    plan = truy_van.session.execute(
+                        text(f"EXPLAIN (FORMAT JSON) {sql}")
+                    ).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return int(plan[0]["Plan"]["Plan Rows"])
+            except Exception as e:
+                logger.debug(f"Estimated count failed, using exact count: {e}")
+
+    return truy_van.count()
+
+
+def validate_count_mode(mode: Optional[str], default: str) -> str:
+    """Chuẩn hóa tham số chế độ đếm"""
+    if mode is None:
+        return default
+    if mode not in COUNT_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"dem_tong không hợp lệ. Chỉ chấp nhận: {', '.join(COUNT_MODES)}",
+        )
+    return mode
+
+
+# =============================================================================
+# IN-MEMORY
+# =============================================================================
+
+
+def sort_key(values: Sequence[Any], spec: SortSpec) -> Tuple:
+    """
+    Khóa so sánh tăng dần tương đương với sort spec, dùng cho bisect trên
+    dữ liệu trong bộ nhớ. Chỉ hỗ trợ trường số/bool (đảo dấu khi giảm dần).
+    """
+    key = []
+    for value, (_, descending) in zip(values, spec):
+        if isinstance(value, bool):
+            value = int(value)
+        elif value is None:
+            value = 0
+        key.append(-value if descending else value)
+    return tuple(key)
@@ -0,0 +1,175 @@
+"""
+Dịch vụ băm mật khẩu cho IVIE Wedding Studio
+- bcrypt (~250ms mỗi lần với cost 12) chạy trong process pool riêng, số
+  worker mặc định bằng số core được cấp (tối đa 2): không chiếm thread của
+  threadpool FastAPI và không giữ GIL của worker web
+- Process con chết (OOM kill...) thì bỏ pool hỏng, tạo pool mới và chạy lại
+- API async: await password_hasher.hash(...) / verify(...)
+- Giới hạn số việc đang chờ: vượt quá thì từ chối ngay (HashingOverloaded,
+  route trả 503 + Retry-After) thay vì để request xếp hàng tới timeout
+- verify() trả thêm mã băm mới khi BCRYPT_ROUNDS đã đổi (băm lại khi đăng nhập)
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from . import bao_mat
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+# Mặc định tối đa 2 process: mỗi process spawn tốn vài chục MB, deploy free
+# tier chỉ có 512MB cho một worker web (start.sh)
+PASSWORD_HASH_DEFAULT_MAX_WORKERS = 2
+
+
+def _default_workers() -> int:
+    # Số core process được phép chạy (cgroup/taskset), không phải số core máy
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS, Windows
+        cores = os.cpu_count() or 1
+    return max(1, min(cores, PASSWORD_HASH_DEFAULT_MAX_WORKERS))
+
+
+# Số process băm mật khẩu (0 = chạy trong threadpool của event loop)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(_default_workers())))
+# Số việc tối đa đang chạy + chờ; vượt quá trả 503
+PASSWORD_HASH_MAX_PENDING = int(
+    os.getenv("PASSWORD_HASH_MAX_PENDING", str(max(1, PASSWORD_HASH_WORKERS) * 8))
+)
+# Gợi ý client thử lại sau (giây) khi quá tải
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+
+class HashingOverloaded(Exception):
+    """Hàng đợi băm mật khẩu đã đầy"""
+
+
+def _warm_worker() -> None:
+    # Dựng CryptContext khi process khởi động, không phải ở lần băm đầu tiên
+    bao_mat.ngu_canh_mat_khau()
+
+
+# =============================================================================
+# SERVICE
+# =============================================================================
+
+
+class PasswordHasher:
+    """
+    Băm / kiểm tra mật khẩu ngoài event loop.
+
+    Process pool tạo khi dùng lần đầu (spawn: process con không kế thừa
+    thread và connection của worker web). Pool hỏng vì process con chết
+    được thay bằng pool mới, việc đang chạy thử lại một lần.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+
+    def _executor(self) -> Optional[Executor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_warm_worker,
+                    )
+                    logger.info(f"Password hasher pool started ({self.workers} processes)")
+        return self._pool
+
+    def _discard(self, pool: Executor) -> None:
+        # Chỉ bỏ đúng pool đã hỏng: request khác có thể đã tạo pool mới
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self.restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.warning("Password hasher pool broken (worker process died), restarting")
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingOverloaded(f"{self.pending} password hashing jobs pending")
+            self.pending += 1
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            pool = self._executor()
+            try:
+                return await loop.run_in_executor(pool, func, *args)
+            except BrokenProcessPool:
+                self._discard(pool)
+                return await loop.run_in_executor(self._executor(), func, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                self.busy_seconds += time.perf_counter() - started
+
+    async def hash(self, password: str) -> str:
+        return await self._run(bao_mat.bam_mat_khau, password)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        (khớp, mã băm mới nếu cost đã đổi).
+
+        Tài khoản không dùng mật khẩu trả (False, None) ngay, không qua pool.
+        """
+        if not hashed or hashed == bao_mat.MAT_KHAU_KHONG_DUNG:
+            return False, None
+        ok, new_hash = await self._run(bao_mat.xac_minh_va_cap_nhat, password, hashed)
+        if new_hash is not None:
+            self.rehashed += 1
+        return ok, new_hash
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "started": self._pool is not None,
+            "restarts": self.restarts,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_ms": round(self.busy_seconds / self.completed * 1000, 1) if self.completed else 0.0,
+        }
+
+
+password_hasher = PasswordHasher()
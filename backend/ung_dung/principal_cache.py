@@ -0,0 +1,141 @@
+"""
+Cache người dùng đã xác thực (principal) cho IVIE Wedding Studio
+- Token mang uid, role, ver (token_version): route cần đăng nhập kiểm tra
+  chữ ký bằng khóa dựng sẵn rồi lấy user từ cache theo (uid, ver), không
+  truy vấn database khi cache hit
+- Cache miss: một truy vấn theo khóa chính, kiểm tra ver khớp token_version
+- Đổi mật khẩu tăng token_version (token cũ hết hiệu lực); sửa profile bỏ
+  entry của user trên mọi worker (kênh invalidation của near cache)
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from .near_cache import MISSING, NearCache
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_CHANNEL = os.getenv("AUTH_CACHE_CHANNEL", "auth:invalidate")
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Ảnh chụp user đã xác thực (dùng chung giữa các request, không sửa)"""
+
+    id: int
+    username: str
+    role: str
+    token_version: int
+    email: Optional[str] = None
+    full_name: Optional[str] = None
+    phone: Optional[str] = None
+    address: Optional[str] = None
+    is_active: bool = True
+
+    @classmethod
+    def from_user(cls, user, role: str) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            role=role,
+            token_version=user.token_version or 0,
+            email=user.email,
+            full_name=user.full_name,
+            phone=user.phone,
+            address=user.address,
+            is_active=bool(user.is_active),
+        )
+
+
+def _key(user_id: int, token_version: int) -> str:
+    return f"{user_id}:{token_version}"
+
+
+# =============================================================================
+# CACHE
+# =============================================================================
+
+
+class PrincipalCache:
+    """
+    TTL cache Principal theo (user id, token version).
+
+    Broker invalidation tạo khi dùng lần đầu: Redis pub/sub nếu có REDIS_URL,
+    ngược lại chỉ trong process.
+    """
+
+    def __init__(
+        self,
+        ttl: float = AUTH_CACHE_TTL,
+        max_entries: int = AUTH_CACHE_MAX_ENTRIES,
+        channel: str = AUTH_CACHE_CHANNEL,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.channel = channel
+        self._near: Optional[NearCache] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache(self) -> NearCache:
+        if self._near is None:
+            with self._lock:
+                if self._near is None:
+                    from .cache_advanced import redis_client
+
+                    self._near = NearCache(
+                        broker=redis_client.broker(self.channel),
+                        ttl=self.ttl,
+                        max_entries=self.max_entries,
+                        max_bytes=self.max_entries * 1024,
+                    )
+        return self._near
+
+    def resolve(
+        self, user_id: int, token_version: int, load: Callable[[], Optional[Principal]]
+    ) -> Optional[Principal]:
+        """
+        Principal của (user_id, token_version).
+
+        load: đọc user từ database khi cache miss; trả None nếu user không
+            còn hoặc token_version đã đổi (không cache kết quả None)
+        """
+        near = self._cache()
+        key = _key(user_id, token_version)
+        principal = near.get(key)
+        if principal is not MISSING:
+            self.hits += 1
+            return principal
+        self.misses += 1
+        generation = near.begin()
+        principal = load()
+        if principal is not None and principal.token_version == token_version:
+            near.fill(key, principal, generation)
+            return principal
+        return None
+
+    def invalidate(self, user_id: int, *token_versions: int) -> None:
+        """Bỏ entry của user (các version đã biết) trên mọi worker"""
+        self._cache().invalidate(_key(user_id, version) for version in token_versions)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "cache": self._near.stats() if self._near is not None else None,
+        }
+
+
+principal_cache = PrincipalCache()
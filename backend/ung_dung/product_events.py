@@ -0,0 +1,60 @@
+"""
+Thông báo thay đổi sản phẩm cho các chỉ mục trong bộ nhớ
+- Các route tạo/sửa/xóa sản phẩm gọi notify_* sau khi commit
+- Chỉ mục (catalog, tìm kiếm, autocomplete...) đăng ký để cập nhật tăng dần
+- cache_advanced đăng ký để xóa response cache của sản phẩm (theo tag)
+- Lỗi của một listener không làm hỏng request ghi dữ liệu
+"""
+
+import logging
+import threading
+from typing import Any, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+_listeners: List[Any] = []
+_lock = threading.Lock()
+
+
+def register(listener: Any) -> Any:
+    """
+    Đăng ký listener nhận thay đổi sản phẩm.
+
+    Listener cần có các method:
+        upsert_products(products): danh sách ORM SanPham vừa tạo/cập nhật
+        remove_products(ids): danh sách id sản phẩm vừa xóa
+        invalidate(): đánh dấu cần build lại toàn bộ (bulk operations)
+    """
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+    return listener
+
+
+def _dispatch(method: str, *args) -> None:
+    with _lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            getattr(listener, method)(*args)
+        except Exception as e:
+            logger.error(f"Product listener {type(listener).__name__}.{method} failed: {e}")
+
+
+def notify_saved(products: Iterable[Any]) -> None:
+    """Gọi sau khi commit tạo/cập nhật sản phẩm (ORM instances đã refresh)"""
+    products = [p for p in products if p is not None]
+    if products:
+        _dispatch("upsert_products", products)
+
+
+def notify_deleted(ids: Iterable[int]) -> None:
+    """Gọi sau khi commit xóa sản phẩm"""
+    ids = [i for i in ids if i is not None]
+    if ids:
+        _dispatch("remove_products", ids)
+
+
+def notify_invalidate() -> None:
+    """Gọi sau các thao tác bulk không có ORM instances (bulk insert/update)"""
+    _dispatch("invalidate")
@@ -0,0 +1,306 @@
+"""
+Rate limiting phân tán cho IVIE Wedding Studio
+- GCRA (Generic Cell Rate Algorithm) trong một Lua script nguyên tử trên Redis
+- Lease token cục bộ: mỗi lần gọi Redis xin một lô token, các request sau
+  dùng dần trong process; request bị chặn được từ chối tại chỗ tới khi hết
+  Retry-After, nên phần lớn quyết định không cần round trip mạng
+- Không có Redis: GCRA trong process với cùng công thức
+- ASGI middleware áp limiter theo nhóm route, trả header RateLimit-*
+"""
+
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .bounded_cache import POLICY_LRU, BoundedCache
+from .cache_advanced import redis_client
+from .route_rules import RouteMatcher
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Giới hạn dạng "số request/giây cửa sổ"
+RATE_LIMIT_API = os.getenv("RATE_LIMIT_API", "100/60")
+RATE_LIMIT_ADMIN = os.getenv("RATE_LIMIT_ADMIN", "200/60")
+# Lô token xin mỗi lần gọi Redis (tỉ lệ của limit) và thời gian giữ lô (giây).
+# Token chưa dùng khi hết hạn bị bỏ: sai số chỉ theo hướng chặt hơn
+RATE_LIMIT_LEASE_FRACTION = float(os.getenv("RATE_LIMIT_LEASE_FRACTION", "0.05"))
+RATE_LIMIT_LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", "1"))
+# Lấy IP client từ X-Forwarded-For (chỉ bật khi đứng sau proxy tin cậy)
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+
+# Số client (key) tối đa giữ trạng thái cục bộ mỗi limiter
+_LOCAL_MAX_KEYS = 10000
+
+# GCRA: lưu TAT (theoretical arrival time, ms) của mỗi key.
+# ARGV: khoảng phát 1 token (ms), dung sai = cả cửa sổ (ms), số token xin.
+# Cấp tối đa số token còn lại (lease), trả {cấp, còn lại, retry sau ms, đầy lại sau ms}
+_GCRA_SCRIPT = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call("time")
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local tat = tonumber(redis.call("get", KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+local available = math.floor((now + tolerance - tat) / interval)
+local granted = math.min(requested, available)
+if granted < 1 then
+    return {0, 0, tat - tolerance + interval - now, tat - now}
+end
+tat = tat + granted * interval
+redis.call("set", KEYS[1], tat, "px", math.max(1, tat - now))
+return {granted, available - granted, 0, tat - now}
+"""
+
+
+def parse_limit(spec: str) -> Tuple[int, int]:
+    """ "100/60" -> (100, 60)"""
+    limit, _, window = spec.partition("/")
+    return int(limit), int(window or 60)
+
+
+class _LocalState:
+    __slots__ = ("tokens", "lease_expires", "blocked_until", "remaining", "reset_at")
+
+    def __init__(self):
+        self.tokens = 0
+        self.lease_expires = 0.0
+        self.blocked_until = 0.0
+        self.remaining = 0
+        self.reset_at = 0.0
+
+
+# =============================================================================
+# RATE LIMITER
+# =============================================================================
+
+
+class RateLimiter:
+    """
+    Rate limiting GCRA: tối đa `limit` request mỗi `window` giây, cho phép
+    burst tới `limit`, token hồi đều mỗi window/limit giây (không reset cứng
+    theo cửa sổ cố định).
+    """
+
+    def __init__(
+        self,
+        key_prefix: str = "ratelimit",
+        limit: int = 100,
+        window: int = 60,
+        lease_fraction: float = RATE_LIMIT_LEASE_FRACTION,
+        lease_ttl: float = RATE_LIMIT_LEASE_TTL,
+    ):
+        """
+        Args:
+            key_prefix: Prefix cho rate limit keys
+            limit: Số request tối đa trong window
+            window: Thời gian window (seconds)
+            lease_fraction: Tỉ lệ limit xin trước mỗi lần gọi Redis (0 = từng token)
+            lease_ttl: Thời gian giữ token đã xin (seconds)
+        """
+        self.key_prefix = key_prefix
+        self.limit = limit
+        self.window = window
+        self.interval_ms = window * 1000 / limit
+        self.tolerance_ms = window * 1000
+        self.lease_size = max(1, int(limit * lease_fraction))
+        self.lease_ttl = lease_ttl
+        self._local = BoundedCache(max_entries=_LOCAL_MAX_KEYS, policy=POLICY_LRU)
+        self._fallback = BoundedCache(max_entries=_LOCAL_MAX_KEYS, policy=POLICY_LRU)
+        self._lock = threading.Lock()
+
+    def _get_key(self, identifier: str) -> str:
+        """Generate rate limit key"""
+        return f"ratelimit:{self.key_prefix}:{identifier}"
+
+    def _gcra_local(self, key: str, requested: int) -> List[float]:
+        """GCRA trong process (không có Redis), cùng kết quả với Lua script"""
+        now = time.time() * 1000
+        with self._lock:
+            tat = max(self._fallback.get(key, now), now)
+            available = math.floor((now + self.tolerance_ms - tat) / self.interval_ms)
+            granted = min(requested, available)
+            if granted < 1:
+                return [0, 0, tat - self.tolerance_ms + self.interval_ms - now, tat - now]
+            tat += granted * self.interval_ms
+            self._fallback.set(key, tat, (tat - now) / 1000)
+            return [granted, available - granted, 0, tat - now]
+
+    def _acquire(self, key: str, requested: int) -> List[float]:
+        result = None
+        if redis_client.is_connected:
+            result = redis_client.run_script(
+                _GCRA_SCRIPT, [key], [self.interval_ms, self.tolerance_ms, requested]
+            )
+        if result is None:
+            result = self._gcra_local(key, requested)
+        return [float(x) for x in result]
+
+    def _result(self, allowed: bool, state: _LocalState, now: float) -> Dict[str, Any]:
+        remaining = state.remaining + state.tokens
+        retry_after = max(0.0, state.blocked_until - now) if not allowed else 0.0
+        return {
+            "allowed": allowed,
+            "remaining": int(remaining),
+            "limit": self.limit,
+            "window": self.window,
+            "reset_after": max(0.0, state.reset_at - now),
+            "retry_after": retry_after,
+            "reset_at": int(time.time() + max(0.0, state.reset_at - now)),
+            "current": int(self.limit - remaining),
+        }
+
+    def check(self, identifier: str, cost: int = 1) -> Dict[str, Any]:
+        """
+        Kiểm tra và tiêu thụ rate limit.
+
+        Args:
+            identifier: IP address hoặc user ID
+            cost: Số token request này tiêu thụ
+
+        Returns:
+            Dict với allowed, remaining, limit, reset_after, retry_after (giây)
+        """
+        key = self._get_key(identifier)
+        now = time.monotonic()
+
+        with self._lock:
+            state = self._local.get(key)
+            if state is None:
+                state = _LocalState()
+                self._local.set(key, state, self.window)
+            # Đang bị chặn: từ chối tại chỗ
+            if state.blocked_until > now:
+                return self._result(False, state, now)
+            # Còn token trong lease
+            if state.tokens >= cost and state.lease_expires > now:
+                state.tokens -= cost
+                return self._result(True, state, now)
+
+        granted, remaining, retry_ms, reset_ms = self._acquire(
+            key, max(cost, self.lease_size)
+        )
+        now = time.monotonic()
+        with self._lock:
+            state.remaining = remaining
+            state.reset_at = now + reset_ms / 1000
+            if granted >= cost:
+                state.tokens = int(granted) - cost
+                state.lease_expires = now + self.lease_ttl
+                return self._result(True, state, now)
+            state.tokens = 0
+            state.blocked_until = now + max(retry_ms, self.interval_ms) / 1000
+            return self._result(False, state, now)
+
+    def is_allowed(self, identifier: str) -> bool:
+        """Simple check nếu allowed"""
+        return self.check(identifier)["allowed"]
+
+    def policy(self) -> str:
+        """Giá trị header RateLimit-Policy"""
+        return f"{self.limit};w={self.window}"
+
+
+# Default rate limiter instances
+api_rate_limiter = RateLimiter("api", *parse_limit(RATE_LIMIT_API))
+admin_rate_limiter = RateLimiter("admin", *parse_limit(RATE_LIMIT_ADMIN))
+
+# Nhóm route -> limiter (rule prefix; khớp sâu nhất thắng)
+DEFAULT_RATE_LIMIT_GROUPS: List[Tuple[str, RateLimiter]] = [
+    ("/api", api_rate_limiter),
+    ("/pg", api_rate_limiter),
+    ("/v2/api", api_rate_limiter),
+    ("/api/{resource}/admin", admin_rate_limiter),
+    ("/v2/api/{resource}/admin", admin_rate_limiter),
+    ("/api/cache", admin_rate_limiter),
+]
+
+
+# =============================================================================
+# MIDDLEWARE
+# =============================================================================
+
+
+def client_identifier(scope: Scope, trust_proxy: bool = RATE_LIMIT_TRUST_PROXY) -> str:
+    """IP client (X-Forwarded-For đầu tiên nếu tin proxy)"""
+    if trust_proxy:
+        forwarded = Headers(scope=scope).get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",", 1)[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def rate_limit_headers(limiter: RateLimiter, result: Dict[str, Any]) -> List[Tuple[bytes, bytes]]:
+    headers = [
+        (b"ratelimit-limit", str(limiter.limit).encode()),
+        (b"ratelimit-remaining", str(result["remaining"]).encode()),
+        (b"ratelimit-reset", str(math.ceil(result["reset_after"])).encode()),
+        (b"ratelimit-policy", limiter.policy().encode()),
+    ]
+    if not result["allowed"]:
+        headers.append((b"retry-after", str(max(1, math.ceil(result["retry_after"]))).encode()))
+    return headers
+
+
+class RateLimitMiddleware:
+    """
+    Áp rate limiter theo nhóm route (ASGI thuần).
+    Request vượt giới hạn nhận 429 kèm Retry-After; mọi response thuộc
+    nhóm có header RateLimit-Limit/Remaining/Reset/Policy.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        groups: Optional[List[Tuple[str, RateLimiter]]] = None,
+        trust_proxy: bool = RATE_LIMIT_TRUST_PROXY,
+    ):
+        self.app = app
+        self.trust_proxy = trust_proxy
+        self._matcher = RouteMatcher(
+            (path, limiter, True) for path, limiter in groups or DEFAULT_RATE_LIMIT_GROUPS
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        found = self._matcher.match(scope["path"])
+        if found is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = found[0]
+        result = limiter.check(client_identifier(scope, self.trust_proxy))
+        headers = rate_limit_headers(limiter, result)
+
+        if not result["allowed"]:
+            response = JSONResponse(
+                {"detail": "Quá nhiều yêu cầu, vui lòng thử lại sau"}, status_code=429
+            )
+            response.raw_headers.extend(headers)
+            await response(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).extend(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,96 @@
+"""
+Bộ so khớp rule theo route cho IVIE Wedding Studio
+- Biên dịch bảng rule thành cây theo segment của path (radix theo segment)
+- Tham số template: "{id}" (segment bất kỳ), "{id:int}" (chỉ chữ số)
+- Rule exact (template) và rule prefix (khớp path và mọi path con)
+- Tra cứu một lần duyệt cây theo path, không quét tuyến tính bảng rule
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+_CONVERTERS: Dict[str, Callable[[str], bool]] = {
+    "str": lambda segment: True,
+    "int": str.isdigit,
+}
+
+
+def _split(path: str) -> List[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+class _Node:
+    __slots__ = ("static", "params", "exact", "prefix")
+
+    def __init__(self):
+        self.static: Dict[str, "_Node"] = {}
+        self.params: List[Tuple[str, str, "_Node"]] = []  # (tên, converter, node)
+        self.exact: Any = None
+        self.prefix: Any = None
+
+
+class RouteMatcher:
+    """
+    Cây rule theo segment.
+
+    Ưu tiên khi khớp: segment tĩnh > tham số (theo thứ tự thêm); rule exact
+    tại node cuối > rule prefix sâu nhất trên đường đi.
+    """
+
+    def __init__(self, rules: Optional[Iterable[Tuple[str, Any, bool]]] = None):
+        self._root = _Node()
+        for template, value, prefix in rules or ():
+            self.add(template, value, prefix)
+
+    def add(self, template: str, value: Any, prefix: bool = False) -> None:
+        """Thêm rule; prefix=True: khớp cả các path con của template"""
+        node = self._root
+        for segment in _split(template):
+            if segment.startswith("{") and segment.endswith("}"):
+                name, _, converter = segment[1:-1].partition(":")
+                converter = converter or "str"
+                if converter not in _CONVERTERS:
+                    raise ValueError(f"Unknown path converter: {converter}")
+                child = next(
+                    (n for p, c, n in node.params if p == name and c == converter), None
+                )
+                if child is None:
+                    child = _Node()
+                    node.params.append((name, converter, child))
+            else:
+                child = node.static.get(segment)
+                if child is None:
+                    child = node.static[segment] = _Node()
+            node = child
+        if prefix:
+            node.prefix = value
+        else:
+            node.exact = value
+
+    def match(self, path: str) -> Optional[Tuple[Any, Dict[str, str]]]:
+        """(value, params) của rule khớp nhất, hoặc None"""
+        return self._walk(self._root, _split(path), 0, {})
+
+    def _walk(
+        self, node: _Node, segments: List[str], index: int, params: Dict[str, str]
+    ) -> Optional[Tuple[Any, Dict[str, str]]]:
+        if index == len(segments):
+            if node.exact is not None:
+                return node.exact, params
+            if node.prefix is not None:
+                return node.prefix, params
+            return None
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._walk(child, segments, index + 1, params)
+            if found is not None:
+                return found
+        for name, converter, child in node.params:
+            if _CONVERTERS[converter](segment):
+                found = self._walk(child, segments, index + 1, {**params, name: segment})
+                if found is not None:
+                    return found
+        if node.prefix is not None:
+            return node.prefix, params
+        return None
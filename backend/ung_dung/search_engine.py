@@ -0,0 +1,447 @@
+"""
+Tìm kiếm sản phẩm toàn văn, không phân biệt dấu, cho IVIE Wedding Studio
+- Bỏ dấu + tách từ theo cùng quy tắc với tao_slug (tien_ich_chuoi)
+- PostgreSQL: cột tsvector search_vector + GIN index, xếp hạng ts_rank_cd;
+  cột và backfill do migration 5 tạo, index do create_indexes build
+  CONCURRENTLY; trước khi migration xong tìm bằng chỉ mục trong bộ nhớ
+- SQLite/khác: chỉ mục đảo ngược trong bộ nhớ, xếp hạng BM25
+- Từ cuối của truy vấn khớp theo tiền tố ("vay cu" -> "vay cuoi")
+- Cập nhật tăng dần qua product_events khi sản phẩm thay đổi
+"""
+
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from . import product_events
+from .tien_ich_chuoi import bo_dau, tach_tu
+
+logger = logging.getLogger(__name__)
+
+# Trọng số theo trường: tên/mã quan trọng hơn mô tả
+FIELD_WEIGHTS = {"name": 3.0, "code": 3.0, "description": 1.0}
+
+# Nhãn trọng số tsvector tương ứng (A > B > C > D)
+PG_WEIGHT_LABELS = {"name": "A", "code": "A", "description": "C"}
+
+# Tham số BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Build lại chỉ mục trong bộ nhớ sau khoảng thời gian này (giây). 0 = không
+MAX_AGE = int(os.getenv("SEARCH_INDEX_MAX_AGE", "600"))
+
+# Giới hạn số từ mở rộng cho tiền tố của từ cuối
+MAX_PREFIX_EXPANSIONS = 50
+
+
+def _field_text(product: Any, field: str) -> str:
+    if isinstance(product, dict):
+        return product.get(field) or ""
+    return getattr(product, field, None) or ""
+
+
+# =============================================================================
+# IN-MEMORY BM25
+# =============================================================================
+
+
+class InMemorySearchIndex:
+    """
+    Chỉ mục đảo ngược process-local với xếp hạng BM25.
+
+    Mỗi tài liệu là một sản phẩm; tần suất từ được nhân trọng số theo trường
+    (FIELD_WEIGHTS) nên từ khớp trong tên xếp trên từ khớp trong mô tả.
+    Ghi đến trong lúc build đọc database được phát lại lên snapshot mới
+    (như ProductCatalogIndex).
+    """
+
+    def __init__(self, max_age: int = MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._build_lock = threading.RLock()
+        self._loaded = False
+        self._built_at = 0.0
+        # Tăng ở mỗi upsert/remove/invalidate; nhật ký ghi khi đang build
+        self._generation = 0
+        self._journal: Optional[List[Tuple[str, Any]]] = None
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._doc_len: Dict[int, float] = {}
+        self._total_len = 0.0
+        self._terms: List[str] = []  # từ đã sắp xếp, dùng cho tra tiền tố
+        self._terms_dirty = False
+
+    # -------------------------------------------------------------------------
+    # Build / cập nhật
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _analyze(product: Any) -> Dict[str, float]:
+        terms: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tach_tu(_field_text(product, field)):
+                terms[token] = terms.get(token, 0.0) + weight
+        return terms
+
+    def _is_stale(self) -> bool:
+        if not self._loaded:
+            return True
+        return self.max_age > 0 and time.time() - self._built_at > self.max_age
+
+    def build(self, csdl) -> int:
+        """
+        Build lại toàn bộ chỉ mục từ database.
+
+        Generation đổi trong lúc đọc thì phát lại nhật ký ghi; có invalidate
+        thì để chưa load (build lại lần sau).
+        """
+        from .co_so_du_lieu import SanPham as SanPhamDB
+
+        with self._build_lock:
+            with self._lock:
+                generation = self._generation
+                self._journal = []
+            try:
+                rows = csdl.query(
+                    SanPhamDB.id, SanPhamDB.name, SanPhamDB.code, SanPhamDB.description
+                ).all()
+            except Exception:
+                with self._lock:
+                    self._journal = None
+                raise
+            docs = [(row.id, self._analyze(row._asdict())) for row in rows]
+
+            with self._lock:
+                journal, self._journal = self._journal, None
+                self._postings = {}
+                self._doc_terms = {}
+                self._doc_len = {}
+                self._total_len = 0.0
+                for product_id, terms in docs:
+                    self._add(product_id, terms)
+                self._terms = sorted(self._postings)
+                self._terms_dirty = False
+                fresh = self._replay(journal) if self._generation != generation else True
+                self._loaded = fresh
+                self._built_at = time.time()
+
+        logger.info(f"Search index built: {len(docs)} products, {len(self._terms)} terms")
+        return len(docs)
+
+    def ensure_loaded(self, csdl) -> None:
+        """Build chỉ mục nếu chưa có hoặc đã quá MAX_AGE"""
+        if self._is_stale():
+            with self._build_lock:
+                if self._is_stale():
+                    self.build(csdl)
+
+    def _add(self, product_id: int, terms: Dict[str, float]) -> None:
+        self._doc_terms[product_id] = terms
+        length = sum(terms.values())
+        self._doc_len[product_id] = length
+        self._total_len += length
+        for term, tf in terms.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                self._terms_dirty = True
+            posting[product_id] = tf
+
+    def _remove(self, product_id: int) -> None:
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        self._total_len -= self._doc_len.pop(product_id, 0.0)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(product_id, None)
+                if not posting:
+                    del self._postings[term]
+                    self._terms_dirty = True
+
+    def _log_write(self, op: str, arg: Any) -> None:
+        # Gọi khi đang giữ _lock
+        self._generation += 1
+        if self._journal is not None:
+            self._journal.append((op, arg))
+
+    def _replay(self, journal: List[Tuple[str, Any]]) -> bool:
+        """Phát lại ghi trong lúc build; False nếu có invalidate"""
+        fresh = True
+        for op, arg in journal:
+            if op == "upsert":
+                for product_id, terms in arg:
+                    self._remove(product_id)
+                    self._add(product_id, terms)
+            elif op == "remove":
+                for product_id in arg:
+                    self._remove(product_id)
+            else:
+                fresh = False
+        return fresh
+
+    def upsert_products(self, products: Iterable[Any]) -> None:
+        docs = [(p.id, self._analyze(p)) for p in products]
+        with self._lock:
+            self._log_write("upsert", docs)
+            if not self._loaded:
+                return
+            for product_id, terms in docs:
+                self._remove(product_id)
+                self._add(product_id, terms)
+
+    def remove_products(self, ids: Iterable[int]) -> None:
+        ids = list(ids)
+        with self._lock:
+            self._log_write("remove", ids)
+            for product_id in ids:
+                self._remove(product_id)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._log_write("invalidate", None)
+            self._loaded = False
+
+    # -------------------------------------------------------------------------
+    # Truy vấn
+    # -------------------------------------------------------------------------
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        start = bisect.bisect_left(self._terms, prefix)
+        matches = []
+        for term in self._terms[start : start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, tokens: List[str], prefix: bool = True) -> List[Tuple[int, float]]:
+        """
+        Tìm sản phẩm chứa tất cả các từ (AND), xếp hạng BM25 giảm dần.
+
+        Args:
+            tokens: Các từ đã bỏ dấu (tach_tu)
+            prefix: Từ cuối khớp theo tiền tố
+        """
+        if not tokens:
+            return []
+
+        with self._lock:
+            if not self._loaded:
+                raise RuntimeError("Search index chưa được build")
+
+            n_docs = len(self._doc_len)
+            if n_docs == 0:
+                return []
+            avg_len = self._total_len / n_docs
+
+            scores: Optional[Dict[int, float]] = None
+            for i, token in enumerate(tokens):
+                terms = [token]
+                if prefix and i == len(tokens) - 1:
+                    terms = self._expand_prefix(token)
+
+                token_scores: Dict[int, float] = {}
+                for term in terms:
+                    posting = self._postings.get(term)
+                    if not posting:
+                        continue
+                    df = len(posting)
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    for product_id, tf in posting.items():
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[product_id] / avg_len)
+                        score = idf * tf * (BM25_K1 + 1) / (tf + norm)
+                        if score > token_scores.get(product_id, 0.0):
+                            token_scores[product_id] = score
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {
+                        pid: s + token_scores[pid] for pid, s in scores.items() if pid in token_scores
+                    }
+                if not scores:
+                    return []
+
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "loaded": self._loaded,
+                "products": len(self._doc_len),
+                "terms": len(self._postings),
+                "built_at": self._built_at,
+            }
+
+
+# =============================================================================
+# POSTGRESQL TSVECTOR
+# =============================================================================
+
+_VECTOR_SQL = " || ".join(
+    f"setweight(to_tsvector('simple', :{field}), '{label}')"
+    for field, label in PG_WEIGHT_LABELS.items()
+)
+
+
+def _vector_params(product: Any) -> Dict[str, Any]:
+    params = {field: bo_dau(_field_text(product, field)) for field in PG_WEIGHT_LABELS}
+    params["id"] = product["id"] if isinstance(product, dict) else product.id
+    return params
+
+
+def update_search_vectors(conn, where: str = "") -> int:
+    """Tính search_vector cho các dòng products khớp where (dùng cả trong migration)"""
+    rows = conn.execute(
+        text(f"SELECT id, name, code, description FROM products {where}")
+    ).mappings().all()
+    if rows:
+        conn.execute(
+            text(f"UPDATE products SET search_vector = {_VECTOR_SQL} WHERE id = :id"),
+            [_vector_params(row) for row in rows],
+        )
+    return len(rows)
+
+
+class PostgresSearchBackend:
+    """
+    Tìm kiếm bằng cột products.search_vector (tsvector) + GIN index.
+
+    Văn bản được bỏ dấu trong Python trước khi đưa vào to_tsvector nên không
+    cần extension unaccent; cột được cập nhật qua product_events.
+    Request không chạy DDL: chỉ kiểm tra migration đã tạo cột chưa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = False
+        # invalidate() tăng _invalidations; _refreshed chỉ theo kịp sau khi
+        # UPDATE toàn bảng đã commit (lỗi thì request sau thử lại)
+        self._invalidations = 0
+        self._refreshed = 0
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready
+
+    def check_ready(self, engine) -> bool:
+        """Cột search_vector đã có (migration đã chạy); đúng một lần thì nhớ"""
+        if not self._ready:
+            from .migrations import SEARCH_VECTOR_VERSION, current_version
+
+            self._ready = (current_version(engine) or 0) >= SEARCH_VECTOR_VERSION
+        return self._ready
+
+    def refresh_if_needed(self, engine) -> None:
+        """Tính lại toàn bộ vector sau notify_invalidate (route bulk gửi notify_saved)"""
+        if self._refreshed == self._invalidations:
+            return
+        with self._lock:
+            target = self._invalidations
+            if self._refreshed == target:
+                return
+            with engine.begin() as conn:
+                update_search_vectors(conn)
+            self._refreshed = target
+
+    def upsert_products(self, products: Iterable[Any]) -> None:
+        from .co_so_du_lieu import dong_co
+
+        if dong_co.dialect.name != "postgresql" or not self.check_ready(dong_co):
+            return  # Migration sẽ backfill
+        params = [_vector_params(p) for p in products]
+        with dong_co.begin() as conn:
+            conn.execute(
+                text(f"UPDATE products SET search_vector = {_VECTOR_SQL} WHERE id = :id"), params
+            )
+
+    def remove_products(self, ids: Iterable[int]) -> None:
+        pass  # Dòng bị xóa mang theo vector của nó
+
+    def invalidate(self) -> None:
+        self._invalidations += 1
+
+    def search(self, csdl, tokens: List[str], prefix: bool = True) -> List[Tuple[int, float]]:
+        if not tokens:
+            return []
+        # tokens chỉ gồm [a-z0-9] nên ghép tsquery an toàn, vẫn truyền qua bind
+        terms = list(tokens)
+        if prefix:
+            terms[-1] = terms[-1] + ":*"
+        rows = csdl.execute(
+            text(
+                "SELECT id, ts_rank_cd(search_vector, q) AS rank "
+                "FROM products, to_tsquery('simple', :q) AS q "
+                "WHERE search_vector @@ q ORDER BY rank DESC, id DESC"
+            ),
+            {"q": " & ".join(terms)},
+        ).all()
+        return [(row.id, float(row.rank)) for row in rows]
+
+
+# =============================================================================
+# FACADE
+# =============================================================================
+
+
+class ProductSearch:
+    """Chọn backend theo dialect của session: PostgreSQL hoặc bộ nhớ"""
+
+    def __init__(self):
+        self.memory = InMemorySearchIndex()
+        self.postgres = PostgresSearchBackend()
+
+    # Listener product_events: chuyển tiếp cho cả hai backend (backend chưa
+    # được dùng sẽ tự bỏ qua)
+    def upsert_products(self, products: Iterable[Any]) -> None:
+        products = list(products)
+        self.memory.upsert_products(products)
+        self.postgres.upsert_products(products)
+
+    def remove_products(self, ids: Iterable[int]) -> None:
+        ids = list(ids)
+        self.memory.remove_products(ids)
+        self.postgres.remove_products(ids)
+
+    def invalidate(self) -> None:
+        self.memory.invalidate()
+        self.postgres.invalidate()
+
+    def search(self, csdl, query: str, prefix: bool = True) -> List[Tuple[int, float]]:
+        """
+        Tìm kiếm sản phẩm.
+
+        Returns:
+            Danh sách (id sản phẩm, điểm) xếp hạng giảm dần
+        """
+        tokens = tach_tu(query)
+        if not tokens:
+            return []
+
+        bind = csdl.get_bind()
+        if bind.dialect.name == "postgresql" and self.postgres.check_ready(bind):
+            self.postgres.refresh_if_needed(bind)
+            return self.postgres.search(csdl, tokens, prefix)
+
+        self.memory.ensure_loaded(csdl)
+        return self.memory.search(tokens, prefix)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"memory": self.memory.stats(), "postgres_ready": self.postgres.is_ready}
+
+
+# Global search instance
+product_search = product_events.register(ProductSearch())
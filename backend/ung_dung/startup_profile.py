@@ -0,0 +1,156 @@
+"""
+Đo thời gian khởi động cho IVIE Wedding Studio
+- Thời gian import từng module router (tính cả dependency được import lần đầu)
+- Thời gian từng bước khởi tạo (CSDL, index, cache...)
+- Cờ sẵn sàng cho /ready: bước khởi tạo chạy ở thread nền, server nhận
+  request ngay; load balancer chỉ chuyển traffic khi /ready trả 200
+- Bước khởi tạo lỗi hẳn (đã hết lượt thử lại của chính nó): thoát process
+  để supervisor (gunicorn, Render) khởi động lại, không treo ở 503 mãi
+"""
+
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Mốc bắt đầu: module này được import đầu tiên trong app
+_STARTED = time.perf_counter()
+
+StartupStep = Tuple[str, Callable[[], Any]]
+
+
+class StartupProfile:
+    """Ghi thời gian import / khởi tạo và trạng thái sẵn sàng của process"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.imports: List[Dict[str, Any]] = []
+        self.steps: List[Dict[str, Any]] = []
+        self.app_loaded_ms: Optional[float] = None
+        self.ready_ms: Optional[float] = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def _elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    @contextmanager
+    def measure(self, name: str, kind: str = "step") -> Iterator[None]:
+        """Đo một khối code; kind: "import" hoặc "step" """
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            entry = {
+                "name": name,
+                "ms": round((time.perf_counter() - started) * 1000, 1),
+                "at_ms": self._elapsed_ms(),
+            }
+            if error:
+                entry["error"] = error
+            with self._lock:
+                (self.imports if kind == "import" else self.steps).append(entry)
+
+    def import_module(self, name: str, package: Optional[str] = None) -> ModuleType:
+        """importlib.import_module có đo thời gian"""
+        with self.measure(name.lstrip("."), kind="import"):
+            return importlib.import_module(name, package)
+
+    def mark_app_loaded(self) -> None:
+        """App đã tạo xong (import + đăng ký route), server sắp nhận request"""
+        self.app_loaded_ms = self._elapsed_ms()
+        slowest = sorted(self.imports, key=lambda e: e["ms"], reverse=True)[:3]
+        logger.info(
+            f"App loaded in {self.app_loaded_ms}ms; slowest imports: "
+            + ", ".join(f"{e['name']} {e['ms']}ms" for e in slowest)
+        )
+
+    def mark_ready(self) -> None:
+        self.ready_ms = self._elapsed_ms()
+        self._ready.set()
+        logger.info(f"✅ Ready after {self.ready_ms}ms")
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def run_background(
+        self,
+        steps: Sequence[StartupStep],
+        after_ready: Sequence[StartupStep] = (),
+        exit_on_failure: bool = True,
+    ) -> threading.Thread:
+        """
+        Chạy các bước khởi tạo ở thread nền.
+
+        steps: phải xong trước khi sẵn sàng; bước lỗi -> thoát process (mã 1)
+            để supervisor khởi động lại, hoặc chỉ ở trạng thái chưa sẵn sàng
+            (/ready trả 503) nếu exit_on_failure=False
+        after_ready: chạy tiếp sau khi đã sẵn sàng (build index, warm cache...);
+            lỗi chỉ ghi log
+        """
+
+        def run():
+            for name, func in steps:
+                try:
+                    with self.measure(name):
+                        func()
+                except Exception as e:
+                    logger.error(f"❌ Startup step {name} failed: {e}")
+                    if exit_on_failure:
+                        _exit_process()
+                    return
+            self.mark_ready()
+            for name, func in after_ready:
+                try:
+                    with self.measure(name):
+                        func()
+                except Exception as e:
+                    logger.warning(f"⚠️ Startup step {name} failed: {e}")
+
+        thread = threading.Thread(target=run, name="startup", daemon=True)
+        thread.start()
+        return thread
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            imports = list(self.imports)
+            steps = list(self.steps)
+        return {
+            "ready": self.is_ready,
+            "app_loaded_ms": self.app_loaded_ms,
+            "ready_ms": self.ready_ms,
+            "uptime_ms": self._elapsed_ms(),
+            "imports_ms": round(sum(e["ms"] for e in imports), 1),
+            "imports": imports,
+            "steps": steps,
+            "timestamp": datetime.now().isoformat(),
+        }
+
+
+def _exit_process() -> None:
+    # Thread nền không dừng được server bằng exception: thoát hẳn process
+    logger.critical("Startup failed, exiting so the supervisor restarts the process")
+    logging.shutdown()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(1)
+
+
+# Một profile cho mỗi process
+startup_profile = StartupProfile(_STARTED)
@@ -3,7 +3,6 @@ Telegram Bot Integration cho IVIE Wedding Studio
 Gửi thông báo khi có khách hàng mới đăng ký
 """
 import os
-import httpx
 from typing import Optional
 
 # Lấy config từ environment variables
@@ -74,6 +73,9 @@ async def gui_thong_bao_telegram(
     }
     
     try:
+        # Import khi gửi: httpx không nằm trên đường khởi động
+        import httpx
+
         async with httpx.AsyncClient() as client:
             response = await client.post(url, json=payload, timeout=10)
             if response.status_code == 200:
@@ -0,0 +1,44 @@
+"""
+Tiện ích xử lý chuỗi tiếng Việt
+- Bỏ dấu (dùng chung cho slug và tìm kiếm không dấu)
+- Tách từ cho chỉ mục tìm kiếm
+"""
+
+import re
+import unicodedata
+from typing import List
+
+# Quy tắc bỏ dấu: mỗi nhóm ký tự có dấu -> ký tự không dấu
+_NHOM_DAU = {
+    "a": "àáạảãâầấậẩẫăằắặẳẵ",
+    "e": "èéẹẻẽêềếệểễ",
+    "i": "ìíịỉĩ",
+    "o": "òóọỏõôồốộổỗơờớợởỡ",
+    "u": "ùúụủũưừứựửữ",
+    "y": "ỳýỵỷỹ",
+    "d": "đ",
+}
+_BANG_BO_DAU = str.maketrans({ky_tu: goc for goc, nhom in _NHOM_DAU.items() for ky_tu in nhom})
+
+_TU = re.compile(r"[a-z0-9]+")
+
+
+def bo_dau(van_ban: str) -> str:
+    """Chuyển về chữ thường và bỏ dấu tiếng Việt ("Váy Cưới" -> "vay cuoi")"""
+    if not van_ban:
+        return ""
+    return unicodedata.normalize("NFC", van_ban).lower().translate(_BANG_BO_DAU)
+
+
+def tach_tu(van_ban: str) -> List[str]:
+    """Bỏ dấu rồi tách thành các từ chữ/số"""
+    return _TU.findall(bo_dau(van_ban))
+
+
+def tao_slug(tieu_de: str) -> str:
+    """Tạo slug từ tiêu đề"""
+    slug = bo_dau(tieu_de)
+    slug = re.sub(r'[^a-z0-9\s-]', '', slug)
+    slug = re.sub(r'[\s_-]+', '-', slug)
+    slug = slug.strip('-')
+    return slug
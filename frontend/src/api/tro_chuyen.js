@@ -1,6 +1,12 @@
-import api from './khach_hang';
+import api, { API_BASE_URL } from './khach_hang';
 
 export const chatAPI = {
     guiTinNhan: (duLieu, token) => api.post(`/api/chat/gui?token=${token}`, duLieu),
-    layLichSu: (token) => api.get(`/api/chat/lich_su?token=${token}`)
+    // sauId: chỉ lấy tin mới hơn tin cuối đã có
+    layLichSu: (token, sauId) => api.get('/api/chat/lich_su', {
+        params: sauId ? { token, sau_id: sauId } : { token }
+    }),
+    // Realtime: WebSocket, fallback Server-Sent Events
+    urlWebSocket: (token) => `${API_BASE_URL.replace(/^http/, 'ws')}/api/chat/ws?token=${encodeURIComponent(token)}`,
+    urlSuKien: (token) => `${API_BASE_URL}/api/chat/su_kien?token=${encodeURIComponent(token)}`
 };
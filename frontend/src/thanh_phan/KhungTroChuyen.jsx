@@ -9,6 +9,7 @@ const ChatBox = () => {
     const [loading, setLoading] = useState(false);
     const [user, setUser] = useState(null);
     const scrollRef = useRef();
+    const lastIdRef = useRef();
 
     useEffect(() => {
         const savedUser = localStorage.getItem('ivie_user');
@@ -22,15 +23,79 @@ const ChatBox = () => {
         return () => window.removeEventListener('authChange', checkAuth);
     }, []);
 
+    // Gộp tin mới vào danh sách (bỏ trùng theo id, giữ thứ tự)
+    const mergeMessages = (moi) => {
+        if (!moi.length) return;
+        setMessages((cu) => {
+            const daCo = new Set(cu.map((m) => m.id));
+            const them = moi.filter((m) => !daCo.has(m.id));
+            return them.length ? [...cu, ...them] : cu;
+        });
+    };
+
     useEffect(() => {
-        if (isOpen && user) {
-            fetchMessages();
-            const interval = setInterval(fetchMessages, 5000);
-            return () => clearInterval(interval);
-        }
+        if (!isOpen || !user) return;
+        const token = localStorage.getItem('ivie_token');
+        let dong = false;
+        let ws = null;
+        let es = null;
+
+        // Lấy bù các tin sau tin cuối đã có (sau khi mất kết nối / resync)
+        const fetchMissed = async () => {
+            const sauId = lastIdRef.current;
+            try {
+                const res = await chatAPI.layLichSu(token, sauId);
+                mergeMessages(res.data);
+            } catch (error) {
+                console.error("Lỗi lấy tin nhắn:", error);
+            }
+        };
+
+        const handleEvent = (event) => {
+            if (event.type === 'message') mergeMessages([event.message]);
+            else if (event.type === 'resync') fetchMissed();
+        };
+
+        const moSuKien = () => {
+            if (dong || typeof EventSource === 'undefined') return;
+            es = new EventSource(chatAPI.urlSuKien(token));
+            es.addEventListener('message', (e) => handleEvent({ type: 'message', message: JSON.parse(e.data) }));
+            es.addEventListener('resync', fetchMissed);
+            // EventSource tự kết nối lại; lấy bù tin trong lúc mất kết nối
+            es.onopen = fetchMissed;
+        };
+
+        const moWebSocket = () => {
+            let daMo = false;
+            ws = new WebSocket(chatAPI.urlWebSocket(token));
+            ws.onopen = () => {
+                daMo = true;
+                fetchMissed();
+            };
+            ws.onmessage = (e) => handleEvent(JSON.parse(e.data));
+            ws.onclose = () => {
+                if (dong) return;
+                // Không mở được WebSocket (proxy chặn...): chuyển sang SSE
+                if (!daMo) moSuKien();
+                else setTimeout(() => !dong && moWebSocket(), 3000);
+            };
+        };
+
+        fetchMessages().then(() => {
+            if (dong) return;
+            if (typeof WebSocket !== 'undefined') moWebSocket();
+            else moSuKien();
+        });
+
+        return () => {
+            dong = true;
+            if (ws) ws.close();
+            if (es) es.close();
+        };
     }, [isOpen, user]);
 
     useEffect(() => {
+        lastIdRef.current = messages.length ? Math.max(...messages.map((m) => m.id)) : undefined;
         if (scrollRef.current) {
             scrollRef.current.scrollTop = scrollRef.current.scrollHeight;
         }
@@ -56,7 +121,7 @@ const ChatBox = () => {
 
         try {
             const res = await chatAPI.guiTinNhan({ tin_nhan: msgText }, token);
-            setMessages([...messages, res.data]);
+            mergeMessages([res.data]);
         } catch (error) {
             console.error("Lỗi gửi tin nhắn:", error);
         }
@@ -85,8 +150,8 @@ const ChatBox = () => {
                         {messages.length === 0 ? (
                             <p style={{ textAlign: 'center', color: '#999', marginTop: '20px' }}>Gửi tin nhắn để bắt đầu trò chuyện với chúng tôi!</p>
                         ) : (
-                            messages.map((m, idx) => (
-                                <div key={idx} className={`message ${m.is_from_admin ? 'admin' : 'user'}`}>
+                            messages.map((m) => (
+                                <div key={m.id} className={`message ${m.is_from_admin ? 'admin' : 'user'}`}>
                                     <div className="message-content">{m.tin_nhan}</div>
                                 </div>
                             ))
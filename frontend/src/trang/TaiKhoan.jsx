@@ -66,6 +66,9 @@ const TaiKhoan = () => {
             if (!cleanedData.password) delete cleanedData.password;
 
             const res = await nguoiDungAPI.capNhatProfile(cleanedData, token);
+            // Đổi mật khẩu: token cũ hết hiệu lực, server trả token mới
+            const tokenMoi = res.headers['x-access-token'];
+            if (tokenMoi) localStorage.setItem('ivie_token', tokenMoi);
             localStorage.setItem('ivie_user', JSON.stringify(res.data));
             setUser(res.data);
             window.dispatchEvent(new Event('authChange'));